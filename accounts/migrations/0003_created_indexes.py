@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_auto_20210615_0907'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='workspacemodel',
+            index=models.Index(fields=['-created', 'uuid'], name='workspaces_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='accountmodel',
+            index=models.Index(fields=['-created', 'uuid'], name='accounts_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='businessmodel',
+            index=models.Index(fields=['-created', 'uuid'], name='business_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usermodel',
+            index=models.Index(fields=['-created', 'uuid'], name='users_created_idx'),
+        ),
+    ]
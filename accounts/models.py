@@ -27,6 +27,9 @@ class WorkspaceModel(ModelContract):
     class Meta:
         ordering = ['-created', ]
         db_table = 'workspaces'
+        indexes = [
+            models.Index(fields=['-created', 'uuid'], name='workspaces_created_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['name', 'business'], name='unique_name'),
@@ -115,6 +118,9 @@ class AccountModel(ModelContract, PermissionsMixin, AbstractBaseUser):
     class Meta:
         ordering = ['-created', ]
         db_table = 'accounts'
+        indexes = [
+            models.Index(fields=['-created', 'uuid'], name='accounts_created_idx'),
+        ]
         verbose_name = 'Account'
 
     def __str__(self):
@@ -156,6 +162,9 @@ class BusinessModel(ModelContract):
     class Meta:
         ordering = ['-created', ]
         db_table = 'business'
+        indexes = [
+            models.Index(fields=['-created', 'uuid'], name='business_created_idx'),
+        ]
         verbose_name = 'Business'
         verbose_name_plural = 'Businesses'
 
@@ -197,6 +206,9 @@ class UserModel(ModelContract):
     class Meta:
         ordering = ['-created', ]
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['-created', 'uuid'], name='users_created_idx'),
+        ]
         verbose_name = 'User'
 
     def __str__(self):
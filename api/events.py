@@ -0,0 +1,157 @@
+"""
+Server-Sent Events endpoint pushing the incremental events of a stream.
+
+It is a plain ASGI application served next to the django one (see scalade_api/asgi.py),
+so long-lived subscriptions don't hold a django worker thread.
+
+Clients reconnecting with a Last-Event-ID header are first sent the changes they missed,
+read from the change feed of the stream.
+"""
+import asyncio
+import json
+import re
+from http.cookies import SimpleCookie
+from typing import List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings as django_settings
+from django.contrib.auth import get_user
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpRequest
+from django.utils.module_loading import import_string
+
+from common.pubsub import get_pubsub
+from common.utils import ModelManager
+from settings import SCALADE_VERSION, STREAM_EVENTS_KEEPALIVE, STREAM_CHANGES_LIMIT
+from streams.events import stream_channel, wait_for_changes
+
+STREAM_EVENTS_PATH = re.compile(
+    r'^/api/v%s/entities/streams/(?P<uuid>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-'
+    r'[0-9a-f]{4}-[0-9a-f]{12})/events/$' % SCALADE_VERSION[0])
+
+
+def _session_key(scope) -> str:
+    cookie = SimpleCookie()
+    for name, value in scope.get('headers', ()):
+        if name == b'cookie':
+            cookie.load(value.decode('latin-1'))
+    morsel = cookie.get(django_settings.SESSION_COOKIE_NAME)
+    return morsel.value if morsel else None
+
+
+def _last_event_id(scope) -> Optional[int]:
+    for name, value in scope.get('headers', ()):
+        if name == b'last-event-id':
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+def _missed_changes(stream_uuid: str, since: int) -> List[dict]:
+    changes, _ = wait_for_changes(stream_uuid, since, 0, STREAM_CHANGES_LIMIT)
+    return [change.as_dict for change in changes]
+
+
+def _authorize(session_key: str, stream_uuid: str) -> int:
+    """
+    Returns the HTTP status of the subscription for the owner of the session.
+    """
+    request = HttpRequest()
+    session_store = import_string(django_settings.SESSION_ENGINE + '.SessionStore')
+    request.session = session_store(session_key)
+    user = get_user(request)
+    if not user.is_authenticated:
+        return 403
+    if not user.has_perm('streams.view_streammodel'):
+        return 403
+    if not ModelManager.handle('streams.stream', 'filter', uuid=stream_uuid).exists():
+        return 404
+    return 200
+
+
+class StreamEventsApplication:
+    """
+    ASGI application subscribed to the events of a stream on behalf of the client.
+
+    Other requests are handed over to the 'fallback' application.
+    """
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    async def __call__(self, scope, receive, send):
+        match = STREAM_EVENTS_PATH.match(scope['path']) if scope['type'] == 'http' else None
+        if match is None:
+            return await self.fallback(scope, receive, send)
+
+        if scope['method'] != 'GET':
+            return await self._respond(send, 405)
+        status = await sync_to_async(_authorize)(_session_key(scope), match.group('uuid'))
+        if status != 200:
+            return await self._respond(send, status)
+
+        await send({'type': 'http.response.start',
+                    'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'),
+                                (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no')]})
+        subscription = get_pubsub().subscribe(stream_channel(match.group('uuid')))
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            # subscribed first, so that no change is missed between the replay and the
+            # live events, those already replayed are skipped
+            last_seq = _last_event_id(scope)
+            while last_seq is not None:
+                missed = await sync_to_async(_missed_changes)(match.group('uuid'), last_seq)
+                for event in missed:
+                    await self._send_event(send, event)
+                    last_seq = event['seq']
+                if len(missed) < STREAM_CHANGES_LIMIT:
+                    break
+
+            while not disconnected.done():
+                next_event = asyncio.ensure_future(subscription.get())
+                await asyncio.wait([next_event, disconnected],
+                                   timeout=STREAM_EVENTS_KEEPALIVE,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if not next_event.done():
+                    next_event.cancel()
+                    if not disconnected.done():
+                        await self._send(send, b': keep-alive\n\n')
+                    continue
+
+                event = next_event.result()
+                if event.get('seq'):
+                    if last_seq is not None and event['seq'] <= last_seq:
+                        continue
+                    last_seq = event['seq']
+                await self._send_event(send, event)
+        finally:
+            subscription.close()
+            disconnected.cancel()
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    @classmethod
+    async def _send_event(cls, send, event: dict):
+        # changes inserted in bulk have no seq on some databases
+        event_id = f"id: {event['seq']}\n" if event.get('seq') else ''
+        await cls._send(send, (
+            f"{event_id}"
+            f"event: {event['type']}\n"
+            f"data: {json.dumps(event, cls=DjangoJSONEncoder)}\n\n").encode())
+
+    @staticmethod
+    async def _send(send, body: bytes):
+        await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+    @staticmethod
+    async def _respond(send, status: int):
+        await send({'type': 'http.response.start',
+                    'status': status,
+                    'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b''})
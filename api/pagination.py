@@ -0,0 +1,130 @@
+"""
+Keyset pagination and counts of the list endpoints.
+
+Pages are read after (or before) the ordering keys of the row delimiting them, given by an
+opaque cursor, instead of scanning and discarding every earlier row as offsets do. The
+listed models are indexed on their ordering keys, ('-created', 'uuid'), so the database
+reads a page from the index position of the cursor whatever the page depth.
+"""
+import base64
+import binascii
+import json
+from typing import List, NamedTuple, Optional, Tuple
+
+from django.core.exceptions import ValidationError
+from django.db import connections, models
+from rest_framework.exceptions import ParseError
+
+from settings import LIST_COUNT_ESTIMATE_CAP
+
+COUNT_MODES = ('exact', 'estimated', 'none')
+
+
+class Cursor(NamedTuple):
+    """
+    Position of a page: the ordering keys of a row and whether the page precedes it.
+    """
+    values: Tuple
+    reverse: bool = False
+
+    def encode(self) -> str:
+        token = json.dumps([list(self.values), self.reverse], separators=(',', ':'))
+        return base64.urlsafe_b64encode(token.encode()).decode().rstrip('=')
+
+    @classmethod
+    def decode(cls, token: str, fields: List[models.Field]) -> 'Cursor':
+        try:
+            values, reverse = json.loads(
+                base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            if len(values) != len(fields):
+                raise ValueError
+            return cls(tuple(field.to_python(value) for field, value in zip(fields, values)),
+                       bool(reverse))
+        except (binascii.Error, TypeError, ValueError, ValidationError):
+            raise ParseError(detail=f"Invalid cursor: '{token}'.")
+
+
+def ordering_keys(model) -> List[Tuple[str, bool]]:
+    """
+    Returns the (field, descending) keys of the model ordering, the primary key is appended
+    to make them unique.
+    """
+    keys = [(name.lstrip('-'), name.startswith('-')) for name in model._meta.ordering]
+    if model._meta.pk.name not in [name for name, _ in keys]:
+        keys.append((model._meta.pk.name, False))
+    return keys
+
+
+def keyset_page(queryset: models.QuerySet, limit: int,
+                token: Optional[str] = None) -> Tuple[List, Optional[str], Optional[str]]:
+    """
+    Returns the page of the queryset at the cursor, the first one when there is no cursor,
+    with the cursors of the next and previous pages, None when there are no more rows.
+    """
+    keys = ordering_keys(queryset.model)
+    fields = [queryset.model._meta.get_field(name) for name, _ in keys]
+    cursor = Cursor.decode(token, fields) if token else None
+    reverse = bool(cursor and cursor.reverse)
+
+    # previous pages are read backwards from the cursor, then put back in order
+    queryset = queryset.order_by(*[('-' if descending != reverse else '') + name
+                                   for name, descending in keys])
+    if cursor:
+        queryset = queryset.filter(_after(keys, cursor.values, reverse))
+    items = list(queryset[:limit + 1])
+    has_more = len(items) > limit
+    items = items[:limit]
+    if reverse:
+        items.reverse()
+
+    def cursor_of(item, reverse_: bool) -> str:
+        return Cursor(tuple(field.value_to_string(item) for field in fields), reverse_).encode()
+
+    has_next, has_prev = has_more, cursor is not None
+    if reverse:
+        has_next, has_prev = has_prev, has_next
+    return (items,
+            cursor_of(items[-1], False) if items and has_next else None,
+            cursor_of(items[0], True) if items and has_prev else None)
+
+
+def _after(keys: List[Tuple[str, bool]], values: Tuple, reverse: bool) -> models.Q:
+    # rows sorted after the values: (a > x) OR (a = x AND b > y) OR ...
+    condition, equal = models.Q(), models.Q()
+    for (name, descending), value in zip(keys, values):
+        lookup = 'lt' if descending != reverse else 'gt'
+        condition |= equal & models.Q(**{f'{name}__{lookup}': value})
+        equal &= models.Q(**{name: value})
+    # the redundant bound on the first key is the index condition the database starts
+    # the scan from, the OR alone is only a filter of the rows read from the top
+    (name, descending), value = keys[0], values[0]
+    lookup = 'lte' if descending != reverse else 'gte'
+    return models.Q(**{f'{name}__{lookup}': value}) & condition
+
+
+def count_rows(queryset: models.QuerySet, mode: str) -> Optional[int]:
+    """
+    Counts the rows of the queryset: 'exact' runs a COUNT(*), 'estimated' reads the row
+    estimate of the query plan on PostgreSQL, elsewhere it counts up to
+    LIST_COUNT_ESTIMATE_CAP rows, and 'none' doesn't count at all.
+    """
+    if mode not in COUNT_MODES:
+        raise ParseError(detail=f"Invalid count mode: '{mode}', valid ones are {COUNT_MODES}.")
+    if mode == 'none':
+        return None
+    if mode == 'exact':
+        return queryset.count()
+
+    queryset = queryset.order_by()
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset[:LIST_COUNT_ESTIMATE_CAP].count()
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    # the driver may have decoded the json column already
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
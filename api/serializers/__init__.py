@@ -1 +1 @@
-from .mixins import BaseSerializer, ListItemsWithURLSerializer
+from .mixins import BaseSerializer, ListItemsWithURLSerializer, SparseFieldsetMixin
@@ -1,7 +1,7 @@
 from django.core.exceptions import ObjectDoesNotExist
 from rest_framework import serializers
 
-from api.serializers import BaseSerializer, ListItemsWithURLSerializer
+from api.serializers import BaseSerializer, ListItemsWithURLSerializer, SparseFieldsetMixin
 from accounts.models import WorkspaceModel, AccountModel, BusinessModel, UserModel
 from common.utils import ModelManager
 
@@ -40,7 +40,7 @@ class WorkspaceCreationSerializer(BaseSerializer):
         return business
 
 
-class WorkspaceSerializer(serializers.ModelSerializer):
+class WorkspaceSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = WorkspaceModel
         fields = '__all__'
@@ -55,7 +55,7 @@ class WorkspaceListSerializer(ListItemsWithURLSerializer):
         fields = ['name', 'business', 'url']
 
 
-class AccountSerializer(serializers.ModelSerializer):
+class AccountSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = AccountModel
         exclude = ['password', ]
@@ -70,7 +70,7 @@ class AccountListSerializer(ListItemsWithURLSerializer):
         fields = ['uuid', 'created', 'auth_id', 'username', 'email', 'url']
 
 
-class BusinessSerializer(serializers.ModelSerializer):
+class BusinessSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = BusinessModel
         fields = '__all__'
@@ -100,7 +100,7 @@ class BusinessListSerializer(ListItemsWithURLSerializer):
         fields = ['uuid', 'organization_name', 'url']
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = UserModel
         fields = '__all__'
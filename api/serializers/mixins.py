@@ -1,10 +1,49 @@
+from typing import List
+
 from django.core.exceptions import ObjectDoesNotExist
 from rest_framework import serializers
+from rest_framework.exceptions import ParseError
 from rest_framework.reverse import reverse
 
 from common.utils import ModelManager
 
 
+class SparseFieldsetMixin:
+    """
+    Model serializer rendering a sparse fieldset of its fields.
+
+    'fields' keeps only the given fields and 'omit' drops the given ones. The heavy fields
+    of Meta.expandable_fields are left out unless named in the 'expand' set of the context,
+    which is shared with the nested serializers. Fields reading other columns than their
+    source declare them in Meta.field_columns.
+    """
+    def __init__(self, *args, fields=None, omit=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        unknown = (set(fields or ()) | set(omit or ())) - set(self.fields)
+        if unknown:
+            raise ParseError(detail=f'Unknown fields: {sorted(unknown)}.')
+
+        expand = self.context.get('expand') or ()
+        expandable = getattr(self.Meta, 'expandable_fields', ())
+        for name in list(self.fields):
+            if ((fields and name not in fields) or (omit and name in omit)
+                    or (name in expandable and name not in expand)):
+                self.fields.pop(name)
+
+    def columns(self) -> List[str]:
+        """
+        Returns the model columns read by the fields rendered, to load them only.
+        """
+        meta = self.Meta.model._meta
+        concrete = {field.name for field in meta.concrete_fields}
+        field_columns = getattr(self.Meta, 'field_columns', {})
+        columns = {meta.pk.name}
+        for name, field in self.fields.items():
+            sources = field_columns.get(name, [field.source.split('.')[0]])
+            columns.update(column for column in sources if column in concrete)
+        return sorted(columns)
+
+
 class BaseSerializer(serializers.Serializer):
     def create(self, validated_data):
         pass
@@ -13,7 +52,7 @@ class BaseSerializer(serializers.Serializer):
         pass
 
 
-class ListItemsWithURLSerializer(serializers.ModelSerializer):
+class ListItemsWithURLSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     url_basename: str = None
 
     def __init__(self, *args, **kwargs):
@@ -1,15 +1,19 @@
+from base64 import b64encode
 import json
 
 from django.core.exceptions import ObjectDoesNotExist
 from rest_framework import serializers
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.reverse import reverse
 from scaladecore.config import InputConfig
+from scaladecore.entities import StreamEntity
 from scaladecore.utils import ID_NAME_REGEX, decode_b64str
 
-from api.serializers import BaseSerializer, ListItemsWithURLSerializer
+from api.serializers import BaseSerializer, ListItemsWithURLSerializer, SparseFieldsetMixin
 from streams.models import StreamModel, FunctionTypeModel, FunctionInstanceModel, VariableModel, \
     FunctionInstanceLogMessageModel
 from common.utils import ModelManager, validate_b64_encoded
+from settings import STREAMS_BULK_CANCEL_MAX_UUIDS
 
 
 class JSONStringField(serializers.Field):
@@ -92,7 +96,7 @@ class FunctionTypeCreationSerializer(BaseSerializer):
         return attrs
 
 
-class FunctionTypeSerializer(serializers.ModelSerializer):
+class FunctionTypeSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     Function type detail serializer.
     """
@@ -164,13 +168,28 @@ class VariableCreationSerializer(BaseSerializer):
         return attrs
 
 
-class VariableSerializer(serializers.ModelSerializer):
+class VariableSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     VariableModel detail serializer.
+
+    The payload is linked by 'body_url', it is only inlined in base64 when 'bytes' is
+    expanded.
     """
+    bytes = serializers.SerializerMethodField()
+    body_url = serializers.SerializerMethodField()
+
     class Meta:
         model = VariableModel
-        fields = '__all__'
+        exclude = ['blob_ref', ]
+        expandable_fields = ['bytes', ]
+        field_columns = {'bytes': ['bytes', 'blob_ref', 'codec']}
+
+    def get_bytes(self, obj):
+        return b64encode(obj.read_bytes()).decode('ascii')
+
+    def get_body_url(self, obj):
+        return reverse('entities-api:variables-body', args=[obj.uuid],
+                       request=self.context.get('request'))
 
 
 class VariableListSerializer(ListItemsWithURLSerializer):
@@ -230,7 +249,7 @@ class FunctionInstanceCreationSerializer(BaseSerializer):
         return json.dumps(position)
 
 
-class FunctionInstanceSerializer(serializers.ModelSerializer):
+class FunctionInstanceSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     Function instance with related variables serializer.
     """
@@ -249,8 +268,14 @@ class FunctionInstanceSerializer(serializers.ModelSerializer):
         return self._serialize_io_variables(obj, 'output')
 
     def _serialize_io_variables(self, obj, iot: str):
-        variables = obj.variables.filter(iot=iot)
-        serializer = VariableSerializer(variables, many=True)
+        # variables prefetched along the stream detail are already ordered by rank
+        variables = getattr(obj, 'context_variables', None)
+        if variables is None:
+            columns = VariableSerializer(context=self.context).columns()
+            variables = obj.variables.filter(iot=iot).only(*columns).order_by('rank')
+        else:
+            variables = [var_ for var_ in variables if var_.iot == iot]
+        serializer = VariableSerializer(variables, many=True, context=self.context)
         return serializer.data
 
 
@@ -317,9 +342,31 @@ class StreamCreationSerializer(BaseSerializer):
         return attrs['spec']
 
 
-class StreamSerializer(serializers.ModelSerializer):
+class StreamBulkCancelSerializer(BaseSerializer):
+    """
+    Selection of the streams to cancel, given selectors are combined.
+    """
+    uuids = serializers.ListField(child=serializers.UUIDField(), required=False,
+                                  allow_empty=False, max_length=STREAMS_BULK_CANCEL_MAX_UUIDS)
+    workspace = serializers.CharField(max_length=50, required=False)
+    status__in = serializers.ListField(
+        child=serializers.ChoiceField(choices=[status for status, _ in StreamEntity.STATUS]),
+        required=False, allow_empty=False)
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError(
+                "at least one of 'uuids', 'workspace' or 'status__in' is required.")
+        return attrs
+
+
+class StreamSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     StreamModel detail serializer.
+
+    Streams loaded by StreamModel.objects.get_detail or prefetch_detail are serialized
+    without further queries, their variables come ordered by rank. The payloads of the
+    variables are only rendered when 'bytes' is expanded.
     """
     functions = serializers.SerializerMethodField()
 
@@ -328,22 +375,19 @@ class StreamSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
     def get_functions(self, obj):
-        serializer = FunctionInstanceSerializer(obj.functions.all(), many=True)
+        serializer = FunctionInstanceSerializer(obj.functions.all(), many=True,
+                                                context=self.context)
         return serializer.data
 
     @property
     def data(self):
         sd = super().data
-        for fc in sd['functions']:
-            inputs_ = fc['inputs']
-            for ipt in inputs_:
+        for fc in sd.get('functions', []):
+            for ipt in fc['inputs']:
                 ipt['__rank__'] = ipt.pop('rank')
-            inputs_.sort(key=lambda x: x['__rank__'])
 
-            outputs_ = fc['outputs']
-            for ipt in outputs_:
+            for ipt in fc['outputs']:
                 ipt['__rank__'] = ipt.pop('rank')
-            outputs_.sort(key=lambda x: x['__rank__'])
 
         return sd
 
@@ -358,10 +402,13 @@ class StreamListSerializer(ListItemsWithURLSerializer):
 
     class Meta:
         model = StreamModel
-        fields = ['uuid', 'name', 'updated', 'status', 'account', 'url']
+        fields = ['uuid', 'name', 'updated', 'status', 'finished', 'pending_functions',
+                  'running_functions', 'blocked_functions', 'canceled_functions',
+                  'completed_functions', 'account', 'url']
+        field_columns = {'account': ['account']}
 
     def get_account(self, obj):
-        return obj.account.uuid
+        return obj.account_id
 
 
 class FunctionInstanceLogMessageSerializer(serializers.ModelSerializer):
@@ -2,8 +2,8 @@ from django.urls import path, include, re_path
 from rest_framework import routers
 from .views.accounts import WorkspaceViewSet, AccountViewSet, BusinessViewSetMixin, UserViewSetMixin
 from .views.auth import SignUpView, SignInView, SignOutView, ResetPasswordView
-from .views.runtime import RetrieveFIContext, CreateFILogMessage, UpdateFIStatus, \
-    CreateFIOutput
+from .views.runtime import RetrieveFIContext, CreateFILogMessage, CreateFILogMessageBatch, \
+    StreamFILogs, UpdateFIStatus, CreateFIOutput, RuntimeStats
 from .views.streams import StreamViewSet, FunctionTypeViewSet, FunctionInstanceViewSet, \
     VariableViewSet
 
@@ -45,8 +45,11 @@ runtime_api_patterns = [
     # fi stands for FunctionInstance
     path(r'runtime/retrieve-fi-context/', RetrieveFIContext.as_view()),
     path(r'runtime/create-fi-log-message/', CreateFILogMessage.as_view()),
+    path(r'runtime/create-fi-log-message-batch/', CreateFILogMessageBatch.as_view()),
+    path(r'runtime/stream-fi-logs/', StreamFILogs.as_view()),
     path(r'runtime/update-fi-status/', UpdateFIStatus.as_view()),
     path(r'runtime/create-fi-output/', CreateFIOutput.as_view()),
+    path(r'runtime/stats/', RuntimeStats.as_view()),
 ]
 
 urlpatterns = entities_api_patterns + auth_api_patterns + runtime_api_patterns
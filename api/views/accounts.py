@@ -8,6 +8,7 @@ from api.serializers.accounts import WorkspaceCreationSerializer, WorkspaceSeria
     BusinessListSerializer, UserSerializer, UserListSerializer
 from common.utils import ModelManager
 from common.utils import DecoratorShipper as Decorators
+from api.pagination import ordering_keys
 from api.views import BaseAPIViewSet
 from api.views.mixins import ReadOnlyWithNoFiltersViewSetMixin, ListViewSetMixin, \
     RetrieveViewSetMixin
@@ -57,7 +58,7 @@ class AccountViewSet(RetrieveViewSetMixin, BaseAPIViewSet):
         initial_queryset = None
         for key, value in request.query_params.items():
             self.check_filter(key)
-            if key not in ['limit', 'offset']:
+            if key not in self.control_params:
                 if key in ['is_staff', 'is_active']:
                     filters[key] = True if value == 'true' else False
                 elif key == 'related_to_workspace':
@@ -73,7 +74,7 @@ class AccountViewSet(RetrieveViewSetMixin, BaseAPIViewSet):
                             "Workspace '%s' doesn't exist." % workspace_uuid)
                     initial_queryset = workspace.accountmodel_set.all()
 
-        if initial_queryset:
+        if initial_queryset is not None:
             accounts = initial_queryset.filter(**filters)
         else:
             accounts = ModelManager.handle(
@@ -81,15 +82,23 @@ class AccountViewSet(RetrieveViewSetMixin, BaseAPIViewSet):
                 'filter',
                 **filters, )
 
-        items, metadata = self.filter_paginated_results(request, accounts)
         list_serializer = AccountListSerializer(
-            items, many=True, request=request)
+            many=True, request=request, **self.get_fieldset(request))
+        accounts = accounts.only(*list_serializer.child.columns(), *[
+            name for name, _ in ordering_keys(accounts.model)])
+        try:
+            items, metadata = self.filter_paginated_results(request, accounts)
+        except ValueError:
+            self.raise_invalid_filters_error()
+        total_queryset, count_metadata = self.count_results(request, accounts)
+        list_serializer.instance = items
         response_data = {
-            'total_queryset': len(accounts),
+            'total_queryset': total_queryset,
             'count': len(items),
             'data': list_serializer.data,
             'metadata': {
                 **metadata,
+                **count_metadata,
                 **{'valid_filters': self.VALID_FILTERS}
             }
         }
@@ -1,4 +1,4 @@
-from typing import Type, Tuple
+from typing import Optional, Type, Tuple
 from django.core.exceptions import ObjectDoesNotExist
 from rest_framework.exceptions import NotFound, ParseError
 from rest_framework.response import Response
@@ -7,7 +7,9 @@ from rest_framework import viewsets
 from rest_framework import serializers
 
 from api.exceptions import MethodNotAllowed
+from api.pagination import count_rows, keyset_page, ordering_keys
 from common.utils import ModelManager
+from settings import LIST_COUNT_DEFAULT_MODE
 
 
 class UUIDLookupMixin:
@@ -35,11 +37,47 @@ class BaseAPIViewSet(viewsets.ViewSet):
 class BaseAPIViewSetSetMixin(UUIDLookupMixin):
     app_model_name: str = None
     VALID_FILTERS: Tuple = None
-    PAGINATION_FILTERS = ('limit', 'offset')
+    PAGINATION_FILTERS = ('limit', 'offset', 'cursor', 'count')
+    FIELDSET_FILTERS = ('fields', 'omit', 'expand')
+
+    @property
+    def control_params(self) -> Tuple:
+        """
+        Query params shaping the response, the other ones are filters.
+        """
+        return self.PAGINATION_FILTERS + self.FIELDSET_FILTERS
+
+    def get_fieldset(self, request) -> dict:
+        """
+        Returns the serializer arguments of the sparse fieldset given by the 'fields',
+        'omit' and 'expand' query params, as comma separated field names.
+        """
+        names = {param: set(request.query_params[param].split(','))
+                 for param in self.FIELDSET_FILTERS if request.query_params.get(param)}
+        return {'fields': names.get('fields'),
+                'omit': names.get('omit'),
+                'context': {'expand': names.get('expand', set()),
+                            'request': request}}
 
     def filter_paginated_results(self, request, queryset):
-        limit, offset = (int(request.query_params.get(self.PAGINATION_FILTERS[0], 10)),
-                         int(request.query_params.get(self.PAGINATION_FILTERS[1], 0)))
+        """
+        Slices a page of the queryset by 'limit' and 'offset', or by keyset when the
+        'cursor' query param is given, empty for the first page.
+        """
+        limit = int(request.query_params.get(self.PAGINATION_FILTERS[0], 10))
+        if self.PAGINATION_FILTERS[2] in request.query_params:
+            cursor = request.query_params[self.PAGINATION_FILTERS[2]]
+            items, next_cursor, prev_cursor = keyset_page(queryset, limit, cursor)
+            return items, {
+                'pagination': {
+                    'limit': limit,
+                    'cursor': cursor,
+                    'next': next_cursor,
+                    'prev': prev_cursor
+                }
+            }
+
+        offset = int(request.query_params.get(self.PAGINATION_FILTERS[1], 0))
         items = queryset[offset:(offset+limit)]
         pagination_metadata = {
             'pagination': {
@@ -49,30 +87,44 @@ class BaseAPIViewSetSetMixin(UUIDLookupMixin):
         }
         return items, pagination_metadata
 
-    def apply_list_filters(self, request) -> Tuple:
+    def count_results(self, request, queryset) -> Tuple[Optional[int], dict]:
+        """
+        Counts the queryset in the mode of the 'count' query param, echoed in the metadata.
+        """
+        mode = request.query_params.get(self.PAGINATION_FILTERS[3], LIST_COUNT_DEFAULT_MODE)
+        return count_rows(queryset, mode), {'count': mode}
+
+    def apply_list_filters(self, request, serializer=None) -> Tuple:
         filters = self.build_filters(request)
         try:
             queryset = ModelManager.handle(
                 self.app_model_name,
                 'filter',
                 **filters, )
+            if serializer is not None:
+                # the ordering keys are loaded as well for the pagination cursors
+                queryset = queryset.only(*serializer.columns(), *[
+                    name for name, _ in ordering_keys(queryset.model)])
             items, metadata = self.filter_paginated_results(request, queryset)
+            total_queryset, count_metadata = self.count_results(request, queryset)
+        except ParseError:
+            raise
         except:
             self.raise_invalid_filters_error()
 
-        metadata = dict(**metadata, **{'valid_filters': self.VALID_FILTERS})
-        return len(queryset), items, metadata
+        metadata = dict(**metadata, **count_metadata, **{'valid_filters': self.VALID_FILTERS})
+        return total_queryset, items, metadata
 
     def build_filters(self, request) -> dict:
         filters = {}
         for key, value in request.query_params.items():
             self.check_filter(key)
-            if key not in ['limit', 'offset']:
+            if key not in self.control_params:
                 filters[key] = value
         return filters
 
     def check_filter(self, filter):
-        if filter not in self.PAGINATION_FILTERS and filter not in self.VALID_FILTERS:
+        if filter not in self.control_params and filter not in self.VALID_FILTERS:
             self.raise_invalid_filters_error()
 
     def raise_invalid_filters_error(self):
@@ -87,9 +139,11 @@ class ListViewSetMixin(BaseAPIViewSetSetMixin):
     ListSerializer: Type[serializers.Serializer] = None
 
     def list(self, request):
-        total_queryset, items, metadata = self.apply_list_filters(request)
         list_serializer = self.ListSerializer(
-            items, many=True, request=request)
+            many=True, request=request, **self.get_fieldset(request))
+        total_queryset, items, metadata = self.apply_list_filters(
+            request, list_serializer.child)
+        list_serializer.instance = items
         response_data = {
             'total_queryset': total_queryset,
             'count': len(items),
@@ -109,18 +163,24 @@ class RetrieveViewSetMixin(BaseAPIViewSetSetMixin):
     RetrieveSerializer: Type[serializers.Serializer] = None
 
     def retrieve(self, request, uuid=None):
+        serializer = self.RetrieveSerializer(**self.get_fieldset(request))
         try:
-            resource = ModelManager.handle(
-                self.app_model_name, 'get', uuid=uuid)
+            serializer.instance = self.get_resource(uuid, serializer)
         except ObjectDoesNotExist:
             raise NotFound(
                 detail=f"resource identifier: '{uuid}' doesn't exist.")
 
-        serializer = self.RetrieveSerializer(resource)
         return Response(
             serializer.data,
             status=HTTP_200_OK)
 
+    def get_resource(self, uuid, serializer):
+        """
+        Gets the resource to retrieve, loading only the columns the serializer reads.
+        """
+        return ModelManager.handle(
+            self.app_model_name, 'only', *serializer.columns()).get(uuid=uuid)
+
 
 class ReadOnlyWithNoFiltersViewSetMixin(ListViewSetMixin, RetrieveViewSetMixin):
     """
@@ -1,17 +1,29 @@
 import pickle
 
-from rest_framework.permissions import AllowAny
-from rest_framework.status import HTTP_200_OK, HTTP_409_CONFLICT, HTTP_500_INTERNAL_SERVER_ERROR
+from django.db import transaction
+
+from rest_framework.exceptions import ParseError
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.status import HTTP_200_OK, HTTP_409_CONFLICT, HTTP_411_LENGTH_REQUIRED, \
+    HTTP_500_INTERNAL_SERVER_ERROR
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from scaladecore.entities import FunctionInstanceEntity
 from scaladecore.utils import decode_b64str
 
 from api.serializers.runtime import UpdateFIStatusSerializer, CreateFIOutputSerializer, \
     CreateFILogMessageSerializer
+from common.codecs import CODEC_STATS
 from common.exceptions import InconsistentStateChangeError
 from common.utils import DecoratorShipper as Decorators
-from common.utils import ModelManager
-from streams.models import VariableModel
+from common.utils import ModelManager, RUNTIME_TOKEN_CACHE, get_body_stream, iter_batches, \
+    iter_ndjson
+from settings import RUNTIME_LOG_BATCH_MAX_SIZE, RUNTIME_LOG_STREAM_BATCH_SIZE, \
+    RUNTIME_LOG_STREAM_MAX_LINE_SIZE, RUNTIME_LOG_STREAM_MAX_ERRORS
+from streams.application.handlers import PushedStreamHandler
+from streams.application.scheduler import DISPATCH_LATENCY
+from streams.events import publish_fi_status, publish_fi_log_messages, publish_fi_output
+from streams.models import VariableModel, FunctionInstanceLogMessageModel
 
 
 def _query_serialized_function_variables(function_instance, iot):
@@ -19,7 +31,7 @@ def _query_serialized_function_variables(function_instance, iot):
         'streams.variable',
         'filter',
         function_instance=function_instance,
-        iot=iot)
+        iot=iot).order_by('rank')
     return [var_.to_entity.as_dict for var_ in variables]
 
 
@@ -31,12 +43,18 @@ class RetrieveFIContext(APIView):
 
     @Decorators.extract_fi_from_token
     def get(self, request):
-        inputs = _query_serialized_function_variables(request.fi, 'input')
-        outputs = _query_serialized_function_variables(request.fi, 'output')
+        fi = ModelManager.handle(
+            'streams.functioninstance',
+            'get_context',
+            uuid=request.fi.uuid)
+        variables = {'input': [], 'output': []}
+        for var_ in fi.context_variables:
+            variables[var_.iot].append(var_.to_entity.as_dict)
+
         return Response(
-            data={'function_instance': request.fi.to_entity.as_dict,
-                  'inputs': inputs,
-                  'outputs': outputs},
+            data={'function_instance': fi.to_entity.as_dict,
+                  'inputs': variables['input'],
+                  'outputs': variables['output']},
             status=HTTP_200_OK)
 
 
@@ -50,19 +68,97 @@ class CreateFILogMessage(APIView):
     def post(self, request):
         serializer = CreateFILogMessageSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        fi_log_message = ModelManager.handle(
-            'streams.FunctionInstanceLogMessage',
-            'create',
-            function_instance=request.fi,
-            log_message=serializer.validated_data['log_message'],
-            log_level=serializer.validated_data['log_level'], )
-
-        # TODO: Send changes trough a socket to application client
+        with transaction.atomic():
+            fi_log_message = ModelManager.handle(
+                'streams.FunctionInstanceLogMessage',
+                'create',
+                function_instance=request.fi,
+                log_message=serializer.validated_data['log_message'],
+                log_level=serializer.validated_data['log_level'], )
+            publish_fi_log_messages(request.fi, [fi_log_message])
 
         return Response(data={'fi_log_message': fi_log_message.uuid},
                         status=HTTP_200_OK)
 
 
+class CreateFILogMessageBatch(APIView):
+    """
+    Creates a batch of log messages related to the underlying FunctionInstance.
+
+    The request body is an array of log message entries, all of them are inserted at once.
+    """
+    permission_classes = [AllowAny]
+
+    @Decorators.extract_fi_from_token
+    def post(self, request):
+        if not isinstance(request.data, list):
+            raise ParseError(detail='Expected an array of log messages.')
+        if len(request.data) > RUNTIME_LOG_BATCH_MAX_SIZE:
+            raise ParseError(
+                detail=f'Too many log messages: the maximum batch size is '
+                       f'{RUNTIME_LOG_BATCH_MAX_SIZE}.')
+
+        serializer = CreateFILogMessageSerializer(data=request.data, many=True,
+                                                  allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            fi_log_messages = FunctionInstanceLogMessageModel.create_batch(
+                request.fi, serializer.validated_data)
+            publish_fi_log_messages(request.fi, fi_log_messages)
+
+        return Response(data={'fi_log_messages': [lm.uuid for lm in fi_log_messages]},
+                        status=HTTP_200_OK)
+
+
+class StreamFILogs(APIView):
+    """
+    Streams log messages related to the underlying FunctionInstance.
+
+    The request body is newline-delimited JSON, one log message per line. It is parsed
+    incrementally and flushed to the database in bounded batches, so a chunked upload can
+    be kept open while the function runs. That requires a WSGI server dechunking the
+    input, e.g. gunicorn, ASGI requests are only handled once fully received.
+    """
+    permission_classes = [AllowAny]
+
+    @Decorators.extract_fi_from_token
+    def post(self, request):
+        body = get_body_stream(request._request)
+        if body is None:
+            return Response(
+                data={'error': 'A Content-Length is required, the server does not support '
+                               'chunked uploads.'},
+                status=HTTP_411_LENGTH_REQUIRED)
+
+        created, rejected, errors = 0, 0, []
+        records = iter_ndjson(body, RUNTIME_LOG_STREAM_MAX_LINE_SIZE)
+        for batch in iter_batches(records, RUNTIME_LOG_STREAM_BATCH_SIZE):
+            entries = []
+            for line_number, record, error in batch:
+                if record is not None:
+                    serializer = CreateFILogMessageSerializer(data=record)
+                    if serializer.is_valid():
+                        entries.append(serializer.validated_data)
+                        continue
+                    error = serializer.errors
+
+                rejected += 1
+                if len(errors) < RUNTIME_LOG_STREAM_MAX_ERRORS:
+                    errors.append({'line': line_number, 'error': error})
+
+            if entries:
+                with transaction.atomic():
+                    fi_log_messages = FunctionInstanceLogMessageModel.create_batch(
+                        request.fi, entries)
+                    publish_fi_log_messages(request.fi, fi_log_messages)
+                created += len(fi_log_messages)
+
+        return Response(data={'created': created,
+                              'rejected': rejected,
+                              'errors': errors},
+                        status=HTTP_200_OK)
+
+
 class UpdateFIStatus(APIView):
     """
     Updates the status of the underlying FunctionInstance.
@@ -74,7 +170,11 @@ class UpdateFIStatus(APIView):
         serializer = UpdateFIStatusSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         try:
-            request.fi.update_status(serializer.validated_data['status_method'])
+            with transaction.atomic():
+                request.fi.update_status(serializer.validated_data['status_method'])
+                publish_fi_status(request.fi)
+                if request.fi.status == FunctionInstanceEntity.STATUS[-1][0]:
+                    transaction.on_commit(lambda: PushedStreamHandler.release(request.fi))
         except InconsistentStateChangeError as exc:
             return Response(
                 data={'error': 'Conflict with the current resource state. ' + str(exc)},
@@ -82,7 +182,6 @@ class UpdateFIStatus(APIView):
 
         # TODO: Maybe reduce body length: no need to re-serialize the function instance ?
         #       return only success or fail (consider also the 'updated' field).
-        # TODO: Send changes trough a socket to application client
 
         return Response(
             data={'function_instance': request.fi.to_entity.as_dict},
@@ -92,6 +191,9 @@ class UpdateFIStatus(APIView):
 class CreateFIOutput(APIView):
     """
     Creates a new output Variable related to the underlying FunctionInstance.
+
+    Only the created output is returned, unless 'all_outputs=true' is given as
+    query parameter to get every output of the FunctionInstance.
     """
     permission_classes = [AllowAny]
 
@@ -102,22 +204,40 @@ class CreateFIOutput(APIView):
         try:
             decoded_variable = pickle.loads(
                 decode_b64str(serializer.validated_data['output']))
-        except Exception as err:
+        except Exception:
             # TODO: Log that exception
             return Response(
                 data={'error': 'A server error occurred while decoding base64 string.'},
                 status=HTTP_500_INTERNAL_SERVER_ERROR)
-        _, err_msg = VariableModel.create_output(
-            fi_uuid=request.fi.uuid,
-            output=decoded_variable)
+        with transaction.atomic():
+            variable, err_msg = VariableModel.create_output(
+                fi_uuid=request.fi.uuid,
+                output=decoded_variable)
+            if not err_msg:
+                publish_fi_output(request.fi, variable)
         if err_msg:
             return Response(
                 data={'error': err_msg},
                 status=HTTP_409_CONFLICT)
 
-        # TODO: Send changes trough a socket to application client
-
-        outputs = _query_serialized_function_variables(request.fi, 'output')
+        if request.query_params.get('all_outputs') == 'true':
+            outputs = _query_serialized_function_variables(request.fi, 'output')
+        else:
+            outputs = [variable.to_entity.as_dict]
         return Response(
             data={'outputs': outputs},
             status=HTTP_200_OK)
+
+
+class RuntimeStats(APIView):
+    """
+    Returns the counters of the runtime token cache, of the variables compression and of
+    the dispatch latency of the process serving the request.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(data={'token_cache': RUNTIME_TOKEN_CACHE.stats,
+                              'codecs': CODEC_STATS.snapshot(),
+                              'dispatch_latency': DISPATCH_LATENCY.stats},
+                        status=HTTP_200_OK)
@@ -1,21 +1,35 @@
-from typing import List, Dict
+from datetime import timedelta
+from typing import List, Dict, Tuple
 
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, \
+    StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags, quote_etag
+from rest_framework.decorators import action
 from rest_framework.exceptions import NotFound, ParseError
 from rest_framework.response import Response
-from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED
+from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_206_PARTIAL_CONTENT, \
+    HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
 from scaladecore.utils import decode_b64str
 
 from api.serializers.streams import FunctionTypeCreationSerializer, FunctionTypeListSerializer, \
     FunctionTypeSerializer, StreamCreationSerializer, StreamSerializer, StreamListSerializer, \
     FunctionInstanceCreationSerializer, FunctionInstanceSerializer, FunctionInstanceListSerializer, \
-    VariableCreationSerializer, VariableSerializer, VariableListSerializer
+    VariableCreationSerializer, VariableSerializer, VariableListSerializer, StreamBulkCancelSerializer
 
 from api.views import BaseAPIViewSet
 from api.views.mixins import ListViewSetMixin, RetrieveViewSetMixin
-from common.utils import ModelManager, validate_b64_encoded
+from common.codecs import accepted_content_encoding
+from common.utils import ModelManager, validate_b64_encoded, parse_byte_range, iter_file_range
 from common.utils import DecoratorShipper as Decorators
-from streams.models import FunctionInstanceModel
+from settings import STREAM_CHANGES_TIMEOUT, STREAM_CHANGES_MAX_TIMEOUT, STREAM_CHANGES_LIMIT
+from streams.events import publish_streams_cancelled, wait_for_changes
+from streams.models import FunctionInstanceModel, StreamModel, StatusCountModel, \
+    DispatchQueueModel
 
 
 class FunctionTypeViewSet(RetrieveViewSetMixin, BaseAPIViewSet):
@@ -26,12 +40,16 @@ class FunctionTypeViewSet(RetrieveViewSetMixin, BaseAPIViewSet):
     RetrieveSerializer = FunctionTypeSerializer
 
     VALID_FILTERS = ('username', 'key', )
+    METRICS_WINDOW = timedelta(days=1)
+    METRICS_PERCENTILES = '50,90,99'
 
     @Decorators.with_permission('streams.view_functiontypemodel')
     def list(self, request):
-        total_queryset, items, metadata = self.apply_list_filters(request)
         list_serializer = FunctionTypeListSerializer(
-            items, many=True, request=request)
+            many=True, request=request, **self.get_fieldset(request))
+        total_queryset, items, metadata = self.apply_list_filters(
+            request, list_serializer.child)
+        list_serializer.instance = items
         response_data = {
             'total_queryset': total_queryset,
             'count': len(items),
@@ -60,13 +78,45 @@ class FunctionTypeViewSet(RetrieveViewSetMixin, BaseAPIViewSet):
     def retrieve(self, request, uuid):
         return super().retrieve(request, uuid=uuid)
 
+    @action(detail=False, methods=['get'], url_path='metrics')
+    @Decorators.with_permission('streams.view_functiontypemodel')
+    def metrics(self, request):
+        """
+        Returns the queue wait, run and blocked time percentiles of the function instances,
+        by function type, over the 'since' and 'until' window (the last day by default).
+        """
+        until = request.query_params.get('until')
+        since = request.query_params.get('since')
+        try:
+            until = parse_datetime(until) if until else timezone.now()
+            since = parse_datetime(since) if since else until - self.METRICS_WINDOW
+            percentiles = [float(pct) for pct in request.query_params.get(
+                'percentiles', self.METRICS_PERCENTILES).split(',')]
+        except ValueError:
+            raise ParseError(detail="'since' and 'until' must be ISO 8601 datetimes and "
+                                    "'percentiles' a comma separated list of numbers.")
+        if not since or not until or any(not 0 <= pct <= 100 for pct in percentiles):
+            raise ParseError(detail="'since' and 'until' must be ISO 8601 datetimes and "
+                                    "'percentiles' numbers between 0 and 100.")
+
+        metrics = ModelManager.handle(
+            'streams.functioninstancetransition',
+            'time_in_status_percentiles',
+            since=since,
+            until=until,
+            percentiles=percentiles, )
+        return Response({'since': since,
+                         'until': until,
+                         'function_types': metrics},
+                        status=HTTP_200_OK)
+
     def build_filters(self, request) -> dict:
         filters = {}
         for key, value in request.query_params.items():
             if key == 'username':
                 filters['account__username'] = value
             else:
-                if key not in ['limit', 'offset']:
+                if key not in self.control_params:
                     filters[key] = value
         return filters
 
@@ -82,9 +132,11 @@ class StreamViewSet(RetrieveViewSetMixin, BaseAPIViewSet):
 
     @Decorators.with_permission('streams.view_streammodel')
     def list(self, request):
-        total_queryset, items, metadata = self.apply_list_filters(request)
         list_serializer = StreamListSerializer(
-            items, many=True, request=request)
+            many=True, request=request, **self.get_fieldset(request))
+        total_queryset, items, metadata = self.apply_list_filters(
+            request, list_serializer.child)
+        list_serializer.instance = items
         response_data = {
             'total_queryset': total_queryset,
             'count': len(items),
@@ -125,8 +177,6 @@ class StreamViewSet(RetrieveViewSetMixin, BaseAPIViewSet):
                                                                   many=True)
         variable_creation_serializer.is_valid(raise_exception=False)
         if variable_creation_serializer.errors:
-            for inst in instances:
-                inst.delete()
             stream.delete()
             for err in variable_creation_serializer.errors:
                 if err:
@@ -134,7 +184,8 @@ class StreamViewSet(RetrieveViewSetMixin, BaseAPIViewSet):
 
         variables = variable_creation_serializer.save()
 
-        stream_serializer = StreamSerializer(stream)
+        stream_serializer = StreamSerializer(stream, **self.get_fieldset(request))
+        self._load_detail(stream, stream_serializer)
         return Response(stream_serializer.data,
                         status=HTTP_201_CREATED)
 
@@ -153,12 +204,128 @@ class StreamViewSet(RetrieveViewSetMixin, BaseAPIViewSet):
             raise NotFound(
                 detail=f"resource identifier: '{uuid}' doesn't exist.")
 
-        st.cancel()
+        with transaction.atomic():
+            cancelled, _, transitions = StreamModel.cancel_many(
+                StreamModel.objects.filter(uuid=st.uuid))
+            publish_streams_cancelled(cancelled, transitions)
+        st.refresh_from_db(fields=['status', 'updated'])
 
-        serializer = StreamSerializer(st)
+        serializer = StreamSerializer(st, **self.get_fieldset(request))
+        self._load_detail(st, serializer)
         return Response(serializer.data,
                         status=HTTP_200_OK)
 
+    @action(detail=False, methods=['post'], url_path='cancel')
+    @Decorators.with_permission('streams.delete_streammodel')
+    def cancel(self, request):
+        """
+        Cancels many streams of the workspaces of the user, selected by uuids and/or filters.
+
+        It runs a fixed number of queries whatever the number of streams selected.
+        """
+        serializer = StreamBulkCancelSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        selection = serializer.validated_data
+
+        streams = ModelManager.handle(
+            'streams.stream',
+            'filter',
+            workspace__in=request.user.workspaces.all(), )
+        if 'uuids' in selection:
+            streams = streams.filter(uuid__in=selection['uuids'])
+        if 'workspace' in selection:
+            streams = streams.filter(workspace__name=selection['workspace'])
+        if 'status__in' in selection:
+            streams = streams.filter(status__in=selection['status__in'])
+
+        with transaction.atomic():
+            cancelled, already_cancelled, transitions = StreamModel.cancel_many(streams)
+            publish_streams_cancelled(cancelled, transitions)
+
+        outcomes = {str(uuid): {'outcome': 'cancelled', 'cancelled_functions': total}
+                    for uuid, total in cancelled.items()}
+        outcomes.update({str(uuid): {'outcome': 'already_cancelled', 'cancelled_functions': 0}
+                         for uuid in already_cancelled})
+        not_found = set(map(str, selection.get('uuids', []))) - outcomes.keys()
+        outcomes.update({uuid: {'outcome': 'not_found', 'cancelled_functions': 0}
+                         for uuid in not_found})
+        return Response({'counts': {'cancelled': len(cancelled),
+                                    'already_cancelled': len(already_cancelled),
+                                    'not_found': len(not_found),
+                                    'cancelled_functions': sum(cancelled.values())},
+                         'streams': outcomes},
+                        status=HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='stats')
+    @Decorators.with_permission('streams.view_streammodel')
+    def stats(self, request):
+        """
+        Counts the streams and function instances by status in the workspaces of the user,
+        or in the one named by the 'workspace' query param.
+        """
+        workspaces = request.user.workspaces.all()
+        workspace_name = request.query_params.get('workspace')
+        if workspace_name:
+            workspaces = workspaces.filter(name=workspace_name)
+
+        totals = StatusCountModel.totals(workspaces)
+        return Response({'streams': totals[StatusCountModel.STREAM],
+                         'function_instances': totals[StatusCountModel.FUNCTION_INSTANCE]},
+                        status=HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='dispatch')
+    @Decorators.with_permission('streams.view_streammodel')
+    def dispatch_queue(self, request):
+        """
+        Returns the dispatch queue depth, the wait of its oldest entry and the running Jobs
+        of the workspaces of the user, or of the one named by the 'workspace' query param.
+        """
+        workspaces = request.user.workspaces.all()
+        workspace_name = request.query_params.get('workspace')
+        if workspace_name:
+            workspaces = workspaces.filter(name=workspace_name)
+
+        return Response(DispatchQueueModel.stats(workspaces), status=HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], url_path='changes')
+    @Decorators.with_permission('streams.view_streammodel')
+    def changes(self, request, uuid=None):
+        """
+        Long-polls the change feed of the stream and its function instances.
+
+        It returns the changes after the 'since' cursor as soon as there is any, waiting
+        up to 'timeout' seconds for them. The returned 'cursor' is the 'since' of the next call.
+        """
+        try:
+            since = int(request.query_params.get('since', 0))
+            timeout = float(request.query_params.get('timeout', STREAM_CHANGES_TIMEOUT))
+        except ValueError:
+            raise ParseError(detail="'since' and 'timeout' query params must be numbers.")
+        timeout = max(0.0, min(timeout, STREAM_CHANGES_MAX_TIMEOUT))
+
+        if not ModelManager.handle('streams.stream', 'filter', uuid=uuid).exists():
+            raise NotFound(
+                detail=f"resource identifier: '{uuid}' doesn't exist.")
+
+        changes, has_more = wait_for_changes(uuid, since, timeout, STREAM_CHANGES_LIMIT)
+        return Response({'stream': uuid,
+                         'cursor': changes[-1].seq if changes else since,
+                         'has_more': has_more,
+                         'changes': [change.as_dict for change in changes]},
+                        status=HTTP_200_OK)
+
+    def get_resource(self, uuid, serializer):
+        stream = StreamModel.objects.only(*serializer.columns()).get(uuid=uuid)
+        return self._load_detail(stream, serializer)
+
+    @staticmethod
+    def _load_detail(stream, serializer):
+        # the function instances and their variables, with the columns rendered only
+        if 'functions' in serializer.fields:
+            variables = VariableSerializer(context=serializer.context)
+            StreamModel.objects.prefetch_detail([stream], variables.columns())
+        return stream
+
     def build_filters(self, request) -> dict:
         filters = {}
         for key, value in request.query_params.items():
@@ -166,7 +333,7 @@ class StreamViewSet(RetrieveViewSetMixin, BaseAPIViewSet):
                 filters['user__username'] = value
             elif key == 'status__in':
                 filters[key] = value.split(',')
-            else:
+            elif key not in self.control_params:
                 filters[key] = value
         return filters
 
@@ -182,9 +349,11 @@ class FunctionInstanceViewSet(RetrieveViewSetMixin, BaseAPIViewSet):
 
     @Decorators.with_permission('streams.view_functioninstancemodel')
     def list(self, request):
-        total_queryset, items, metadata = self.apply_list_filters(request)
         list_serializer = FunctionInstanceListSerializer(
-            items, many=True, request=request)
+            many=True, request=request, **self.get_fieldset(request))
+        total_queryset, items, metadata = self.apply_list_filters(
+            request, list_serializer.child)
+        list_serializer.instance = items
         response_data = {
             'total_queryset': total_queryset,
             'count': len(items),
@@ -206,7 +375,7 @@ class FunctionInstanceViewSet(RetrieveViewSetMixin, BaseAPIViewSet):
             if key == 'status__in':
                 filters[key] = value.split(',')
             else:
-                if key not in ['limit', 'offset']:
+                if key not in self.control_params:
                     filters[key] = value
         return filters
 
@@ -249,13 +418,84 @@ class VariableViewSet(ListViewSetMixin, RetrieveViewSetMixin, BaseAPIViewSet):
             raise NotFound(
                 detail=f"resource identifier: '{uuid}' doesn't exist.")
 
-        variable.body = decode_b64str(body)
+        variable.bytes = decode_b64str(body)
         variable.save()
 
-        serializer = VariableSerializer(variable)
+        serializer = VariableSerializer(variable, **self.get_fieldset(request))
         return Response(serializer.data,
                         status=HTTP_200_OK)
 
+    @action(detail=True, methods=['get'], url_path='body')
+    @Decorators.with_permission('streams.view_variablemodel')
+    def body(self, request, uuid=None):
+        """
+        Streams the raw payload of the variable.
+
+        Compressed payloads are served without being decompressed to clients accepting
+        the matching content-coding. The checksum of the payload is its ETag, and single
+        byte ranges of the decompressed payload are served on request.
+        """
+        try:
+            variable = ModelManager.handle(
+                'streams.variable',
+                'get',
+                uuid=uuid, )
+        except ObjectDoesNotExist:
+            raise NotFound(
+                detail=f"resource identifier: '{uuid}' doesn't exist.")
+
+        # the size and checksum are only known for the payloads stored since they exist
+        known = bool(variable.checksum)
+        range_header = request.headers.get('Range') if known else None
+        content_encoding = None if range_header else accepted_content_encoding(
+            variable.codec, request.headers.get('Accept-Encoding', ''))
+        etag = None
+        if known:
+            etag = quote_etag(f'{variable.checksum}-{content_encoding}' if content_encoding
+                              else variable.checksum)
+            if_range = request.headers.get('If-Range')
+            if if_range and if_range != etag:
+                range_header = None
+
+        if etag and set(parse_etags(request.headers.get('If-None-Match', ''))) & {etag, '*'}:
+            response = HttpResponseNotModified()
+        elif range_header:
+            try:
+                byte_range = parse_byte_range(range_header, variable.size)
+            except ValueError:
+                response = HttpResponse(status=HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response['Content-Range'] = f'bytes */{variable.size}'
+                return response
+            response = self._body_response(variable, byte_range)
+        elif content_encoding:
+            response = FileResponse(variable.open_stored(), content_type=variable.content_type)
+            response['Content-Encoding'] = content_encoding
+        else:
+            response = self._body_response(variable)
+
+        if etag:
+            response['ETag'] = etag
+        if known:
+            response['Accept-Ranges'] = 'bytes'
+        patch_vary_headers(response, ('Accept-Encoding', ))
+        return response
+
+    @staticmethod
+    def _body_response(variable, byte_range: Tuple[int, int] = None):
+        if byte_range is None:
+            response = FileResponse(variable.open(), content_type=variable.content_type)
+            if variable.checksum:
+                response['Content-Length'] = variable.size
+            return response
+
+        first, last = byte_range
+        response = StreamingHttpResponse(
+            iter_file_range(variable.open(), first, last - first + 1),
+            status=HTTP_206_PARTIAL_CONTENT, content_type=variable.content_type)
+        response['Content-Length'] = last - first + 1
+        response['Content-Range'] = f'bytes {first}-{last}/{variable.size}'
+        return response
+
 
 def try_create_input_variables(funcs_data: dict,
                                func_instances: List[FunctionInstanceModel]
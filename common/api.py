@@ -1,9 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
+from typing import Iterator, List, Union
 
-from .contracts import HttpClient, APIContract
+import requests
+
+from .contracts import HttpClient, APIContract, LogPreview
+from .exceptions import ResourceVersionExpiredError
 from .utils import get_hex_string
 from .mixins import BaseHeadersMixin
-from settings import K8S_SERVER_URL, K8S_PORT, K8S_TOKEN, K8S_BASE_API_URL, K8S_NAMESPACE
+from settings import K8S_SERVER_URL, K8S_PORT, K8S_TOKEN, K8S_BASE_API_URL, K8S_NAMESPACE, \
+    HTTP_CLIENT_CONNECT_TIMEOUT
 
 
 class KubernetesHttpClient(BaseHeadersMixin, HttpClient):
@@ -18,8 +25,9 @@ class KubernetesHttpClient(BaseHeadersMixin, HttpClient):
 
     @classmethod
     def new(cls, server_url: str = K8S_SERVER_URL, port: int = K8S_PORT,
-            base_api_url: str = K8S_BASE_API_URL, namespace: str = K8S_NAMESPACE):
-        return cls(namespace, server_url, port, base_api_url, base_headers=cls.AUTH_HEADERS)
+            base_api_url: str = K8S_BASE_API_URL, namespace: str = K8S_NAMESPACE, **kwargs):
+        return cls(namespace, server_url, port, base_api_url, base_headers=cls.AUTH_HEADERS,
+                   **kwargs)
 
     def _refresh_token(self):
         # TODO: implement this method
@@ -33,7 +41,9 @@ class KubernetesAPI(APIContract):
     }
 
     def __init__(self):
-        self._client = KubernetesHttpClient.new()
+        # the singleton keeps its client, and so its pool of connections
+        if not hasattr(self, '_client'):
+            self._client = KubernetesHttpClient.new()
 
     def __new__(cls):
         if not cls.__inst:
@@ -46,17 +56,84 @@ class KubernetesAPI(APIContract):
 
     def create(self, resource: str, config: dict):
         hex_id = get_hex_string()
-        self._log_to(resource, 'info', '[%s] creating %s: %s' % (hex_id, resource, config))
+        self._log_to(resource, 'info', '[%s] creating %s: %s', hex_id, resource, LogPreview(config))
         resp = self.client.post(relative_url=self._build_uri(config['apiVersion'], resource),
                                 json=config,
                                 verify=False)
-        self._log_to(resource, 'info', '[%s] %s created' % (hex_id, resource))
+        self._log_to(resource, 'info', '[%s] %s created', hex_id, resource)
+        return resp
+
+    def create_encoded(self, resource: str, api_version: str, body: bytes):
+        """
+        Creates a resource from its manifest already encoded as JSON.
+        """
+        hex_id = get_hex_string()
+        self._log_to(resource, 'info', '[%s] creating %s: %s', hex_id, resource, LogPreview(body))
+        resp = self.client.post(relative_url=self._build_uri(api_version, resource),
+                                body=body,
+                                verify=False)
+        self._log_to(resource, 'info', '[%s] %s created', hex_id, resource)
         return resp
 
-    def _log_to(self, resource_name, level, msg):
+    def create_many(self, resource: str, configs: List[dict]) -> List[Union[requests.Response,
+                                                                            Exception]]:
+        """
+        Creates the resources concurrently on the pooled connections of the client.
+
+        Results are in the order of the configs, a failed call results in its exception.
+        """
+        def create(config):
+            try:
+                return self.create(resource, config)
+            except Exception as exc:
+                return exc
+
+        max_workers = max(1, min(self.client.pool_size, len(configs)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(create, configs))
+
+    def list(self, resource: str, api_version: str, url_params: dict = None) -> dict:
+        resp = self.client.get(relative_url=self._build_uri(api_version, resource),
+                               url_params=url_params,
+                               verify=False)
+        resp.raise_for_status()
+        return resp.json()
+
+    def watch(self, resource: str, api_version: str, resource_version: str, timeout: int,
+              url_params: dict = None) -> Iterator[dict]:
+        """
+        Yields the watch events of the resources changed after the resource version, until
+        the server ends the stream after 'timeout' seconds.
+
+        It raises ResourceVersionExpiredError when the resource version is too old to resume
+        from, the resources have to be listed again.
+        """
+        params = {**(url_params or {}),
+                  'watch': 'true',
+                  'resourceVersion': resource_version,
+                  'allowWatchBookmarks': 'true',
+                  'timeoutSeconds': timeout}
+        resp = self.client.get(relative_url=self._build_uri(api_version, resource),
+                               url_params=params,
+                               stream=True,
+                               timeout=(HTTP_CLIENT_CONNECT_TIMEOUT, timeout + 5),
+                               verify=False)
+        with resp:
+            if resp.status_code == 410:
+                raise ResourceVersionExpiredError(resource_version)
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event['type'] == 'ERROR' and event['object'].get('code') == 410:
+                    raise ResourceVersionExpiredError(resource_version)
+                yield event
+
+    def _log_to(self, resource_name, level, msg, *args):
         logger = self.LOGGERS[resource_name]
         log_method = logger.__getattribute__(level)
-        log_method(msg)
+        log_method(msg, *args)
 
     def _build_uri(self, api_version, resource):
         return f"{api_version}/namespaces/{self.client.namespace}/{resource}s"
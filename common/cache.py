@@ -0,0 +1,71 @@
+from collections import OrderedDict
+import threading
+import time
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """
+    A bounded, thread-safe LRU cache whose entries expire after a time-to-live.
+    """
+    def __init__(self, maxsize: int, ttl: float, timer: Callable[[], float] = time.monotonic):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._timer = timer
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            value, expires = entry
+            if expires <= self._timer():
+                self._remove(key)
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        ttl = self._ttl if ttl is None else min(ttl, self._ttl)
+        if ttl <= 0 or self._maxsize <= 0:
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, self._timer() + ttl)
+
+            while len(self._entries) > self._maxsize:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'size': len(self._entries),
+                'maxsize': self._maxsize,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key: Hashable):
+        del self._entries[key]
@@ -0,0 +1,156 @@
+import io
+import lzma
+import threading
+import time
+import zlib
+from typing import BinaryIO, Optional, Tuple
+
+IDENTITY = 'identity'
+ZLIB = 'zlib'
+LZMA = 'lzma'
+CODECS = [(IDENTITY, 'Identity'), (ZLIB, 'Zlib'), (LZMA, 'LZMA')]
+
+# HTTP content-coding able to transport each codec output untouched.
+HTTP_CONTENT_ENCODINGS = {
+    ZLIB: 'deflate',
+}
+
+
+def accepted_content_encoding(codec: str, accept_encoding: str) -> Optional[str]:
+    """
+    Returns the HTTP content-coding to serve a payload stored with 'codec' as it is,
+    or None when the client 'Accept-Encoding' header doesn't allow it.
+    """
+    content_encoding = HTTP_CONTENT_ENCODINGS.get(codec)
+    if not content_encoding:
+        return None
+
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        if name.strip().lower() != content_encoding:
+            continue
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                return content_encoding if float(quality[2:]) > 0 else None
+            except ValueError:
+                return None
+        return content_encoding
+    return None
+
+
+def encode(content: bytes, codec: str) -> bytes:
+    if codec == ZLIB:
+        return zlib.compress(content)
+    if codec == LZMA:
+        return lzma.compress(content)
+    return content
+
+
+def decode(content: bytes, codec: str) -> bytes:
+    if codec == ZLIB:
+        return zlib.decompress(content)
+    if codec == LZMA:
+        return lzma.decompress(content)
+    return content
+
+
+def _decompressor(codec: str):
+    if codec == ZLIB:
+        return zlib.decompressobj()
+    if codec == LZMA:
+        return lzma.LZMADecompressor()
+    raise ValueError(f"Unknown codec '{codec}'.")
+
+
+class DecodingReader(io.RawIOBase):
+    """
+    Readable binary file that lazily decompresses another file, chunk by chunk.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, raw: BinaryIO, codec: str):
+        self._raw = raw
+        self._decompressor = _decompressor(codec)
+        self._buffer = b''
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer and not self._eof:
+            chunk = self._raw.read(self.CHUNK_SIZE)
+            if not chunk:
+                self._eof = True
+                break
+            self._buffer = self._decompressor.decompress(chunk)
+
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self):
+        self._raw.close()
+        super().close()
+
+
+def open_decoded(raw: BinaryIO, codec: str) -> BinaryIO:
+    if codec == IDENTITY:
+        return raw
+    return io.BufferedReader(DecodingReader(raw, codec))
+
+
+class CodecStats:
+    """
+    Thread-safe counters of the compression attempts made for each variable type.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, variable_type: str, kept: bool, raw_size: int, encoded_size: int,
+               cpu_seconds: float):
+        with self._lock:
+            stats = self._stats.setdefault(variable_type, {
+                'attempts': 0, 'kept': 0, 'raw_bytes': 0, 'encoded_bytes': 0,
+                'cpu_seconds': 0.0})
+            stats['attempts'] += 1
+            stats['kept'] += int(kept)
+            stats['raw_bytes'] += raw_size
+            stats['encoded_bytes'] += encoded_size
+            stats['cpu_seconds'] += cpu_seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                variable_type: dict(
+                    stats,
+                    ratio=(stats['encoded_bytes'] / stats['raw_bytes']
+                           if stats['raw_bytes'] else 1.0))
+                for variable_type, stats in self._stats.items()}
+
+
+CODEC_STATS = CodecStats()
+
+
+def compress(content: bytes, codec: str, min_size: int, min_ratio: float,
+             variable_type: str = None) -> Tuple[str, bytes]:
+    """
+    Compresses 'content' with 'codec' only when it shrinks below 'min_ratio' of its size.
+
+    It returns the codec actually applied and the encoded content. The decision only
+    depends on the content, so identical payloads are always stored alike.
+    """
+    if codec == IDENTITY or len(content) < min_size:
+        return IDENTITY, content
+
+    started = time.process_time()
+    encoded = encode(content, codec)
+    kept = len(encoded) <= len(content) * min_ratio
+    CODEC_STATS.record(variable_type or 'unknown', kept, len(content), len(encoded),
+                       time.process_time() - started)
+    if kept:
+        return codec, encoded
+    return IDENTITY, content
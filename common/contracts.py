@@ -1,8 +1,13 @@
 from abc import ABC, abstractmethod
 import logging
+from typing import BinaryIO, Iterator, Tuple
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from common.utils import get_hex_string
+from settings import HTTP_CLIENT_POOL_SIZE, HTTP_CLIENT_CONNECT_TIMEOUT, HTTP_CLIENT_READ_TIMEOUT, \
+    HTTP_CLIENT_MAX_RETRIES, HTTP_CLIENT_BACKOFF_FACTOR, HTTP_CLIENT_LOG_BODY_MAX_SIZE
 from django.db import models
 from scaladecore.entities import EntityContract
 
@@ -34,19 +39,103 @@ class ApplicationHandler(ABC):
         pass
 
 
+class BlobStorage(ABC):
+    """
+    Content-addressed storage of binary payloads kept out of the database.
+
+    Payloads are saved under a key (their checksum) and the returned reference is what
+    has to be stored to read them back.
+    """
+    @abstractmethod
+    def save(self, key: str, content: bytes) -> str:
+        pass
+
+    @abstractmethod
+    def open(self, ref: str) -> BinaryIO:
+        pass
+
+    @abstractmethod
+    def exists(self, ref: str) -> bool:
+        pass
+
+    @abstractmethod
+    def delete(self, ref: str):
+        pass
+
+    @abstractmethod
+    def keys(self) -> Iterator[Tuple[str, float]]:
+        """
+        Yields the key of every stored payload with its modification time, as a timestamp.
+        """
+        pass
+
+    def read(self, ref: str) -> bytes:
+        with self.open(ref) as file:
+            return file.read()
+
+
+class PubSubBackend(ABC):
+    """
+    Publish/subscribe channel of JSON serializable messages.
+
+    Messages are published from synchronous code and consumed by asyncio subscribers.
+    """
+    @abstractmethod
+    def publish(self, channel: str, message: dict):
+        pass
+
+    @abstractmethod
+    def subscribe(self, channel: str):
+        """
+        Returns a subscription to the channel, it must be called from a running event loop.
+        """
+        pass
+
+    @abstractmethod
+    def wait(self, channel: str, timeout: float) -> bool:
+        """
+        Blocks the calling thread until a message is published to the channel, it returns
+        False when the timeout expires first.
+        """
+        pass
+
+
 class HttpClient(ABC):
-    LOGGER = logging.getLogger('http_client')
+    """
+    HTTP client of a remote API, backed by a pooled keep-alive session.
 
-    def __init__(self, server_url: str, port: int, base_api_url: str, base_headers: dict = None):
+    Calls answered with a throttling or server error status are retried with an
+    exponential backoff, honouring the Retry-After header.
+    """
+    LOGGER = logging.getLogger('http_client')
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, server_url: str, port: int, base_api_url: str, base_headers: dict = None,
+                 pool_size: int = HTTP_CLIENT_POOL_SIZE,
+                 timeout: Tuple[float, float] = (HTTP_CLIENT_CONNECT_TIMEOUT,
+                                                 HTTP_CLIENT_READ_TIMEOUT),
+                 max_retries: int = HTTP_CLIENT_MAX_RETRIES,
+                 backoff_factor: float = HTTP_CLIENT_BACKOFF_FACTOR):
         self._server_url = server_url
         self._port = port
         self._base_api_url = base_api_url
         self._base_headers = base_headers
+        self._pool_size = pool_size
+        self._timeout = timeout
+        self._session = self._build_session(pool_size, max_retries, backoff_factor)
 
     @property
     def base_headers(self):
         return self._base_headers
 
+    @property
+    def pool_size(self) -> int:
+        return self._pool_size
+
+    @property
+    def session(self) -> requests.Session:
+        return self._session
+
     @classmethod
     @abstractmethod
     def new(cls, *args, **kwargs):
@@ -56,24 +145,26 @@ class HttpClient(ABC):
         hex_id = get_hex_string()
 
         self._log_call(hex_id, 'GET', relative_url, url_params)
-        response = requests.get(self._compose_url(relative_url),
-                                params=url_params,
-                                headers=headers,
-                                **kwargs)
+        kwargs.setdefault('timeout', self._timeout)
+        response = self.session.get(self._compose_url(relative_url),
+                                    params=url_params,
+                                    headers=headers,
+                                    **kwargs)
 
-        self._log_response(hex_id, 'GET', response.status_code, response.json())
+        self._log_response(hex_id, 'GET', response, streamed=kwargs.get('stream', False))
         return response
 
     def post(self, relative_url: str, body: dict = None, headers: dict = None, **kwargs):
         hex_id = get_hex_string()
 
         self._log_call(hex_id, 'POST', relative_url, body=body)
-        response = requests.post(self._compose_url(relative_url),
-                                 data=body,
-                                 headers=headers,
-                                 **kwargs)
+        kwargs.setdefault('timeout', self._timeout)
+        response = self.session.post(self._compose_url(relative_url),
+                                     data=body,
+                                     headers=headers,
+                                     **kwargs)
 
-        self._log_response(hex_id, 'POST', response.status_code, response.json())
+        self._log_response(hex_id, 'POST', response)
         return response
 
     def put(self, relative_url: str, url_params: dict = None, body: dict = None,
@@ -87,17 +178,58 @@ class HttpClient(ABC):
     def delete(self, relative_url: str, headers: dict = None, **kwargs):
         raise NotImplementedError
 
+    def close(self):
+        self.session.close()
+
+    def _build_session(self, pool_size: int, max_retries: int,
+                       backoff_factor: float) -> requests.Session:
+        # every method is retried: callers must make non idempotent calls safe to repeat,
+        # a Job created twice with the same name is rejected with a conflict.
+        retry = Retry(total=max_retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=self.RETRY_STATUSES,
+                      allowed_methods=False,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True,
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
     def _compose_url(self, relative_url, append_slash=False):
         return "{0}/{1}/{2}{3}".format(
             self._server_url, self._base_api_url, relative_url, '/' if append_slash else '')
 
     def _log_call(self, hex_id, method, relative_url, url_params=None, body=None):
-        self.LOGGER.info(f'[{hex_id}] HTTP CALL method: {method} | relative_url: {relative_url} | '
-                         f'url_params: {url_params} | body: {body}')
+        self.LOGGER.info('[%s] HTTP CALL method: %s | relative_url: %s | url_params: %s | '
+                         'body: %s', hex_id, method, relative_url, url_params,
+                         LogPreview(body))
+
+    def _log_response(self, hex_id, method, response, streamed=False):
+        # the body of streamed responses is left for the caller to consume
+        self.LOGGER.info('[%s] HTTP RESPONSE method: %s | status: %s | body: %s',
+                         hex_id, method, response.status_code,
+                         '<streamed>' if streamed else LogPreview(response.content))
+
 
-    def _log_response(self, hex_id, method, status, response_body):
-        self.LOGGER.info(f'[{hex_id}] HTTP RESPONSE method: {method} | status: {status} | '
-                         f'body: {response_body}')
+class LogPreview:
+    """
+    Log argument only rendered when the record is emitted, it is cut to max_size characters.
+    """
+    def __init__(self, value, max_size: int = HTTP_CLIENT_LOG_BODY_MAX_SIZE):
+        self.value = value
+        self.max_size = max_size
+
+    def __str__(self):
+        value = self.value
+        if isinstance(value, bytes):
+            value = value[:self.max_size + 1].decode('utf-8', errors='replace')
+        else:
+            value = str(value)
+        if len(value) > self.max_size:
+            return value[:self.max_size] + '...'
+        return value
 
 
 class APIContract:
@@ -13,3 +13,14 @@ class InconsistentStateChangeError(Exception):
             self.current_status,
             self.updated_status,
         )
+
+
+class ResourceVersionExpiredError(Exception):
+    """
+    The resourceVersion a Kubernetes watch resumes from is too old, it has to relist.
+    """
+    def __init__(self, resource_version: str):
+        self.resource_version = resource_version
+
+    def __str__(self):
+        return "Resource version '{0}' is expired.".format(self.resource_version)
@@ -0,0 +1,155 @@
+import asyncio
+from functools import lru_cache
+import json
+import logging
+import threading
+import time
+from typing import Dict, Optional, Set
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+from .contracts import PubSubBackend
+from settings import PUBSUB_BACKEND
+
+
+class Subscription:
+    """
+    Messages of a channel delivered to an asyncio consumer through a bounded queue.
+
+    Slow consumers lose the oldest messages instead of blocking the publishers.
+    """
+    def __init__(self, channel: str, max_size: int, on_close=None):
+        self.channel = channel
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=max_size)
+        self._on_close = on_close
+        self.dropped = 0
+
+    def put(self, message: dict):
+        """
+        Thread-safe delivery of a message to the subscriber.
+        """
+        self._loop.call_soon_threadsafe(self._put_nowait, message)
+
+    async def get(self, timeout: float = None) -> Optional[dict]:
+        """
+        Waits for the next message, it returns None when the timeout expires.
+        """
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        if self._on_close:
+            self._on_close(self)
+            self._on_close = None
+
+    def _put_nowait(self, message: dict):
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(message)
+
+
+class LocalPubSubBackend(PubSubBackend):
+    """
+    In-process backend, it only reaches subscribers served by the same process.
+    """
+    def __init__(self, max_queue_size: int = 1000):
+        self._max_queue_size = max_queue_size
+        self._lock = threading.Lock()
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+        self._waiters: Dict[str, Set[threading.Event]] = {}
+
+    def publish(self, channel: str, message: dict):
+        with self._lock:
+            subscriptions = tuple(self._subscriptions.get(channel, ()))
+            waiters = tuple(self._waiters.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(message)
+        for waiter in waiters:
+            waiter.set()
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(channel, self._max_queue_size, on_close=self._unsubscribe)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def wait(self, channel: str, timeout: float) -> bool:
+        waiter = threading.Event()
+        with self._lock:
+            self._waiters.setdefault(channel, set()).add(waiter)
+        try:
+            return waiter.wait(timeout)
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(channel, set())
+                waiters.discard(waiter)
+                if not waiters:
+                    self._waiters.pop(channel, None)
+
+    def _unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.channel, None)
+
+
+class RedisPubSubBackend(PubSubBackend):
+    """
+    Redis backend, it reaches subscribers served by any process.
+    """
+    LOGGER = logging.getLogger('pubsub')
+
+    def __init__(self, url: str, max_queue_size: int = 1000):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._max_queue_size = max_queue_size
+
+    def publish(self, channel: str, message: dict):
+        self._client.publish(channel, json.dumps(message, cls=DjangoJSONEncoder))
+
+    def subscribe(self, channel: str) -> Subscription:
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(channel)
+        subscription = Subscription(channel, self._max_queue_size,
+                                    on_close=lambda _: pubsub.close())
+
+        def listen():
+            try:
+                for item in pubsub.listen():
+                    subscription.put(json.loads(item['data']))
+            except Exception as exc:
+                # the pubsub connection is closed when the subscription is
+                self.LOGGER.debug("Redis subscription to '%s' finished: %s", channel, exc)
+
+        threading.Thread(target=listen, daemon=True).start()
+        return subscription
+
+    def wait(self, channel: str, timeout: float) -> bool:
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(channel)
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                # subscription confirmations are returned as None too
+                if pubsub.get_message(timeout=remaining) is not None:
+                    return True
+        finally:
+            pubsub.close()
+
+
+@lru_cache(maxsize=None)
+def get_pubsub() -> PubSubBackend:
+    """
+    Returns the publish/subscribe backend configured by PUBSUB_BACKEND setting.
+    """
+    backend_class = import_string(PUBSUB_BACKEND['BACKEND'])
+    return backend_class(**PUBSUB_BACKEND.get('OPTIONS', {}))
@@ -0,0 +1,130 @@
+from functools import lru_cache
+import io
+import os
+import tempfile
+from typing import BinaryIO, Iterator, Tuple
+
+from django.utils.module_loading import import_string
+
+from .contracts import BlobStorage
+from settings import VARIABLES_BLOB_STORAGE
+
+
+class LocalBlobStorage(BlobStorage):
+    """
+    Stores payloads as files of a local directory, sharded by the first key characters.
+    """
+    def __init__(self, location: str):
+        self.location = str(location)
+
+    def save(self, key: str, content: bytes) -> str:
+        path = self._path(key)
+        if os.path.exists(path):
+            # content addressed: an existing file already holds the same payload
+            return key
+
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return key
+
+    def open(self, ref: str) -> BinaryIO:
+        return open(self._path(ref), 'rb')
+
+    def exists(self, ref: str) -> bool:
+        return os.path.exists(self._path(ref))
+
+    def delete(self, ref: str):
+        try:
+            os.remove(self._path(ref))
+        except FileNotFoundError:
+            pass
+
+    def keys(self) -> Iterator[Tuple[str, float]]:
+        for dirpath, _, filenames in os.walk(self.location):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                # files being written are temporary ones, outside of their final path
+                if path == self._path(filename):
+                    yield filename, os.path.getmtime(path)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.location, key[:2], key[2:4], key)
+
+
+class StreamingBodyIO(io.RawIOBase):
+    """
+    A read-only, non seekable, binary file over a botocore StreamingBody, which has
+    neither the context manager nor the io protocol the payload readers rely on.
+    """
+    def __init__(self, body):
+        self._body = body
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        chunk = self._body.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+    def close(self):
+        if not self.closed:
+            self._body.close()
+        super().close()
+
+
+class S3BlobStorage(BlobStorage):
+    """
+    Stores payloads as objects of an S3 compatible bucket.
+    """
+    def __init__(self, bucket: str, prefix: str = '', **client_kwargs):
+        import boto3
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = boto3.client('s3', **client_kwargs)
+
+    def save(self, key: str, content: bytes) -> str:
+        self._client.put_object(Bucket=self.bucket, Key=self._key(key), Body=content)
+        return key
+
+    def open(self, ref: str) -> BinaryIO:
+        response = self._client.get_object(Bucket=self.bucket, Key=self._key(ref))
+        return io.BufferedReader(StreamingBodyIO(response['Body']))
+
+    def exists(self, ref: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=self._key(ref))
+        except ClientError:
+            return False
+        return True
+
+    def delete(self, ref: str):
+        self._client.delete_object(Bucket=self.bucket, Key=self._key(ref))
+
+    def keys(self) -> Iterator[Tuple[str, float]]:
+        paginator = self._client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key'][len(self.prefix):], obj['LastModified'].timestamp()
+
+    def _key(self, key: str) -> str:
+        return f'{self.prefix}{key}'
+
+
+@lru_cache(maxsize=None)
+def get_blob_storage() -> BlobStorage:
+    """
+    Returns the blob storage configured by VARIABLES_BLOB_STORAGE setting.
+    """
+    storage_class = import_string(VARIABLES_BLOB_STORAGE['BACKEND'])
+    return storage_class(**VARIABLES_BLOB_STORAGE.get('OPTIONS', {}))
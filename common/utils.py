@@ -1,5 +1,10 @@
 import binascii
+import hashlib
+from itertools import islice
+import json
 import os
+import time
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 from django.apps import apps
 from django.core.exceptions import ObjectDoesNotExist
@@ -8,6 +13,9 @@ from rest_framework.response import Response
 from rest_framework.status import HTTP_403_FORBIDDEN, HTTP_409_CONFLICT
 from scaladecore.utils import BASE64_REGEX, parse_bearer_token, decode_scalade_token
 
+from .cache import TTLCache
+from settings import RUNTIME_TOKEN_CACHE_MAXSIZE, RUNTIME_TOKEN_CACHE_TTL
+
 
 class ModelManager:
     @classmethod
@@ -39,6 +47,151 @@ def get_hex_string(size=12):
     return binascii.b2a_hex(os.urandom(size)).decode()
 
 
+def iter_batches(iterable: Iterable, size: int) -> Iterator[List]:
+    """
+    Lazily splits an iterable into lists of at most 'size' items.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def get_body_stream(request):
+    """
+    Returns a file-like object reading the body of a django request as it is received.
+
+    Without a Content-Length, e.g. chunked uploads, Django reads an empty body. The WSGI
+    input is read directly instead when the server dechunks it and ends it with the body,
+    which it tells by 'wsgi.input_terminated'. It returns None when the body length is
+    unknown otherwise. Django ASGI handler receives the whole body before the view runs.
+    """
+    meta = request.META
+    if meta.get('CONTENT_LENGTH') or 'wsgi.input' not in meta:
+        return request
+    if meta.get('wsgi.input_terminated'):
+        return meta['wsgi.input']
+    return None
+
+
+def iter_ndjson(stream, max_line_size: int) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Lazily parses a newline-delimited JSON stream, line by line.
+
+    It yields (line_number, record, error) tuples: 'record' is None when the line
+    could not be parsed and 'error' describes why. Blank lines are skipped and lines
+    longer than 'max_line_size' are discarded without being held in memory.
+    """
+    line_number = 0
+    while True:
+        line = stream.readline(max_line_size + 1)
+        if not line:
+            return
+        line_number += 1
+        if len(line) > max_line_size and not line.endswith(b'\n'):
+            # drain the rest of the oversized line
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(max_line_size + 1)
+            yield line_number, None, f'line exceeds {max_line_size} bytes.'
+            continue
+
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_number, None, 'invalid JSON.'
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, 'a JSON object is expected.'
+            continue
+        yield line_number, record, None
+
+
+def parse_byte_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a single range 'Range' header into the (first, last) byte positions, both
+    included, of a representation of 'size' bytes.
+
+    It returns None when the header is not a single byte range, to serve the whole
+    representation, and raises ValueError when the range is not satisfiable.
+    """
+    unit, _, ranges = (header or '').partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+    first, sep, last = ranges.strip().partition('-')
+    if (not sep or not (first or last) or (first and not first.isdigit())
+            or (last and not last.isdigit())):
+        return None
+
+    if not first:
+        # suffix range: the last bytes
+        if not int(last) or not size:
+            raise ValueError('unsatisfiable range')
+        return max(size - int(last), 0), size - 1
+    first, last = int(first), int(last) if last else size - 1
+    if first >= size:
+        raise ValueError('unsatisfiable range')
+    if last < first:
+        return None
+    return first, min(last, size - 1)
+
+
+def iter_file_range(file, first: int, length: int, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Lazily reads 'length' bytes from the 'first' position of a file, which is closed
+    once read. Files that can't seek are read up to the position.
+    """
+    try:
+        if file.seekable():
+            file.seek(first)
+        else:
+            while first:
+                skipped = len(file.read(min(first, chunk_size)))
+                if not skipped:
+                    return
+                first -= skipped
+        while length:
+            chunk = file.read(min(length, chunk_size))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+# Claims of the decoded runtime tokens, keyed by token digest. The FunctionInstance is
+# always read from the database, so its status is never stale.
+RUNTIME_TOKEN_CACHE = TTLCache(maxsize=RUNTIME_TOKEN_CACHE_MAXSIZE, ttl=RUNTIME_TOKEN_CACHE_TTL)
+
+
+def _resolve_runtime_token(token: str):
+    """
+    Returns the decoded claims of a runtime token and its FunctionInstance.
+
+    Decoding and verifying the token is skipped on a cache hit, the FunctionInstance is
+    still fetched by its primary key.
+    """
+    fi_model = ModelManager.get_model('streams', 'functioninstance')
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    claims = RUNTIME_TOKEN_CACHE.get(digest)
+    if claims is not None:
+        return claims, fi_model.objects.get(uuid=claims['fi_uuid'])
+
+    claims = decode_scalade_token(token)
+    fi = fi_model.objects.get(uuid=claims['fi_uuid'])
+    ttl = None
+    if 'exp' in claims:
+        # never serve a token beyond its own expiration
+        ttl = claims['exp'] - time.time()
+    RUNTIME_TOKEN_CACHE.set(digest, claims, ttl=ttl)
+    return claims, fi
+
+
 class DecoratorShipper:
     """
     Ships common used decorators as static methods.
@@ -65,10 +218,7 @@ class DecoratorShipper:
                     return Response(
                         data={'error': 'It requires Bearer token authorization.'},
                         status=HTTP_403_FORBIDDEN)
-                decoded_json = decode_scalade_token(token)
-                fi = ModelManager.handle(
-                    'streams.functioninstance',
-                    'get', uuid=decoded_json['fi_uuid'])
+                _, fi = _resolve_runtime_token(token)
             except ObjectDoesNotExist:
                 return Response(
                     data={'error': "It is a conflict: functions instance resource  doesn't exist."},
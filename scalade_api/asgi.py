@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once django is set up, it serves the Server-Sent Events of the streams.
+from api.events import StreamEventsApplication  # noqa: E402
+
+application = StreamEventsApplication(django_application)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 
 from scaladecore.utils import ISO_8601_FORMAT
@@ -202,3 +203,110 @@ K8S_PORT = os.getenv('K8S_PORT', 443)
 K8S_TOKEN = os.getenv('K8S_TOKEN', 'fakeToken')
 K8S_BASE_API_URL = os.getenv('K8S_BASE_API_URL', 'apis')
 K8S_NAMESPACE = os.getenv('K8S_NAMESPACE', 'default')
+
+# HTTP CLIENTS
+# calls answered with 429 or 5xx are retried after backoff_factor * 2 ** (retry - 1) seconds.
+HTTP_CLIENT_POOL_SIZE = int(os.getenv('HTTP_CLIENT_POOL_SIZE', 16))
+HTTP_CLIENT_CONNECT_TIMEOUT = float(os.getenv('HTTP_CLIENT_CONNECT_TIMEOUT', 5))
+HTTP_CLIENT_READ_TIMEOUT = float(os.getenv('HTTP_CLIENT_READ_TIMEOUT', 30))
+HTTP_CLIENT_MAX_RETRIES = int(os.getenv('HTTP_CLIENT_MAX_RETRIES', 3))
+HTTP_CLIENT_BACKOFF_FACTOR = float(os.getenv('HTTP_CLIENT_BACKOFF_FACTOR', 0.5))
+HTTP_CLIENT_LOG_BODY_MAX_SIZE = int(os.getenv('HTTP_CLIENT_LOG_BODY_MAX_SIZE', 1024))
+
+# SCHEDULER
+# delay target (in seconds) between an upstream completion and its downstream Jobs submission.
+SCHEDULER_MAX_WORKERS = int(os.getenv('SCHEDULER_MAX_WORKERS', 16))
+SCHEDULER_DISPATCH_LATENCY_TARGET = float(os.getenv('SCHEDULER_DISPATCH_LATENCY_TARGET', 0.5))
+SCHEDULER_JOB_TTL = int(os.getenv('SCHEDULER_JOB_TTL', 100))
+# default container resources of the Jobs, as JSON.
+SCHEDULER_JOB_RESOURCES = json.loads(os.getenv('SCHEDULER_JOB_RESOURCES', '{}'))
+SCHEDULER_TEMPLATES_CACHE_SIZE = int(os.getenv('SCHEDULER_TEMPLATES_CACHE_SIZE', 1024))
+# dotted path of a callable issuing the runtime token of a FunctionInstance uuid, required
+# by the processes dispatching Jobs (drain_dispatch_queue and reconcile_jobs).
+SCHEDULER_RUNTIME_TOKEN_ISSUER = os.getenv('SCHEDULER_RUNTIME_TOKEN_ISSUER')
+
+# DISPATCH QUEUE
+# Jobs are submitted by batches, slots go first to the workspaces with the lowest running
+# Jobs per weight. Limits and weights of specific workspaces are JSON objects by uuid.
+DISPATCH_BATCH_SIZE = int(os.getenv('DISPATCH_BATCH_SIZE', 200))
+DISPATCH_MAX_RUNNING_PER_WORKSPACE = int(os.getenv('DISPATCH_MAX_RUNNING_PER_WORKSPACE', 100))
+DISPATCH_WORKSPACE_MAX_RUNNING = json.loads(os.getenv('DISPATCH_WORKSPACE_MAX_RUNNING', '{}'))
+DISPATCH_WORKSPACE_WEIGHTS = json.loads(os.getenv('DISPATCH_WORKSPACE_WEIGHTS', '{}'))
+DISPATCH_LEASE_TIMEOUT = float(os.getenv('DISPATCH_LEASE_TIMEOUT', 60))
+
+# JOBS RECONCILER
+# job status changes are applied by batches, flushed at least once per interval (in seconds).
+RECONCILER_BATCH_SIZE = int(os.getenv('RECONCILER_BATCH_SIZE', 500))
+RECONCILER_FLUSH_INTERVAL = float(os.getenv('RECONCILER_FLUSH_INTERVAL', 1))
+RECONCILER_WATCH_TIMEOUT = int(os.getenv('RECONCILER_WATCH_TIMEOUT', 300))
+RECONCILER_RETRY_DELAY = float(os.getenv('RECONCILER_RETRY_DELAY', 5))
+
+# VARIABLES STORAGE
+# payloads bigger than the threshold (in bytes) are kept out of the database.
+VARIABLES_BLOB_THRESHOLD = int(os.getenv('VARIABLES_BLOB_THRESHOLD', 64 * 1024))
+if os.getenv('VARIABLES_BLOB_S3_BUCKET'):
+    VARIABLES_BLOB_STORAGE = {
+        'BACKEND': 'common.storage.S3BlobStorage',
+        'OPTIONS': {
+            'bucket': os.getenv('VARIABLES_BLOB_S3_BUCKET'),
+            'prefix': os.getenv('VARIABLES_BLOB_S3_PREFIX', 'variables/'),
+            'endpoint_url': os.getenv('VARIABLES_BLOB_S3_ENDPOINT_URL'),
+        },
+    }
+else:
+    VARIABLES_BLOB_STORAGE = {
+        'BACKEND': 'common.storage.LocalBlobStorage',
+        'OPTIONS': {
+            'location': os.getenv('VARIABLES_BLOB_STORAGE_LOCATION', Path(BASE_DIR, 'blobs')),
+        },
+    }
+
+# released blobs, and payloads stored by rolled back transactions, are deleted by
+# collect_variable_blobs once older than the grace period (in seconds).
+VARIABLES_BLOB_GC_GRACE = float(os.getenv('VARIABLES_BLOB_GC_GRACE', 3600))
+
+# payloads are compressed when the codec shrinks them below the min ratio of their size.
+VARIABLES_COMPRESSION_CODEC = os.getenv('VARIABLES_COMPRESSION_CODEC', 'zlib')
+VARIABLES_COMPRESSION_MIN_SIZE = int(os.getenv('VARIABLES_COMPRESSION_MIN_SIZE', 1024))
+VARIABLES_COMPRESSION_MIN_RATIO = float(os.getenv('VARIABLES_COMPRESSION_MIN_RATIO', 0.9))
+
+# PUBLISH/SUBSCRIBE
+if os.getenv('PUBSUB_REDIS_URL'):
+    PUBSUB_BACKEND = {
+        'BACKEND': 'common.pubsub.RedisPubSubBackend',
+        'OPTIONS': {'url': os.getenv('PUBSUB_REDIS_URL')},
+    }
+else:
+    PUBSUB_BACKEND = {
+        'BACKEND': 'common.pubsub.LocalPubSubBackend',
+    }
+STREAM_EVENTS_KEEPALIVE = float(os.getenv('STREAM_EVENTS_KEEPALIVE', 15))
+
+# long-polling of the streams change feed, waits are cut by the poll interval
+# to catch changes whose notification was missed.
+STREAM_CHANGES_TIMEOUT = float(os.getenv('STREAM_CHANGES_TIMEOUT', 25))
+STREAM_CHANGES_MAX_TIMEOUT = float(os.getenv('STREAM_CHANGES_MAX_TIMEOUT', 60))
+STREAM_CHANGES_POLL_INTERVAL = float(os.getenv('STREAM_CHANGES_POLL_INTERVAL', 2))
+STREAM_CHANGES_LIMIT = int(os.getenv('STREAM_CHANGES_LIMIT', 500))
+# changes older than the retention (in seconds) are deleted by purge_stream_changes.
+STREAM_CHANGES_RETENTION = float(os.getenv('STREAM_CHANGES_RETENTION', 7 * 24 * 3600))
+
+# STATUS COUNTS
+# the workspace status counts are split in shards updated at random, run
+# reconcile_status_counts after raising it.
+STATUS_COUNTS_SHARDS = int(os.getenv('STATUS_COUNTS_SHARDS', 8))
+
+# ENTITIES API
+STREAMS_BULK_CANCEL_MAX_UUIDS = int(os.getenv('STREAMS_BULK_CANCEL_MAX_UUIDS', 5000))
+# total rows of the lists are counted by 'exact', 'estimated' or 'none' mode, estimates
+# without planner statistics count up to the cap.
+LIST_COUNT_DEFAULT_MODE = os.getenv('LIST_COUNT_DEFAULT_MODE', 'exact')
+LIST_COUNT_ESTIMATE_CAP = int(os.getenv('LIST_COUNT_ESTIMATE_CAP', 10000))
+
+# RUNTIME API
+RUNTIME_TOKEN_CACHE_MAXSIZE = int(os.getenv('RUNTIME_TOKEN_CACHE_MAXSIZE', 10000))
+RUNTIME_TOKEN_CACHE_TTL = float(os.getenv('RUNTIME_TOKEN_CACHE_TTL', 30))
+RUNTIME_LOG_BATCH_MAX_SIZE = int(os.getenv('RUNTIME_LOG_BATCH_MAX_SIZE', 1000))
+RUNTIME_LOG_STREAM_BATCH_SIZE = int(os.getenv('RUNTIME_LOG_STREAM_BATCH_SIZE', 500))
+RUNTIME_LOG_STREAM_MAX_LINE_SIZE = int(os.getenv('RUNTIME_LOG_STREAM_MAX_LINE_SIZE', 4096))
+RUNTIME_LOG_STREAM_MAX_ERRORS = int(os.getenv('RUNTIME_LOG_STREAM_MAX_ERRORS', 10))
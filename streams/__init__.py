@@ -1 +1 @@
-
+default_app_config = 'streams.apps.StreamsConfig'
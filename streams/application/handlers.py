@@ -1,8 +1,34 @@
+import logging
+
 from common.contracts import ApplicationHandler
+from .scheduler import StreamScheduler
+
+LOGGER = logging.getLogger('streams.scheduler')
 
 
 class PushedStreamHandler(ApplicationHandler):
+    """
+    Queues the instances of the pushed streams, their Jobs are submitted by the
+    drain_dispatch_queue processes instead of the requests.
+    """
     @classmethod
     def handle(cls, stream_id: int):
-        pass
+        """
+        Queues the instances of the stream that don't depend on any other.
+        """
+        return StreamScheduler.enqueue(stream_id)
+
+    @classmethod
+    def release(cls, function_instance):
+        """
+        Queues the instances of the stream released by a completed instance.
 
+        It runs once the completion is committed, so it never fails the request: the
+        reconciler releases the stream again when it watches the Job complete.
+        """
+        try:
+            return StreamScheduler.enqueue(function_instance.stream_id)
+        except Exception:
+            LOGGER.exception('failed to release the instances of stream %s',
+                             function_instance.stream_id)
+            return []
@@ -0,0 +1,114 @@
+"""
+Job manifests of the FunctionInstances, rendered from templates compiled per FunctionType.
+
+A template is the JSON encoding of the Job manifest with slots for the per-instance fields,
+rendering it only encodes those fields and formats them in.
+"""
+from functools import lru_cache
+import json
+import re
+from typing import NamedTuple, Optional, Union
+from uuid import UUID
+
+from settings import SCHEDULER_JOB_TTL, SCHEDULER_JOB_RESOURCES, SCHEDULER_TEMPLATES_CACHE_SIZE
+
+FI_UUID_LABEL = 'scalade.io/fi-uuid'
+STREAM_UUID_LABEL = 'scalade.io/stream-uuid'
+
+API_VERSION = 'batch/v1'
+
+# placeholders of the per-instance fields, the ones standing for JSON values are quoted
+_FI_HEX = '@@FI_HEX@@'
+_FI_UUID = '@@FI_UUID@@'
+_STREAM_UUID = '@@STREAM_UUID@@'
+_TOKEN_ENV = '@@TOKEN_ENV@@'
+_RESOURCES = '@@RESOURCES@@'
+_SLOTS = {
+    _FI_HEX: 'fi_hex',
+    _FI_UUID: 'fi_uuid',
+    _STREAM_UUID: 'stream_uuid',
+    # the optional env entry takes its separator along
+    f',"{_TOKEN_ENV}"': 'token_env',
+    f'"{_RESOURCES}"': 'resources',
+}
+_SLOTS_REGEX = re.compile('(%s)' % '|'.join(re.escape(slot) for slot in _SLOTS))
+
+_SEPARATORS = (',', ':')
+
+
+class JobManifest(NamedTuple):
+    """
+    A Job manifest encoded as the JSON body of its creation request.
+    """
+    name: str
+    body: bytes
+
+    def as_dict(self) -> dict:
+        return json.loads(self.body)
+
+
+class JobTemplate:
+    """
+    Job manifest of a FunctionType compiled into a format string of pre-encoded JSON.
+    """
+    def __init__(self, image: str, ttl: int = SCHEDULER_JOB_TTL,
+                 resources: dict = SCHEDULER_JOB_RESOURCES):
+        self.image = image
+        self._default_resources = json.dumps(resources, separators=_SEPARATORS)
+        self._body = self._compile(image, ttl)
+
+    def render(self, fi_uuid: UUID, stream_uuid: Union[UUID, str], token: Optional[str] = None,
+               resources: Optional[dict] = None) -> JobManifest:
+        """
+        Renders the manifest of a FunctionInstance, given resources replace the default ones.
+        """
+        name = f'fi-{fi_uuid.hex}'
+        values = {
+            'fi_hex': fi_uuid.hex,
+            'fi_uuid': str(fi_uuid),
+            'stream_uuid': str(stream_uuid),
+            'token_env': (',{"name":"SCALADE_RUNTIME_TOKEN","value":%s}' % json.dumps(token)
+                          if token else ''),
+            'resources': (json.dumps(resources, separators=_SEPARATORS) if resources is not None
+                          else self._default_resources),
+        }
+        return JobManifest(name, (self._body % values).encode())
+
+    @staticmethod
+    def _compile(image: str, ttl: int) -> str:
+        name = f'fi-{_FI_HEX}'
+        labels = {FI_UUID_LABEL: _FI_UUID, STREAM_UUID_LABEL: _STREAM_UUID}
+        manifest = {
+            'apiVersion': API_VERSION,
+            'kind': 'Job',
+            'metadata': {'name': name, 'labels': labels},
+            'spec': {
+                'ttlSecondsAfterFinished': ttl,
+                'backoffLimit': 0,
+                'template': {
+                    'metadata': {'labels': labels},
+                    'spec': {
+                        'containers': [{
+                            'name': name,
+                            'image': image,
+                            'env': [{'name': 'SCALADE_FI_UUID', 'value': _FI_UUID}, _TOKEN_ENV],
+                            'resources': _RESOURCES,
+                        }],
+                        'restartPolicy': 'Never',
+                    },
+                },
+            },
+        }
+        # the encoded manifest becomes a format string of the per-instance fields
+        return ''.join('%%(%s)s' % _SLOTS[part] if part in _SLOTS else part.replace('%', '%%')
+                       for part in _SLOTS_REGEX.split(
+                           json.dumps(manifest, separators=_SEPARATORS)))
+
+
+@lru_cache(maxsize=SCHEDULER_TEMPLATES_CACHE_SIZE)
+def get_job_template(function_type_uuid: UUID, updated, image: str) -> JobTemplate:
+    """
+    Returns the compiled template of a FunctionType, the change of its 'updated' field
+    compiles a new one.
+    """
+    return JobTemplate(image)
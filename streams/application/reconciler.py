@@ -0,0 +1,257 @@
+"""
+Reconciliation of the FunctionInstances statuses with the Kubernetes Jobs running them.
+
+A single watch of the Jobs of K8S_NAMESPACE streams their changes. The statuses they map
+to are applied in batches, then the resourceVersion reached is stored so that a restarted
+reconciler resumes from it. Transitions only move forward, replaying events is harmless.
+"""
+from collections import Counter
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from django.db import transaction
+from django.utils import timezone
+from scaladecore.entities import FunctionInstanceEntity
+
+from common.api import KubernetesAPI
+from common.exceptions import ResourceVersionExpiredError
+from common.utils import iter_batches
+from settings import RECONCILER_BATCH_SIZE, RECONCILER_FLUSH_INTERVAL, \
+    RECONCILER_WATCH_TIMEOUT, RECONCILER_RETRY_DELAY
+from streams.events import publish_fi_statuses
+from streams.models import FunctionInstanceModel, WatchCheckpointModel
+from .manifests import API_VERSION, FI_UUID_LABEL
+from .scheduler import get_scheduler
+
+JOBS_CHECKPOINT = 'k8s.jobs'
+
+RUNNING = FunctionInstanceEntity.STATUS[1][0]
+CANCELED = FunctionInstanceEntity.STATUS[-2][0]
+COMPLETED = FunctionInstanceEntity.STATUS[-1][0]
+
+LOGGER = logging.getLogger('streams.reconciler')
+
+_END = object()
+
+
+def job_fi_status(job: dict, deleted: bool = False) -> Optional[str]:
+    """
+    Returns the FunctionInstance status a Job stands for, if any.
+    """
+    status = job.get('status') or {}
+    for condition in status.get('conditions') or []:
+        if condition.get('status') == 'True':
+            if condition.get('type') == 'Complete':
+                return COMPLETED
+            if condition.get('type') == 'Failed':
+                return CANCELED
+    if deleted:
+        # finished Jobs are only deleted once their condition has been observed
+        return CANCELED
+    if status.get('active'):
+        return RUNNING
+    return None
+
+
+class KubernetesJobSource:
+    """
+    The Jobs of the FunctionInstances, listed and watched through KubernetesAPI.
+    """
+    def __init__(self, api: KubernetesAPI = None, timeout: int = RECONCILER_WATCH_TIMEOUT):
+        self.api = api or KubernetesAPI()
+        self.timeout = timeout
+
+    def list(self) -> Tuple[List[dict], str]:
+        body = self.api.list('job', API_VERSION, {'labelSelector': FI_UUID_LABEL})
+        return body['items'], body['metadata']['resourceVersion']
+
+    def watch(self, resource_version: str) -> Iterator[dict]:
+        return self.api.watch('job', API_VERSION, resource_version, self.timeout,
+                              {'labelSelector': FI_UUID_LABEL})
+
+
+class ReplayJobSource:
+    """
+    Stand-in of KubernetesJobSource replaying recorded watch events, to run offline.
+
+    The events are replayed by the first watch, whatever the resource version it resumes
+    from, the next ones end at once.
+    """
+    def __init__(self, events: Iterable[dict], items: List[dict] = None,
+                 resource_version: str = '0'):
+        self.events = list(events)
+        self.items = items or []
+        self.resource_version = resource_version
+
+    @classmethod
+    def from_file(cls, path: str) -> 'ReplayJobSource':
+        """
+        Reads the events from a file in the watch stream format: one JSON event per line.
+        """
+        with open(path, 'r') as file:
+            return cls([json.loads(line) for line in file if line.strip()])
+
+    def list(self) -> Tuple[List[dict], str]:
+        return self.items, self.resource_version
+
+    def watch(self, resource_version: str) -> Iterator[dict]:
+        events, self.events = self.events, []
+        for event in events:
+            if event['type'] == 'ERROR' and event['object'].get('code') == 410:
+                raise ResourceVersionExpiredError(resource_version)
+            yield event
+
+
+class JobReconciler:
+    """
+    Applies the statuses of the watched Jobs to their FunctionInstances.
+
+    Changes are buffered, the latest status of each instance wins, and flushed once
+    'batch_size' instances changed or every 'flush_interval' seconds.
+    """
+    def __init__(self, source=None, batch_size: int = RECONCILER_BATCH_SIZE,
+                 flush_interval: float = RECONCILER_FLUSH_INTERVAL,
+                 checkpoint: str = JOBS_CHECKPOINT, scheduler=None):
+        self.source = source or KubernetesJobSource()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.checkpoint = checkpoint
+        self.stats = Counter()
+        # a misconfigured scheduler fails here, before watching anything
+        self.scheduler = scheduler or get_scheduler()
+        self._pending: Dict[UUID, str] = {}
+        self._stored_version = None
+
+    def run(self, stop: threading.Event = None):
+        """
+        Reconciles until stopped, watches are resumed as the server ends them.
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                self.reconcile_once(stop)
+            except Exception:
+                LOGGER.exception('jobs watch failed, retrying in %ss', RECONCILER_RETRY_DELAY)
+                stop.wait(RECONCILER_RETRY_DELAY)
+
+    def reconcile_once(self, stop: threading.Event = None) -> Optional[str]:
+        """
+        Consumes one watch stream from the stored resource version, the Jobs are listed
+        first when there is none. It returns the resource version reached.
+        """
+        resource_version = WatchCheckpointModel.load(self.checkpoint)
+        self._stored_version = resource_version
+        if resource_version is None:
+            resource_version = self.relist()
+
+        events = queue.Queue()
+        reader = threading.Thread(target=self._read, args=(resource_version, events),
+                                  daemon=True)
+        reader.start()
+        flushed = time.monotonic()
+        while not (stop and stop.is_set()):
+            try:
+                event = events.get(
+                    timeout=max(0.0, self.flush_interval - (time.monotonic() - flushed)))
+            except queue.Empty:
+                self.flush(resource_version)
+                flushed = time.monotonic()
+                continue
+
+            if event is _END:
+                break
+            if isinstance(event, ResourceVersionExpiredError):
+                self.flush(resource_version)
+                WatchCheckpointModel.store(self.checkpoint, None)
+                return None
+            if isinstance(event, Exception):
+                self.flush(resource_version)
+                raise event
+            if event['type'] == 'ERROR':
+                LOGGER.error('jobs watch error: %s', event['object'])
+                break
+
+            self.stats['events'] += 1
+            if event['type'] != 'BOOKMARK':
+                self._observe(event['object'], deleted=event['type'] == 'DELETED')
+            resource_version = event['object']['metadata']['resourceVersion']
+            if len(self._pending) >= self.batch_size:
+                self.flush(resource_version)
+                flushed = time.monotonic()
+
+        self.flush(resource_version)
+        return resource_version
+
+    def relist(self) -> str:
+        """
+        Applies the statuses of every Job, it returns the resource version of the list.
+        """
+        items, resource_version = self.source.list()
+        for job in items:
+            self._observe(job)
+        self.flush(resource_version)
+        self.stats['relists'] += 1
+        return resource_version
+
+    def flush(self, resource_version: str) -> Dict[UUID, Tuple[UUID, str, str]]:
+        """
+        Applies the buffered statuses in batches and stores the resource version reached,
+        the instances of completed ones are released to the scheduler, which drains its
+        queue into the Job slots freed.
+        """
+        pending, self._pending = self._pending, {}
+        applied = {}
+        for batch in iter_batches(pending.items(), self.batch_size):
+            now = timezone.now()
+            with transaction.atomic():
+                transitions = FunctionInstanceModel.transition_many(dict(batch), now)
+                if transitions:
+                    publish_fi_statuses(transitions, now)
+            applied.update(transitions)
+
+        if resource_version != self._stored_version:
+            WatchCheckpointModel.store(self.checkpoint, resource_version)
+            self._stored_version = resource_version
+
+        self.stats['transitions'] += len(applied)
+        completed = {stream_uuid for stream_uuid, _, status in applied.values()
+                     if status == COMPLETED}
+        for stream_uuid in completed:
+            try:
+                self.scheduler.release(stream_uuid)
+            except Exception:
+                LOGGER.exception('failed to release the instances of stream %s', stream_uuid)
+        if applied and not completed:
+            # finished instances free Job slots of the instances queued by their workspaces
+            try:
+                self.scheduler.drain()
+            except Exception:
+                LOGGER.exception('failed to drain the dispatch queue')
+        return applied
+
+    def _observe(self, job: dict, deleted: bool = False):
+        labels = job['metadata'].get('labels') or {}
+        status = job_fi_status(job, deleted)
+        if not status or FI_UUID_LABEL not in labels:
+            return
+        try:
+            fi_uuid = UUID(labels[FI_UUID_LABEL])
+        except ValueError:
+            LOGGER.warning('job %s has an invalid %s label', job['metadata'].get('name'),
+                           FI_UUID_LABEL)
+            return
+        self._pending[fi_uuid] = status
+
+    def _read(self, resource_version: str, events: queue.Queue):
+        try:
+            for event in self.source.watch(resource_version):
+                events.put(event)
+        except Exception as exc:
+            events.put(exc)
+        else:
+            events.put(_END)
@@ -0,0 +1,293 @@
+"""
+Dependency-driven dispatch of the FunctionInstances of pushed streams to Kubernetes.
+
+A FunctionInstance depends on every instance of the preceding column of its stream, it is
+ready once all of them are completed. Columns stand for the wiring of the variables: the
+inputs of an instance are given as values when the stream is created, none of them refers
+to the output of another instance yet. Ready instances are claimed and queued in the
+database, so concurrent releases of the same stream never dispatch an instance twice. The
+queue is drained fairly between workspaces, within their maximum of running Jobs.
+"""
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import heapq
+import json
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+from uuid import UUID
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from scaladecore.entities import FunctionInstanceEntity, StreamEntity
+
+from common.api import KubernetesAPI
+from common.pubsub import get_pubsub
+from settings import SCHEDULER_MAX_WORKERS, SCHEDULER_DISPATCH_LATENCY_TARGET, \
+    SCHEDULER_RUNTIME_TOKEN_ISSUER, DISPATCH_BATCH_SIZE
+from streams.managers import percentile_cont
+from streams.models import FunctionInstanceModel, DispatchQueueModel
+from .manifests import API_VERSION, JobManifest, get_job_template
+
+PENDING = FunctionInstanceEntity.STATUS[0][0]
+COMPLETED = FunctionInstanceEntity.STATUS[-1][0]
+PUSHED = StreamEntity.STATUS[1][0]
+
+LOGGER = logging.getLogger('streams.scheduler')
+
+# wakes the drain_dispatch_queue processes up when instances are queued
+DISPATCH_CHANNEL = 'dispatch-queue'
+
+
+def build_dependencies(positions: Dict[UUID, Tuple[int, int]]) -> Dict[UUID, Set[UUID]]:
+    """
+    Returns the upstream instances of each instance given their (row, col) positions.
+
+    The upstream instances are those of the nearest preceding column holding any, whatever
+    their row, the instances of the first column have none. It is a simplification of the
+    wiring of their variables, which isn't stored.
+    """
+    columns: Dict[int, Set[UUID]] = {}
+    for uuid, (_, col) in positions.items():
+        columns.setdefault(col, set()).add(uuid)
+
+    dependencies, upstream = {}, set()
+    for col in sorted(columns):
+        for uuid in columns[col]:
+            dependencies[uuid] = upstream
+        upstream = columns[col]
+    return dependencies
+
+
+def create_job(manifest: JobManifest):
+    response = KubernetesAPI().create_encoded('job', API_VERSION, manifest.body)
+    # a conflict is a Job already submitted before its queue entry lease expired
+    if response.status_code != 409:
+        response.raise_for_status()
+    return response
+
+
+def fair_shares(queued: Dict[UUID, int], running: Dict[UUID, int], max_running: Dict[UUID, int],
+                weights: Dict[UUID, float], budget: int) -> Dict[UUID, int]:
+    """
+    Splits a budget of Jobs between the workspaces with queued instances.
+
+    Each Job goes to the workspace with the lowest running Jobs per weight, among the ones
+    below their maximum, so that a workspace with a huge backlog never starves the others.
+    """
+    heap = [(running.get(workspace_id, 0) / weights[workspace_id], str(workspace_id),
+             workspace_id)
+            for workspace_id in queued if running.get(workspace_id, 0) < max_running[workspace_id]]
+    heapq.heapify(heap)
+    shares = Counter()
+    while budget and heap:
+        _, key, workspace_id = heapq.heappop(heap)
+        shares[workspace_id] += 1
+        budget -= 1
+        load = running.get(workspace_id, 0) + shares[workspace_id]
+        if shares[workspace_id] < queued[workspace_id] and load < max_running[workspace_id]:
+            heapq.heappush(heap, (load / weights[workspace_id], key, workspace_id))
+    return dict(shares)
+
+
+class DispatchLatency:
+    """
+    Latest delays, in seconds, between the completion of an upstream instance and the
+    submission of the Jobs it released.
+    """
+    def __init__(self, target: float, max_samples: int = 1000):
+        self.target = target
+        self.over_target = 0
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> bool:
+        """
+        Records a delay, it returns False when it exceeds the target.
+        """
+        with self._lock:
+            self._samples.append(seconds)
+            if seconds > self.target:
+                self.over_target += 1
+                return False
+        return True
+
+    def percentiles(self, fractions: Iterable[float]) -> Dict[str, Optional[float]]:
+        with self._lock:
+            samples = sorted(self._samples)
+        return {f'p{round(fraction * 100):g}': percentile_cont(samples, fraction) if samples
+                else None for fraction in fractions}
+
+    @property
+    def stats(self) -> dict:
+        return {'samples': len(self), 'target': self.target, 'over_target': self.over_target,
+                **self.percentiles((0.5, 0.9, 0.99))}
+
+    def __len__(self):
+        return len(self._samples)
+
+
+# delays of the Jobs submitted by the scheduler of the process
+DISPATCH_LATENCY = DispatchLatency(SCHEDULER_DISPATCH_LATENCY_TARGET)
+
+
+class StreamScheduler:
+    """
+    Queues the ready FunctionInstances of the streams and submits their Jobs through a
+    bounded pool of workers.
+    """
+    def __init__(self, dispatch: Callable[[JobManifest], object] = create_job,
+                 max_workers: int = SCHEDULER_MAX_WORKERS,
+                 latency: Optional[DispatchLatency] = None,
+                 token_issuer: Optional[Callable[[UUID], str]] = None,
+                 batch_size: int = DISPATCH_BATCH_SIZE):
+        self._dispatch = dispatch
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='stream-scheduler')
+        self._token_issuer = token_issuer
+        self.latency = latency or DispatchLatency(SCHEDULER_DISPATCH_LATENCY_TARGET)
+
+    def schedule(self, stream_uuid: Union[UUID, str]) -> List[UUID]:
+        """
+        Queues every ready instance of the stream and drains the queue, it returns the
+        instances submitted.
+        """
+        return self._dispatch_ready(stream_uuid)
+
+    def release(self, stream_uuid: Union[UUID, str]) -> List[UUID]:
+        """
+        Dispatches the instances of the stream released by completed upstream instances.
+        """
+        return self._dispatch_ready(stream_uuid)
+
+    @classmethod
+    def enqueue(cls, stream_uuid: Union[UUID, str]) -> List[UUID]:
+        """
+        Queues every ready instance of the stream, without submitting their Jobs, and
+        signals the processes draining the queue. It returns the instances queued.
+        """
+        queued = cls._enqueue_ready(stream_uuid)
+        if queued:
+            get_pubsub().publish(DISPATCH_CHANNEL, {'stream': str(stream_uuid),
+                                                    'queued': len(queued)})
+        return queued
+
+    def drain(self) -> List[UUID]:
+        """
+        Submits the Jobs of the queued instances the workspaces have room for, it returns
+        the instances submitted.
+
+        The delay between the completion of the last upstream instance and the submission
+        is recorded for each instance that has any.
+        """
+        DispatchQueueModel.purge()
+        available = DispatchQueueModel.available()
+        queued = dict(available.order_by().values('workspace').annotate(
+            total=Count('id')).values_list('workspace', 'total'))
+        if not queued:
+            return []
+
+        # the running Jobs are counted under the lock of the workspaces, so concurrent
+        # drains see the leases of each other and never exceed their maximum together
+        with transaction.atomic():
+            DispatchQueueModel.lock_workspaces(list(queued))
+            running = DispatchQueueModel.running_by_workspace(list(queued))
+            shares = fair_shares(
+                queued, running,
+                {workspace_id: DispatchQueueModel.max_running(workspace_id)
+                 for workspace_id in queued},
+                {workspace_id: DispatchQueueModel.weight(workspace_id) for workspace_id in queued},
+                self.batch_size)
+            leased = DispatchQueueModel.lease(shares)
+        if not leased:
+            return []
+
+        manifests = [get_job_template(*function_type).render(
+                         fi_uuid, stream_id,
+                         self._token_issuer(fi_uuid) if self._token_issuer else None)
+                     for _, _, fi_uuid, stream_id, *function_type in leased]
+        results = self._executor.map(self._submit, manifests)
+        dispatched, failed = [], []
+        for (entry_id, released, fi_uuid, *_), submitted in zip(leased, results):
+            (dispatched if submitted else failed).append((entry_id, fi_uuid))
+            if submitted and released:
+                self._record_latency(fi_uuid, released)
+
+        DispatchQueueModel.objects.filter(id__in=[entry_id for entry_id, _ in dispatched]).delete()
+        if failed:
+            # failed entries are leased again by the next drain
+            DispatchQueueModel.objects.filter(
+                id__in=[entry_id for entry_id, _ in failed]).update(dispatched=None)
+        return [fi_uuid for _, fi_uuid in dispatched]
+
+    def _record_latency(self, fi_uuid: UUID, released):
+        latency = (timezone.now() - released).total_seconds()
+        if not self.latency.record(latency):
+            LOGGER.warning('function instance %s dispatched %.3fs after its release, over '
+                           'the %.3fs target', fi_uuid, latency, self.latency.target)
+
+    def _dispatch_ready(self, stream_uuid: Union[UUID, str]) -> List[UUID]:
+        self._enqueue_ready(stream_uuid)
+        return self.drain()
+
+    def _submit(self, manifest: JobManifest) -> bool:
+        try:
+            self._dispatch(manifest)
+        except Exception:
+            LOGGER.exception('failed to dispatch %s', manifest.name)
+            return False
+        return True
+
+    @staticmethod
+    def _enqueue_ready(stream_uuid: Union[UUID, str]) -> List[UUID]:
+        """
+        Marks the ready instances of the stream as initialized and queues them, it returns
+        the ones claimed by this call. Nothing is queued unless the stream is pushed.
+        """
+        instances = FunctionInstanceModel.objects.filter(stream_id=stream_uuid).order_by()
+        rows = {uuid: (json.loads(position), status, initialized, completed)
+                for uuid, position, status, initialized, completed in instances.values_list(
+                    'uuid', 'position', 'status', 'initialized', 'completed')}
+        dependencies = build_dependencies(
+            {uuid: (position['row'], position['col'])
+             for uuid, (position, *_) in rows.items()})
+        ready = [uuid for uuid, (_, status, initialized, _) in rows.items()
+                 if status == PENDING and initialized is None
+                 and all(rows[upstream][1] == COMPLETED for upstream in dependencies[uuid])]
+        if not ready:
+            return []
+
+        now = timezone.now()
+        with transaction.atomic(savepoint=False):
+            # the stream row is locked too, so it can't be paused or cancelled meanwhile
+            unclaimed = instances.select_for_update(of=('self', 'stream')).filter(
+                uuid__in=ready, status=PENDING, initialized__isnull=True,
+                stream__status=PUSHED)
+            claimed = list(unclaimed.values_list('uuid', 'stream__workspace'))
+            FunctionInstanceModel.objects.filter(
+                uuid__in=[uuid for uuid, _ in claimed]).update(initialized=now)
+            DispatchQueueModel.enqueue(claimed, now, released={
+                uuid: max((rows[upstream][3] for upstream in dependencies[uuid]
+                           if rows[upstream][3]), default=None)
+                for uuid, _ in claimed})
+        return [uuid for uuid, _ in claimed]
+
+
+@lru_cache(maxsize=None)
+def get_scheduler() -> StreamScheduler:
+    """
+    Returns the scheduler shared by the process, its Jobs are created through KubernetesAPI.
+
+    It raises ImproperlyConfigured without a SCHEDULER_RUNTIME_TOKEN_ISSUER, the Jobs could
+    never call the runtime API without their token.
+    """
+    if not SCHEDULER_RUNTIME_TOKEN_ISSUER:
+        raise ImproperlyConfigured(
+            'SCHEDULER_RUNTIME_TOKEN_ISSUER must be set to dispatch the function instances.')
+    return StreamScheduler(latency=DISPATCH_LATENCY,
+                           token_issuer=import_string(SCHEDULER_RUNTIME_TOKEN_ISSUER))
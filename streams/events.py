@@ -0,0 +1,169 @@
+"""
+Incremental changes of a stream and its FunctionInstances, pushed to the application clients.
+
+Every change is appended to the change feed of the stream and published to its channel.
+
+The writers of a feed are serialized by the lock of the stream row until they commit, so
+its changes are given their 'seq' in commit order: readers never see a change while one
+with a lower seq may still be committed, which they would skip.
+"""
+import json
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from uuid import UUID
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from scaladecore.entities import StreamEntity
+
+from common.pubsub import get_pubsub
+from settings import STREAM_CHANGES_POLL_INTERVAL
+from .models import StreamChangeModel, StreamModel
+
+STREAM_STATUS = 'stream.status'
+FI_STATUS = 'fi.status'
+FI_LOG_MESSAGES = 'fi.log_messages'
+FI_OUTPUT = 'fi.output'
+
+LOGGER = logging.getLogger('streams.events')
+
+
+def stream_channel(stream_uuid: Union[UUID, str]) -> str:
+    return f'streams.{stream_uuid}'
+
+
+def record_change(stream_uuid: Union[UUID, str], type_: str, data: dict,
+                  fi_uuid: Optional[Union[UUID, str]] = None) -> StreamChangeModel:
+    """
+    Appends a change to the feed of the stream and publishes it to the stream channel.
+
+    The change row belongs to the current transaction, it is only published once the
+    transaction commits so that subscribers never see changes that are rolled back. A
+    failing backend never fails the change itself, long-polling clients still get it.
+    """
+    with transaction.atomic(savepoint=False):
+        _lock_feeds([stream_uuid])
+        change = StreamChangeModel.objects.create(
+            stream_id=stream_uuid,
+            function_instance_id=fi_uuid,
+            type=type_,
+            data=json.dumps(data, cls=DjangoJSONEncoder))
+    _publish_on_commit([change])
+    return change
+
+
+def record_changes(changes: List[Tuple[Union[UUID, str], str, dict, Optional[Union[UUID, str]]]]
+                   ) -> List[StreamChangeModel]:
+    """
+    Appends many stream changes, given as (stream_uuid, type, data, fi_uuid), in a single
+    insert.
+    """
+    with transaction.atomic(savepoint=False):
+        _lock_feeds([stream_uuid for stream_uuid, *_ in changes])
+        changes = StreamChangeModel.objects.bulk_create([
+            StreamChangeModel(stream_id=stream_uuid,
+                              function_instance_id=fi_uuid,
+                              type=type_,
+                              data=json.dumps(data, cls=DjangoJSONEncoder))
+            for stream_uuid, type_, data, fi_uuid in changes])
+    _publish_on_commit(changes)
+    return changes
+
+
+def _lock_feeds(stream_uuids: List[Union[UUID, str]]):
+    StreamModel.lock(stream_uuids)
+
+
+def _publish_on_commit(changes: List[StreamChangeModel]):
+    events = [(stream_channel(change.stream_id), change.as_dict) for change in changes]
+
+    def publish():
+        backend = get_pubsub()
+        for channel, event in events:
+            try:
+                backend.publish(channel, event)
+            except Exception:
+                LOGGER.exception("Couldn't publish '%s' event to '%s'.", event['type'], channel)
+
+    transaction.on_commit(publish)
+
+
+def wait_for_changes(stream_uuid: Union[UUID, str], since: int, timeout: float,
+                     limit: int) -> Tuple[List[StreamChangeModel], bool]:
+    """
+    Returns the first 'limit' changes of the stream after the 'since' cursor, waiting up to
+    'timeout' seconds for any. It also tells whether more changes are pending.
+    """
+    changes = StreamChangeModel.objects.filter(stream_id=stream_uuid, seq__gt=since)
+    deadline = time.monotonic() + timeout
+    while True:
+        found = list(changes.order_by('seq')[:limit + 1])
+        remaining = deadline - time.monotonic()
+        if found or remaining <= 0:
+            return found[:limit], len(found) > limit
+        get_pubsub().wait(stream_channel(stream_uuid),
+                          min(remaining, STREAM_CHANGES_POLL_INTERVAL))
+
+
+def publish_stream_status(stream):
+    record_change(stream.uuid, STREAM_STATUS, {
+        'status': stream.status,
+        'updated': stream.updated,
+    })
+
+
+def publish_streams_cancelled(cancelled: Dict[UUID, int],
+                              transitions: Dict[UUID, Tuple[UUID, str, str]]):
+    """
+    Publishes the cancelled streams and the statuses of their function instances, given
+    as returned by StreamModel.cancel_many.
+    """
+    now = timezone.now()
+    record_changes([
+        (stream_uuid, STREAM_STATUS, {'status': StreamEntity.STATUS[-2][0],
+                                      'updated': now,
+                                      'cancelled_functions': total}, None)
+        for stream_uuid, total in cancelled.items()] + [
+        (stream_uuid, FI_STATUS, {'status': status, 'updated': now}, fi_uuid)
+        for fi_uuid, (stream_uuid, _, status) in transitions.items()])
+
+
+def publish_fi_status(function_instance):
+    record_change(function_instance.stream_id, FI_STATUS, {
+        'status': function_instance.status,
+        'updated': function_instance.updated,
+    }, fi_uuid=function_instance.uuid)
+
+
+def publish_fi_statuses(transitions: Dict[UUID, Tuple[UUID, str, str]], updated):
+    """
+    Publishes the statuses of many function instances, given as returned by
+    FunctionInstanceModel.transition_many.
+    """
+    record_changes([
+        (stream_uuid, FI_STATUS, {'status': status, 'updated': updated}, fi_uuid)
+        for fi_uuid, (stream_uuid, _, status) in transitions.items()])
+
+
+def publish_fi_log_messages(function_instance, log_messages: Iterable):
+    data = [{'uuid': str(lm.uuid),
+             'created': lm.created,
+             'log_level': lm.log_level,
+             'log_message': lm.log_message, }
+            for lm in log_messages]
+    if data:
+        record_change(function_instance.stream_id, FI_LOG_MESSAGES, {'log_messages': data},
+                      fi_uuid=function_instance.uuid)
+
+
+def publish_fi_output(function_instance, variable):
+    record_change(function_instance.stream_id, FI_OUTPUT, {
+        'uuid': str(variable.uuid),
+        'created': variable.created,
+        'id_name': variable.id_name,
+        'type': variable.type,
+        'rank': variable.rank,
+        'size': variable.size,
+    }, fi_uuid=function_instance.uuid)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from settings import VARIABLES_BLOB_GC_GRACE
+from streams.models import VariableBlobModel
+
+
+class Command(BaseCommand):
+    help = ('Deletes the variable blobs no longer referenced, and the stored payloads '
+            'without a blob, from the blob storage.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=float, default=VARIABLES_BLOB_GC_GRACE,
+                            help='Only delete those unreferenced for over GRACE seconds.')
+
+    def handle(self, *args, **options):
+        collected, orphans = VariableBlobModel.collect(options['grace'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {collected} released blobs and {orphans} unreferenced payloads.'))
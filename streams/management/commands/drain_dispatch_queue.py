@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from common.pubsub import get_pubsub
+from streams.application.scheduler import DISPATCH_CHANNEL, get_scheduler
+
+
+class Command(BaseCommand):
+    help = ('Submits the Jobs of the queued function instances their workspaces have room '
+            'for, those queued by the API requests or left queued by a restarted process.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Keep draining until interrupted, as soon as instances are '
+                                 'queued or every INTERVAL seconds at the latest.')
+
+    def handle(self, *args, **options):
+        scheduler = get_scheduler()
+        dispatched = 0
+        try:
+            while True:
+                drained = scheduler.drain()
+                dispatched += len(drained)
+                if not options['interval']:
+                    break
+                # a full batch may have left more entries the workspaces have room for
+                if len(drained) < scheduler.batch_size:
+                    get_pubsub().wait(DISPATCH_CHANNEL, options['interval'])
+        except KeyboardInterrupt:
+            pass
+        latency = scheduler.latency.stats
+        self.stdout.write(self.style.SUCCESS(
+            f'Dispatched {dispatched} function instances, released ones in '
+            f"p50={latency['p50']}s p90={latency['p90']}s p99={latency['p99']}s, "
+            f"{latency['over_target']} over the {latency['target']}s target."))
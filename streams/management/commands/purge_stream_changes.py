@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from settings import STREAM_CHANGES_RETENTION
+from streams.models import StreamChangeModel
+
+
+class Command(BaseCommand):
+    help = 'Deletes the changes of the streams feeds older than their retention.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention', type=float, default=STREAM_CHANGES_RETENTION,
+                            help='Keep the changes of the last RETENTION seconds.')
+
+    def handle(self, *args, **options):
+        deleted = StreamChangeModel.purge(
+            timezone.now() - timedelta(seconds=options['retention']))
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} stream changes.'))
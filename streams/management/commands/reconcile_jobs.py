@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from streams.application.reconciler import JobReconciler, ReplayJobSource
+
+
+class Command(BaseCommand):
+    help = ('Watches the Kubernetes Jobs of the function instances and applies their '
+            'statuses, until interrupted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Stop when the server ends the watch.')
+        parser.add_argument('--replay', metavar='FILE',
+                            help='Replay the recorded watch events of FILE instead of '
+                                 'watching the cluster.')
+
+    def handle(self, *args, **options):
+        source = ReplayJobSource.from_file(options['replay']) if options['replay'] else None
+        reconciler = JobReconciler(source)
+        try:
+            if options['once'] or source:
+                reconciler.reconcile_once()
+            else:
+                reconciler.run()
+        except KeyboardInterrupt:
+            pass
+        stats = reconciler.stats
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {stats['events']} events, applied {stats['transitions']} transitions "
+            f"and listed the jobs {stats['relists']} times."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from streams.models import StreamModel, StatusCountModel
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the streams function counters and the workspaces status counts.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            streams = StreamModel.refresh_function_counters(StreamModel.objects.all())
+            StatusCountModel.reconcile()
+        self.stdout.write(self.style.SUCCESS(
+            f'Reconciled the counters of {streams} streams and the workspaces status counts.'))
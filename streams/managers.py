@@ -0,0 +1,115 @@
+from datetime import datetime
+from itertools import groupby
+import math
+from operator import itemgetter
+from typing import Dict, Iterable, List
+
+from django.db import connection, models
+
+
+class FunctionInstanceManager(models.Manager):
+    def get_context(self, *args, **kwargs):
+        """
+        Gets a function instance with its runtime context loaded in two queries.
+
+        The function type, the stream and their accounts are joined in, and the
+        variables are prefetched ordered by rank into 'context_variables'.
+        """
+        from .models import VariableModel
+        variables = VariableModel.objects.order_by('rank')
+        queryset = self.select_related(
+            'function_type__account', 'stream__account').prefetch_related(
+            models.Prefetch('variables', queryset=variables, to_attr='context_variables'))
+        return queryset.get(*args, **kwargs)
+
+
+class StreamManager(models.Manager):
+    @staticmethod
+    def detail_prefetches(variable_columns: Iterable[str] = None) -> List[models.Prefetch]:
+        """
+        Prefetches of the stream detail: its function instances, then all their variables
+        ordered by rank into 'context_variables', loading only the given variable columns.
+        """
+        from .models import FunctionInstanceModel, VariableModel
+        variables = VariableModel.objects.order_by('rank')
+        if variable_columns is not None:
+            variables = variables.only('function_instance', 'iot', 'rank', *variable_columns)
+        functions = FunctionInstanceModel.objects.prefetch_related(
+            models.Prefetch('variables', queryset=variables, to_attr='context_variables'))
+        return [models.Prefetch('functions', queryset=functions)]
+
+    def get_detail(self, *args, variable_columns: Iterable[str] = None, **kwargs):
+        """
+        Gets a stream with its detail loaded in three queries, whatever its size.
+        """
+        return self.prefetch_related(*self.detail_prefetches(variable_columns)).get(
+            *args, **kwargs)
+
+    def prefetch_detail(self, streams: List, variable_columns: Iterable[str] = None) -> List:
+        """
+        Loads the detail of streams already fetched, in two queries.
+        """
+        models.prefetch_related_objects(streams, *self.detail_prefetches(variable_columns))
+        return streams
+
+
+class PercentileCont(models.Aggregate):
+    """
+    Continuous percentile of an ordered set, available on PostgreSQL.
+    """
+    function = 'PERCENTILE_CONT'
+    name = 'PercentileCont'
+    template = '%(function)s(%(fraction)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+
+    def __init__(self, expression, fraction: float, **extra):
+        super().__init__(expression, fraction=float(fraction), **extra)
+
+
+def percentile_cont(ordered_values: List, fraction: float):
+    """
+    Interpolated percentile of sorted values, as computed by PERCENTILE_CONT.
+    """
+    position = (len(ordered_values) - 1) * fraction
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return ordered_values[lower] + (ordered_values[upper] - ordered_values[lower]) * (
+        position - lower)
+
+
+class FunctionInstanceTransitionManager(models.Manager):
+    # time spent in each status is reported by the name of the metric
+    METRICS = {'pending': 'queue_wait', 'running': 'run_time', 'blocked': 'blocked_time'}
+
+    def time_in_status_percentiles(self, since: datetime, until: datetime,
+                                   percentiles: Iterable[float]) -> Dict[str, dict]:
+        """
+        Returns the percentiles, in seconds, of the time function instances spent in each
+        status before leaving it between 'since' and 'until', by function type.
+
+        They are computed by the database on PostgreSQL, otherwise from a single query
+        fetching the ordered durations.
+        """
+        percentiles = sorted(set(percentiles))
+        transitions = self.filter(created__gte=since, created__lt=until,
+                                  from_status__in=self.METRICS.keys(),
+                                  elapsed__isnull=False).order_by()
+        metrics = {}
+        if connection.vendor == 'postgresql':
+            rows = transitions.values('function_type', 'from_status').annotate(
+                count=models.Count('id'),
+                **{f'p{pct:g}': PercentileCont('elapsed', pct / 100) for pct in percentiles})
+            for row in rows:
+                metrics.setdefault(str(row['function_type']), {})[
+                    self.METRICS[row['from_status']]] = {
+                    'count': row['count'],
+                    **{f'p{pct:g}': row[f'p{pct:g}'].total_seconds() for pct in percentiles}}
+            return metrics
+
+        rows = transitions.order_by('function_type', 'from_status', 'elapsed').values_list(
+            'function_type', 'from_status', 'elapsed')
+        for (function_type, from_status), group in groupby(rows, key=itemgetter(0, 1)):
+            durations = [elapsed.total_seconds() for _, _, elapsed in group]
+            metrics.setdefault(str(function_type), {})[self.METRICS[from_status]] = {
+                'count': len(durations),
+                **{f'p{pct:g}': percentile_cont(durations, pct / 100) for pct in percentiles}}
+        return metrics
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_outputs_count(apps, schema_editor):
+    FunctionInstanceModel = apps.get_model('streams', 'FunctionInstanceModel')
+    VariableModel = apps.get_model('streams', 'VariableModel')
+    last_rank = VariableModel.objects.filter(
+        function_instance=models.OuterRef('pk'),
+        iot='output').order_by('-rank').values('rank')[:1]
+    FunctionInstanceModel.objects.update(
+        outputs_count=Coalesce(models.Subquery(last_rank) + 1, 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='functioninstancemodel',
+            name='outputs_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of output ranks allocated.'),
+        ),
+        migrations.RunPython(backfill_outputs_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_size_and_checksum(apps, schema_editor):
+    VariableModel = apps.get_model('streams', 'VariableModel')
+    batch = []
+    for variable in VariableModel.objects.only('uuid', 'bytes').iterator(chunk_size=500):
+        content = bytes(variable.bytes)
+        variable.size = len(content)
+        variable.checksum = hashlib.sha256(content).hexdigest()
+        batch.append(variable)
+        if len(batch) == 500:
+            VariableModel.objects.bulk_update(batch, ['size', 'checksum'])
+            batch = []
+    if batch:
+        VariableModel.objects.bulk_update(batch, ['size', 'checksum'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0002_functioninstancemodel_outputs_count'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='variablemodel',
+            name='bytes',
+            field=models.BinaryField(blank=True, default=b'', help_text='Inline payload, empty when it is kept in the blob storage.'),
+        ),
+        migrations.AddField(
+            model_name='variablemodel',
+            name='size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='variablemodel',
+            name='checksum',
+            field=models.CharField(blank=True, help_text='SHA-256 of the payload.', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='variablemodel',
+            name='blob_ref',
+            field=models.CharField(blank=True, help_text='Reference of the payload in the blob storage.', max_length=255, null=True),
+        ),
+        migrations.RunPython(backfill_size_and_checksum, migrations.RunPython.noop),
+    ]
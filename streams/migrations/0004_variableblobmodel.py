@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+
+def backfill_variable_blobs(apps, schema_editor):
+    VariableModel = apps.get_model('streams', 'VariableModel')
+    VariableBlobModel = apps.get_model('streams', 'VariableBlobModel')
+    references = VariableModel.objects.exclude(blob_ref=None).values(
+        'blob_ref').annotate(total=models.Count('uuid'), size=models.Max('size'))
+    VariableBlobModel.objects.bulk_create([
+        VariableBlobModel(checksum=ref['blob_ref'], size=ref['size'], ref_count=ref['total'])
+        for ref in references], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0003_variable_blob_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VariableBlobModel',
+            fields=[
+                ('checksum', models.CharField(help_text='SHA-256 of the payload, its blob storage key.', max_length=64, primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0, help_text='Number of variables referencing it.')),
+            ],
+            options={
+                'verbose_name': 'Variable Blob',
+                'db_table': 'variable_blobs',
+                'ordering': ['-created'],
+            },
+        ),
+        migrations.RunPython(backfill_variable_blobs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0004_variableblobmodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='variablemodel',
+            name='codec',
+            field=models.CharField(choices=[('identity', 'Identity'), ('zlib', 'Zlib'), ('lzma', 'LZMA')], default='identity', help_text='Compression the payload is stored with.', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='variableblobmodel',
+            name='codec',
+            field=models.CharField(choices=[('identity', 'Identity'), ('zlib', 'Zlib'), ('lzma', 'LZMA')], default='identity', max_length=10),
+        ),
+    ]
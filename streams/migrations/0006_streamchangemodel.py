@@ -0,0 +1,28 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0005_variable_codec'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StreamChangeModel',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('type', models.CharField(max_length=50)),
+                ('data', models.TextField()),
+                ('function_instance', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='streams.functioninstancemodel')),
+                ('stream', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='streams.streammodel')),
+            ],
+            options={
+                'verbose_name': 'Stream Change',
+                'db_table': 'stream_changes',
+                'ordering': ['seq'],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+FUNCTION_STATUSES = ('pending', 'running', 'blocked', 'canceled', 'completed')
+
+
+def backfill_function_counters(apps, schema_editor):
+    StreamModel = apps.get_model('streams', 'StreamModel')
+    FunctionInstanceModel = apps.get_model('streams', 'FunctionInstanceModel')
+    counters = {}
+    for status in FUNCTION_STATUSES:
+        total = FunctionInstanceModel.objects.filter(
+            stream=models.OuterRef('pk'), status=status).order_by().values(
+            'stream').annotate(total=models.Count('uuid')).values('total')
+        counters[f'{status}_functions'] = Coalesce(models.Subquery(total), 0)
+    StreamModel.objects.update(**counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0006_streamchangemodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='streammodel',
+            name='pending_functions',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='streammodel',
+            name='running_functions',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='streammodel',
+            name='blocked_functions',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='streammodel',
+            name='canceled_functions',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='streammodel',
+            name='completed_functions',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_function_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models.functions import Coalesce
+
+STATUSES = {
+    'stream': ('settled', 'pushed', 'paused', 'cancelled', 'finished'),
+    'function_instance': ('pending', 'running', 'blocked', 'canceled', 'completed'),
+}
+
+
+def backfill_status_counts(apps, schema_editor):
+    WorkspaceModel = apps.get_model('accounts', 'WorkspaceModel')
+    StreamModel = apps.get_model('streams', 'StreamModel')
+    FunctionInstanceModel = apps.get_model('streams', 'FunctionInstanceModel')
+    StatusCountModel = apps.get_model('streams', 'StatusCountModel')
+    StatusCountModel.objects.bulk_create([
+        StatusCountModel(workspace_id=workspace_id, kind=kind, status=status)
+        for workspace_id in WorkspaceModel.objects.values_list('pk', flat=True)
+        for kind, statuses in STATUSES.items()
+        for status in statuses], batch_size=500)
+
+    totals = {
+        'stream': StreamModel.objects.filter(
+            workspace=models.OuterRef('workspace'), status=models.OuterRef('status')),
+        'function_instance': FunctionInstanceModel.objects.filter(
+            stream__workspace=models.OuterRef('workspace'), status=models.OuterRef('status')),
+    }
+    for kind, queryset in totals.items():
+        total = queryset.order_by().values('status').annotate(
+            total=models.Count('uuid')).values('total')
+        StatusCountModel.objects.filter(kind=kind).update(total=Coalesce(models.Subquery(total), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_auto_20210615_0907'),
+        ('streams', '0007_stream_function_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusCountModel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('stream', 'Stream'), ('function_instance', 'Function Instance')], max_length=20)),
+                ('status', models.CharField(max_length=50)),
+                ('total', models.BigIntegerField(default=0)),
+                ('workspace', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_counts', to='accounts.workspacemodel')),
+            ],
+            options={
+                'verbose_name': 'Status Count',
+                'db_table': 'status_counts',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='statuscountmodel',
+            constraint=models.UniqueConstraint(fields=('workspace', 'kind', 'status'), name='unique_status_count'),
+        ),
+        migrations.RunPython(backfill_status_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+FUNCTION_STATUS_CHOICES = [('pending', 'Pending'), ('running', 'Running'), ('blocked', 'Blocked'), ('canceled', 'Canceled'), ('completed', 'Completed')]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0008_statuscountmodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FunctionInstanceTransitionModel',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(help_text='When the status changed.')),
+                ('from_status', models.CharField(choices=FUNCTION_STATUS_CHOICES, max_length=50, null=True)),
+                ('to_status', models.CharField(choices=FUNCTION_STATUS_CHOICES, max_length=50)),
+                ('elapsed', models.DurationField(help_text='Time spent in the previous status.', null=True)),
+                ('function_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transitions', to='streams.functioninstancemodel')),
+                ('function_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transitions', to='streams.functiontypemodel')),
+            ],
+            options={
+                'verbose_name': 'Function Instance Transition',
+                'db_table': 'function_instance_transitions',
+                'ordering': ['created'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='functioninstancetransitionmodel',
+            index=models.Index(fields=['function_type', 'from_status', 'created'], name='fi_transitions_metrics_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0009_functioninstancetransitionmodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WatchCheckpointModel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('resource_version', models.CharField(max_length=100, null=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Watch Checkpoint',
+                'db_table': 'watch_checkpoints',
+            },
+        ),
+    ]
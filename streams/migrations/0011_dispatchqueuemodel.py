@@ -0,0 +1,32 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_auto_20210615_0907'),
+        ('streams', '0010_watchcheckpointmodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DispatchQueueModel',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('enqueued', models.DateTimeField()),
+                ('dispatched', models.DateTimeField(help_text='When the entry was leased.', null=True)),
+                ('function_instance', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='dispatch_entry', to='streams.functioninstancemodel')),
+                ('workspace', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dispatch_queue', to='accounts.workspacemodel')),
+            ],
+            options={
+                'verbose_name': 'Dispatch Queue Entry',
+                'db_table': 'dispatch_queue',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dispatchqueuemodel',
+            index=models.Index(fields=['workspace', 'id'], name='dispatch_queue_workspace_idx'),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0011_dispatchqueuemodel'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='streamchangemodel',
+            index=models.Index(fields=['created'], name='stream_changes_created_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0012_stream_changes_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='variableblobmodel',
+            name='released',
+            field=models.DateTimeField(help_text='When its last reference was released.', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='variableblobmodel',
+            index=models.Index(fields=['released'], name='variable_blobs_released_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0013_variableblobmodel_released'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='functioninstancetransitionmodel',
+            name='fi_transitions_metrics_idx',
+        ),
+        migrations.AddIndex(
+            model_name='functioninstancetransitionmodel',
+            index=models.Index(fields=['created', 'from_status'], name='fi_transitions_created_idx'),
+        ),
+    ]
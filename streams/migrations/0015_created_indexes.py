@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0014_fi_transitions_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='functiontypemodel',
+            index=models.Index(fields=['-created', 'uuid'], name='function_types_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='streammodel',
+            index=models.Index(fields=['-created', 'uuid'], name='streams_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='functioninstancemodel',
+            index=models.Index(fields=['-created', 'uuid'], name='function_instances_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='variablemodel',
+            index=models.Index(fields=['-created', 'uuid'], name='variables_created_idx'),
+        ),
+    ]
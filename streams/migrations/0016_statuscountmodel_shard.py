@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+from settings import STATUS_COUNTS_SHARDS
+
+
+def create_status_count_shards(apps, schema_editor):
+    StatusCountModel = apps.get_model('streams', 'StatusCountModel')
+    StatusCountModel.objects.bulk_create([
+        StatusCountModel(workspace_id=workspace_id, kind=kind, status=status, shard=shard)
+        for workspace_id, kind, status in StatusCountModel.objects.values_list(
+            'workspace_id', 'kind', 'status')
+        for shard in range(1, STATUS_COUNTS_SHARDS)], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0015_created_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statuscountmodel',
+            name='shard',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RemoveConstraint(
+            model_name='statuscountmodel',
+            name='unique_status_count',
+        ),
+        migrations.AddConstraint(
+            model_name='statuscountmodel',
+            constraint=models.UniqueConstraint(fields=('workspace', 'kind', 'status', 'shard'), name='unique_status_count'),
+        ),
+        migrations.RunPython(create_status_count_shards, migrations.RunPython.noop),
+    ]
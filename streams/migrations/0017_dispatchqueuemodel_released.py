@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0016_statuscountmodel_shard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispatchqueuemodel',
+            name='released',
+            field=models.DateTimeField(help_text='When its last upstream instance completed.', null=True),
+        ),
+    ]
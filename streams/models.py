@@ -1,17 +1,31 @@
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
 from uuid import UUID, uuid4
+import hashlib
+import io
 import json
-from typing import Tuple, Optional, Union
+import random
+from typing import BinaryIO, Dict, Iterable, Tuple, Optional, Union, List
 
-from django.db import models
-from django.core.exceptions import ObjectDoesNotExist
+from django.db import models, transaction, IntegrityError
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 from scaladecore.entities import FunctionTypeEntity, StreamEntity, VariableEntity, \
     FunctionInstanceEntity, FunctionInstanceLogMessageEntity
 from scaladecore.config import InputConfig, OutputConfig, PositionConfig
 from scaladecore.variables import Variable
 
+from common import codecs
 from common.contracts import ModelContract
 from common.exceptions import InconsistentStateChangeError
+from common.storage import get_blob_storage
+from settings import VARIABLES_BLOB_THRESHOLD, VARIABLES_COMPRESSION_CODEC, \
+    VARIABLES_COMPRESSION_MIN_SIZE, VARIABLES_COMPRESSION_MIN_RATIO, \
+    DISPATCH_MAX_RUNNING_PER_WORKSPACE, DISPATCH_WORKSPACE_MAX_RUNNING, \
+    DISPATCH_WORKSPACE_WEIGHTS, DISPATCH_LEASE_TIMEOUT, STATUS_COUNTS_SHARDS
+from .managers import FunctionInstanceManager, FunctionInstanceTransitionManager, \
+    StreamManager
 
 # TODO: FunctionRepositoryModel (an Image container repository)
 
@@ -36,6 +50,9 @@ class FunctionTypeModel(ModelContract):
     class Meta:
         ordering = ['-created', ]
         db_table = 'function_types'
+        indexes = [
+            models.Index(fields=['-created', 'uuid'], name='function_types_created_idx'),
+        ]
         verbose_name = 'Function Type'
 
     @property
@@ -82,10 +99,26 @@ class StreamModel(ModelContract):
                                 on_delete=models.CASCADE,
                                 related_name='streams',
                                 help_text='The creator and owner of the stream.')
+    # function instances counters by status, maintained on each function instance change
+    pending_functions = models.PositiveIntegerField(default=0)
+    running_functions = models.PositiveIntegerField(default=0)
+    blocked_functions = models.PositiveIntegerField(default=0)
+    canceled_functions = models.PositiveIntegerField(default=0)
+    completed_functions = models.PositiveIntegerField(default=0)
+
+    FUNCTION_COUNTERS = {status: f'{status}_functions'
+                         for status, _ in FunctionInstanceEntity.STATUS}
+    # function instances statuses that keep the stream from finishing
+    UNFINISHED_FUNCTION_STATUSES = [status for status, _ in FunctionInstanceEntity.STATUS[:3]]
+
+    objects = StreamManager()
 
     class Meta:
         ordering = ['-created', ]
         db_table = 'streams'
+        indexes = [
+            models.Index(fields=['-created', 'uuid'], name='streams_created_idx'),
+        ]
         verbose_name = 'Stream'
 
     @property
@@ -100,12 +133,222 @@ class StreamModel(ModelContract):
             status=self.status,
             account=self.account.to_entity, )
 
-    def cancel(self):
-        instances = self.functions.all()
-        for inst in instances:
-            inst.cancel()
-        self.status = StreamEntity.STATUS[-2][0]
-        self.save()
+    def cancel(self) -> int:
+        """
+        Cancels the stream and its function instances, it returns the number of function
+        instances cancelled.
+        """
+        cancelled, _, _ = self.__class__.cancel_many(
+            self.__class__.objects.filter(uuid=self.uuid))
+        self.refresh_from_db(fields=['status', 'updated'])
+        return cancelled.get(self.uuid, 0)
+
+    @classmethod
+    def lock(cls, stream_uuids: Iterable[Union[UUID, str]]) -> List[UUID]:
+        """
+        Locks the rows of the streams until the end of the transaction.
+
+        Changes to a stream and its function instances lock the stream row first, always
+        in the same order, so that concurrent changes never deadlock.
+        """
+        return list(cls.objects.select_for_update().filter(
+            uuid__in=set(stream_uuids)).order_by('uuid').values_list('uuid', flat=True))
+
+    @classmethod
+    def cancel_many(cls, streams: models.QuerySet) -> Tuple[Dict[UUID, int], List[UUID],
+                                                            Dict[UUID, Tuple[UUID, str, str]]]:
+        """
+        Cancels the streams of the queryset and all their function instances with
+        set-based queries, whose number only depends on the workspaces and statuses involved.
+
+        It returns the number of function instances cancelled by each cancelled stream,
+        the streams that were already cancelled, and the stream, the previous and the new
+        status of the function instances cancelled, as transition_many() does.
+        """
+        stream_cancelled = StreamEntity.STATUS[-2][0]
+        fi_cancelled = FunctionInstanceEntity.STATUS[-2][0]
+        now = timezone.now()
+        with transaction.atomic():
+            statuses = {uuid: (status, workspace_id) for uuid, status, workspace_id in
+                        streams.select_for_update(of=('self',)).order_by('uuid').values_list(
+                            'uuid', 'status', 'workspace_id')}
+            targets = cls.objects.filter(
+                uuid__in=streams.exclude(status=stream_cancelled).values('uuid'))
+            instances = FunctionInstanceModel.objects.filter(
+                stream__in=targets.values('uuid')).exclude(status=fi_cancelled)
+            rows = list(instances.order_by().values_list(
+                'uuid', 'function_type', 'stream', 'stream__workspace', 'status', 'updated'))
+            instances.update(status=fi_cancelled, updated=now)
+            FunctionInstanceTransitionModel.objects.bulk_create([
+                FunctionInstanceTransitionModel(
+                    function_instance_id=fi_uuid, function_type_id=function_type_id,
+                    from_status=status, to_status=fi_cancelled, created=now,
+                    elapsed=now - updated if updated else None)
+                for fi_uuid, function_type_id, _, _, status, updated in rows])
+            # every function instance of the targets moves to the cancelled counter
+            counters = {counter: 0 for counter in cls.FUNCTION_COUNTERS.values()}
+            cancelled_counter = cls.FUNCTION_COUNTERS[fi_cancelled]
+            counters[cancelled_counter] = models.F(cancelled_counter)
+            for counter in cls.FUNCTION_COUNTERS.values():
+                if counter != cancelled_counter:
+                    counters[cancelled_counter] += models.F(counter)
+            targets.update(status=stream_cancelled, updated=now, **counters)
+
+            cancelled, already_cancelled = {}, []
+            stream_moves, function_moves = Counter(), Counter()
+            for uuid, (status, workspace_id) in statuses.items():
+                if status == stream_cancelled:
+                    already_cancelled.append(uuid)
+                else:
+                    cancelled[uuid] = 0
+                    stream_moves[workspace_id, status] += 1
+            for _, _, stream_uuid, workspace_id, status, _ in rows:
+                cancelled[stream_uuid] = cancelled.get(stream_uuid, 0) + 1
+                function_moves[workspace_id, status] += 1
+            for (workspace_id, status), total in stream_moves.items():
+                StatusCountModel.bump(workspace_id, StatusCountModel.STREAM, status,
+                                      stream_cancelled, total)
+            for (workspace_id, status), total in function_moves.items():
+                StatusCountModel.bump(workspace_id, StatusCountModel.FUNCTION_INSTANCE, status,
+                                      fi_cancelled, total)
+            transitions = {fi_uuid: (stream_uuid, status, fi_cancelled)
+                           for fi_uuid, _, stream_uuid, _, status, _ in rows}
+        return cancelled, already_cancelled, transitions
+
+    @classmethod
+    def count_function_change(cls, stream_uuid: Union[UUID, str], from_status: Optional[str],
+                              to_status: Optional[str], now=None) -> int:
+        """
+        Moves a function instance between the counters of its stream with a single UPDATE,
+        a None status stands for a created or deleted instance.
+
+        The workspace status counts are moved too, and the stream is finished when its
+        last unfinished function instance completes, is canceled or deleted.
+        """
+        if from_status == to_status:
+            return 0
+
+        changes = {}
+        if from_status:
+            counter = cls.FUNCTION_COUNTERS[from_status]
+            changes[counter] = models.F(counter) - 1
+        if to_status:
+            counter = cls.FUNCTION_COUNTERS[to_status]
+            changes[counter] = models.F(counter) + 1
+        updated = cls.objects.filter(uuid=stream_uuid).update(**changes)
+
+        workspace = models.Subquery(
+            cls.objects.filter(uuid=stream_uuid).values('workspace_id')[:1])
+        StatusCountModel.bump(workspace, StatusCountModel.FUNCTION_INSTANCE,
+                              from_status, to_status)
+        if from_status in cls.UNFINISHED_FUNCTION_STATUSES and \
+                to_status not in cls.UNFINISHED_FUNCTION_STATUSES:
+            cls.finish_if_done(stream_uuid, now)
+        return updated
+
+    @classmethod
+    def count_function_changes(cls, moves: Iterable[Tuple[UUID, UUID, str, str]], now=None):
+        """
+        Moves many function instances between counters, given as (stream, workspace,
+        from_status, to_status), with one UPDATE by stream and one by workspace and
+        statuses, then finishes the streams done.
+        """
+        deltas, workspace_moves, finishing = defaultdict(Counter), Counter(), set()
+        for stream_uuid, workspace_id, from_status, to_status in moves:
+            deltas[stream_uuid][cls.FUNCTION_COUNTERS[from_status]] -= 1
+            deltas[stream_uuid][cls.FUNCTION_COUNTERS[to_status]] += 1
+            workspace_moves[workspace_id, from_status, to_status] += 1
+            if from_status in cls.UNFINISHED_FUNCTION_STATUSES and \
+                    to_status not in cls.UNFINISHED_FUNCTION_STATUSES:
+                finishing.add(stream_uuid)
+
+        for stream_uuid, counters in deltas.items():
+            cls.objects.filter(uuid=stream_uuid).update(
+                **{counter: models.F(counter) + delta
+                   for counter, delta in counters.items() if delta})
+        for (workspace_id, from_status, to_status), total in workspace_moves.items():
+            StatusCountModel.bump(workspace_id, StatusCountModel.FUNCTION_INSTANCE,
+                                  from_status, to_status, total)
+        for stream_uuid in finishing:
+            cls.finish_if_done(stream_uuid, now)
+
+    @classmethod
+    def count_deleted_functions(cls, instances: models.QuerySet, now=None):
+        """
+        Removes the function instances of the queryset, about to be deleted, from the
+        counters with one UPDATE by stream and one by workspace, then ends the streams done.
+        """
+        deltas, workspace_totals, finishing = defaultdict(dict), defaultdict(dict), set()
+        totals = instances.order_by().values_list(
+            'stream', 'stream__workspace', 'status').annotate(total=models.Count('uuid'))
+        for stream_uuid, workspace_id, status, total in totals:
+            deltas[stream_uuid][cls.FUNCTION_COUNTERS[status]] = total
+            workspace_totals[workspace_id][status] = \
+                workspace_totals[workspace_id].get(status, 0) + total
+            if status in cls.UNFINISHED_FUNCTION_STATUSES:
+                finishing.add(stream_uuid)
+
+        for stream_uuid, counters in deltas.items():
+            cls.objects.filter(uuid=stream_uuid).update(
+                **{counter: models.F(counter) - total for counter, total in counters.items()})
+        for workspace_id, status_totals in workspace_totals.items():
+            StatusCountModel.remove(workspace_id, StatusCountModel.FUNCTION_INSTANCE,
+                                    status_totals)
+        for stream_uuid in finishing:
+            cls.finish_if_done(stream_uuid, now)
+
+    @classmethod
+    def finish_if_done(cls, stream_uuid: Union[UUID, str], now=None) -> bool:
+        """
+        Ends the stream when none of its function instances is left unfinished, unless it
+        is already cancelled or finished: it is finished when any of them completed, and
+        cancelled when all of them were canceled. A stream without function instances
+        is left as it is.
+        """
+        finished, cancelled = StreamEntity.STATUS[-1][0], StreamEntity.STATUS[-2][0]
+        completed_counter = cls.FUNCTION_COUNTERS[FunctionInstanceEntity.STATUS[-1][0]]
+        canceled_counter = cls.FUNCTION_COUNTERS[FunctionInstanceEntity.STATUS[-2][0]]
+        done = cls.objects.filter(
+            uuid=stream_uuid,
+            **{cls.FUNCTION_COUNTERS[status]: 0
+               for status in cls.UNFINISHED_FUNCTION_STATUSES}).exclude(
+            status__in=[cancelled, finished])
+        current = done.values_list('status', 'workspace_id', completed_counter,
+                                   canceled_counter).first()
+        if current is None:
+            return False
+
+        status, workspace_id, completed, canceled = current
+        now = now or timezone.now()
+        if completed:
+            changed = done.filter(status=status, **{f'{completed_counter}__gt': 0}).update(
+                status=finished, finished=now, updated=now)
+            to_status = finished
+        elif canceled:
+            # as cancel_many() does, a cancelled stream has no finish time
+            changed = done.filter(status=status, **{completed_counter: 0,
+                                                    f'{canceled_counter}__gt': 0}).update(
+                status=cancelled, updated=now)
+            to_status = cancelled
+        else:
+            return False
+        if not changed:
+            return False
+        StatusCountModel.bump(workspace_id, StatusCountModel.STREAM, status, to_status)
+        return True
+
+    @classmethod
+    def refresh_function_counters(cls, streams: models.QuerySet) -> int:
+        """
+        Recomputes the function instances counters of the streams with a single UPDATE.
+        """
+        counters = {}
+        for status, counter in cls.FUNCTION_COUNTERS.items():
+            total = FunctionInstanceModel.objects.filter(
+                stream=models.OuterRef('pk'), status=status).order_by().values(
+                'stream').annotate(total=models.Count('uuid')).values('total')
+            counters[counter] = Coalesce(models.Subquery(total), 0)
+        return streams.update(**counters)
 
 
 class FunctionInstanceModel(ModelContract):
@@ -124,10 +367,28 @@ class FunctionInstanceModel(ModelContract):
     completed = models.DateTimeField(null=True)
     status = models.CharField(max_length=50, default=FunctionInstanceEntity.STATUS[0][0],
                               choices=FunctionInstanceEntity.STATUS)
+    outputs_count = models.PositiveIntegerField(default=0,
+                                                help_text='Number of output ranks allocated.')
+
+    objects = FunctionInstanceManager()
+
+    # status changes observed from the outside of the function, by its Job, only move forward
+    OBSERVED_TRANSITIONS = {
+        FunctionInstanceEntity.STATUS[0][0]: {FunctionInstanceEntity.STATUS[1][0],
+                                              FunctionInstanceEntity.STATUS[-2][0],
+                                              FunctionInstanceEntity.STATUS[-1][0]},
+        FunctionInstanceEntity.STATUS[1][0]: {FunctionInstanceEntity.STATUS[-2][0],
+                                              FunctionInstanceEntity.STATUS[-1][0]},
+        FunctionInstanceEntity.STATUS[2][0]: {FunctionInstanceEntity.STATUS[-2][0],
+                                              FunctionInstanceEntity.STATUS[-1][0]},
+    }
 
     class Meta:
         ordering = ['-created', ]
         db_table = 'function_instances'
+        indexes = [
+            models.Index(fields=['-created', 'uuid'], name='function_instances_created_idx'),
+        ]
         verbose_name = 'Function Instance'
 
     @property
@@ -147,38 +408,247 @@ class FunctionInstanceModel(ModelContract):
     def entity_class(self):
         return FunctionInstanceEntity
 
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            StreamModel.lock([self.stream_id])
+            status = self.__class__.objects.select_for_update().filter(
+                uuid=self.uuid).values_list('status', flat=True).first()
+            if status:
+                StreamModel.count_function_change(self.stream_id, status, None)
+            VariableBlobModel.release_variables(self.variables.all())
+            return super().delete(*args, **kwargs)
+
     def cancel(self):
-        self.status = self.entity_class.STATUS[-2][0]
-        self.save()
+        self._transition(self.status, self.entity_class.STATUS[-2][0])
 
     @property
     def is_running(self) -> bool:
         return self.status == self.entity_class.STATUS[1][0]
 
-    def _block(self):
-        if self.is_running:
-            self.status = self.entity_class.STATUS[2][0]
-            self.save()
-        else:
+    def _transition(self, expected_status: str, status: str, **changes):
+        """
+        Changes the status with a single conditional UPDATE, it only succeeds when the
+        stored status still is the expected one, entered when this instance says it was.
+        The transition is logged and the counters of the stream are moved in the same
+        transaction, under the lock of the stream row.
+        """
+        now = changes.setdefault('updated', timezone.now())
+        changes['status'] = status
+        instances = self.__class__.objects.filter(uuid=self.uuid)
+        with transaction.atomic(savepoint=False):
+            StreamModel.lock([self.stream_id])
+            changed = instances.filter(status=expected_status,
+                                       updated=self.updated).update(**changes)
+            if changed:
+                # 'updated' is when the expected status was entered: it is unchanged since
+                # this instance was loaded, or the UPDATE would have failed.
+                FunctionInstanceTransitionModel.objects.create(
+                    function_instance_id=self.uuid,
+                    function_type_id=self.function_type_id,
+                    from_status=expected_status,
+                    to_status=status,
+                    created=now,
+                    elapsed=now - self.updated if self.updated else None)
+                StreamModel.count_function_change(
+                    self.stream_id, expected_status, status, now)
+        if not changed:
+            current_status = instances.values_list('status', flat=True).first()
             raise InconsistentStateChangeError(
                 self.__class__,
-                self.status,
-                self.entity_class.STATUS[2][0])
+                current_status or self.status,
+                status)
+
+        for field, value in changes.items():
+            setattr(self, field, value)
+
+    def _block(self):
+        self._transition(self.entity_class.STATUS[1][0],
+                         self.entity_class.STATUS[2][0])
 
     def _complete(self):
-        if self.is_running:
-            self.status = self.entity_class.STATUS[-1][0]
-            self.save()
-        else:
-            raise InconsistentStateChangeError(
-                self.__class__,
-                self.status,
-                self.entity_class.STATUS[-1][0])
+        now = timezone.now()
+        self._transition(self.entity_class.STATUS[1][0],
+                         self.entity_class.STATUS[-1][0],
+                         completed=now,
+                         updated=now)
 
     def update_status(self, status_method: str):
         mth = getattr(self, '_' + status_method)
         mth.__call__()
 
+    @classmethod
+    def transition_many(cls, statuses: Dict[Union[UUID, str], str],
+                        now=None) -> Dict[UUID, Tuple[UUID, str, str]]:
+        """
+        Moves function instances to the given statuses with one UPDATE by status change,
+        only the transitions in OBSERVED_TRANSITIONS are applied. The transitions are
+        logged and the counters moved in the same transaction.
+
+        It returns the stream, the previous and the new status of the instances moved.
+        """
+        statuses = {UUID(str(fi_uuid)): status for fi_uuid, status in statuses.items()}
+        completed = FunctionInstanceEntity.STATUS[-1][0]
+        now = now or timezone.now()
+        applied, groups, transitions, moves = {}, defaultdict(list), [], []
+        with transaction.atomic():
+            # the stream of an instance never changes, it is read before being locked
+            StreamModel.lock(cls.objects.filter(uuid__in=statuses).order_by().values_list(
+                'stream', flat=True).distinct())
+            rows = cls.objects.select_for_update(of=('self',)).filter(
+                uuid__in=statuses).order_by().values_list(
+                'uuid', 'function_type', 'stream', 'stream__workspace', 'status', 'updated')
+            for fi_uuid, function_type_id, stream_uuid, workspace_id, status, updated in rows:
+                to_status = statuses[fi_uuid]
+                if to_status not in cls.OBSERVED_TRANSITIONS.get(status, ()):
+                    continue
+                applied[fi_uuid] = (stream_uuid, status, to_status)
+                groups[status, to_status].append(fi_uuid)
+                transitions.append(FunctionInstanceTransitionModel(
+                    function_instance_id=fi_uuid, function_type_id=function_type_id,
+                    from_status=status, to_status=to_status, created=now,
+                    elapsed=now - updated if updated else None))
+                moves.append((stream_uuid, workspace_id, status, to_status))
+
+            for (from_status, to_status), fi_uuids in groups.items():
+                changes = {'status': to_status, 'updated': now}
+                if to_status == completed:
+                    changes['completed'] = now
+                cls.objects.filter(uuid__in=fi_uuids, status=from_status).update(**changes)
+            FunctionInstanceTransitionModel.objects.bulk_create(transitions)
+            StreamModel.count_function_changes(moves, now)
+        return applied
+
+
+class VariableBlobModel(models.Model):
+    """
+    A payload of the blob storage shared by all the variables with the same content.
+
+    Blobs whose last reference is released are kept until collect() deletes them, under
+    the lock of their row, once released for longer than a grace period. Acquiring a blob
+    waits for that lock, so its payload is always written after any deletion of it.
+    """
+    checksum = models.CharField(primary_key=True, max_length=64,
+                                help_text='SHA-256 of the payload, its blob storage key.')
+    created = models.DateTimeField(auto_now_add=True)
+    size = models.BigIntegerField()
+    codec = models.CharField(max_length=10, default=codecs.IDENTITY, choices=codecs.CODECS)
+    ref_count = models.PositiveIntegerField(default=0,
+                                            help_text='Number of variables referencing it.')
+    released = models.DateTimeField(null=True,
+                                    help_text='When its last reference was released.')
+
+    class Meta:
+        ordering = ['-created', ]
+        db_table = 'variable_blobs'
+        indexes = [
+            models.Index(fields=['released'], name='variable_blobs_released_idx'),
+        ]
+        verbose_name = 'Variable Blob'
+
+    def __str__(self):
+        return self.checksum
+
+    @classmethod
+    def acquire(cls, checksum: str, content: bytes, variable_type: str = None) -> Tuple[str, str]:
+        """
+        Adds a reference to the payload, it is only compressed and written to the
+        blob storage when no other variable references it yet.
+
+        It returns the blob storage reference and the codec the payload is stored with.
+        """
+        blobs = cls.objects.filter(checksum=checksum)
+        codec = blobs.values_list('codec', flat=True).first()
+        if codec is not None and blobs.filter(ref_count__gt=0).update(
+                ref_count=models.F('ref_count') + 1):
+            return checksum, codec
+
+        with transaction.atomic():
+            # waits for a collection of the blob in progress, before writing it again
+            codec = blobs.select_for_update().values_list('codec', flat=True).first()
+            if codec is not None:
+                encoded = codecs.encode(content, codec)
+                blobs.update(ref_count=models.F('ref_count') + 1, released=None)
+            else:
+                codec, encoded = codecs.compress(
+                    content, VARIABLES_COMPRESSION_CODEC, VARIABLES_COMPRESSION_MIN_SIZE,
+                    VARIABLES_COMPRESSION_MIN_RATIO, variable_type)
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(checksum=checksum, size=len(content), codec=codec,
+                                           ref_count=1)
+                except IntegrityError:
+                    # created concurrently by another variable with the same payload
+                    blobs.update(ref_count=models.F('ref_count') + 1, released=None)
+            # a rollback leaves the payload unreferenced, collect() deletes it
+            ref = get_blob_storage().save(checksum, encoded)
+        return ref, codec
+
+    @classmethod
+    def release(cls, checksum: str):
+        """
+        Removes a reference to the payload.
+        """
+        cls.objects.filter(checksum=checksum).update(
+            ref_count=models.F('ref_count') - 1,
+            released=models.Case(models.When(ref_count__lte=1, then=models.Value(timezone.now())),
+                                 default=models.F('released'),
+                                 output_field=models.DateTimeField()))
+
+    @classmethod
+    def release_variables(cls, variables: models.QuerySet) -> int:
+        """
+        Removes the references of the variables of the queryset with a single UPDATE, it
+        must run before the variables are deleted.
+        """
+        total = models.Subquery(
+            variables.filter(blob_ref=models.OuterRef('checksum')).order_by().values(
+                'blob_ref').annotate(total=models.Count('uuid')).values('total'),
+            output_field=models.PositiveIntegerField())
+        return cls.objects.filter(checksum__in=variables.values('blob_ref')).update(
+            ref_count=models.F('ref_count') - total,
+            released=models.Case(models.When(ref_count__lte=total,
+                                             then=models.Value(timezone.now())),
+                                 default=models.F('released'),
+                                 output_field=models.DateTimeField()))
+
+    @classmethod
+    def collect(cls, grace: float, batch_size: int = 500) -> Tuple[int, int]:
+        """
+        Deletes the blobs released for over 'grace' seconds, then the stored payloads older
+        than that without a blob, e.g. written by transactions rolled back.
+
+        It returns the number of blobs and of unreferenced payloads deleted.
+        """
+        storage = get_blob_storage()
+        cutoff = timezone.now() - timedelta(seconds=grace)
+        collected = 0
+        while True:
+            with transaction.atomic():
+                checksums = list(cls.objects.select_for_update(skip_locked=True).filter(
+                    ref_count=0, released__lte=cutoff).values_list(
+                    'checksum', flat=True)[:batch_size])
+                for checksum in checksums:
+                    storage.delete(checksum)
+                cls.objects.filter(checksum__in=checksums).delete()
+            collected += len(checksums)
+            if len(checksums) < batch_size:
+                break
+
+        orphans = 0
+        for key, modified in storage.keys():
+            if modified > cutoff.timestamp():
+                continue
+            try:
+                with transaction.atomic():
+                    # the row claims the key: acquiring it waits until the payload is deleted
+                    cls.objects.create(checksum=key, size=0)
+                    storage.delete(key)
+                    cls.objects.filter(checksum=key).delete()
+            except IntegrityError:
+                continue
+            orphans += 1
+        return collected, orphans
+
 
 class VariableModel(ModelContract):
     uuid = models.UUIDField(primary_key=True,
@@ -191,16 +661,35 @@ class VariableModel(ModelContract):
     id_name = models.CharField(max_length=50)
     type = models.CharField(max_length=50)
     charset = models.CharField(max_length=50, default='utf-8')
-    bytes = models.BinaryField()
+    bytes = models.BinaryField(blank=True, default=b'',
+                               help_text='Inline payload, empty when it is kept in the blob storage.')
+    size = models.BigIntegerField(default=0)
+    checksum = models.CharField(max_length=64, blank=True, help_text='SHA-256 of the payload.')
+    codec = models.CharField(max_length=10, default=codecs.IDENTITY, choices=codecs.CODECS,
+                             help_text='Compression the payload is stored with.')
+    blob_ref = models.CharField(max_length=255, null=True, blank=True,
+                                help_text='Reference of the payload in the blob storage.')
     function_instance = models.ForeignKey(FunctionInstanceModel, on_delete=models.CASCADE,
                                           related_name='variables')
     rank = models.IntegerField()
 
+    # types whose payload is their value as text encoded in 'charset'
+    TEXT_TYPES = ('text', 'integer', 'float', 'boolean', 'datetime')
+
     class Meta:
         ordering = ['-created', ]
         db_table = 'variables'
+        indexes = [
+            models.Index(fields=['-created', 'uuid'], name='variables_created_idx'),
+        ]
         verbose_name = 'Variable'
 
+    @property
+    def content_type(self) -> str:
+        if self.type in self.TEXT_TYPES:
+            return f'text/plain; charset={self.charset}'
+        return 'application/octet-stream'
+
     @property
     def to_entity(self) -> VariableEntity:
         return VariableEntity(
@@ -210,31 +699,110 @@ class VariableModel(ModelContract):
             id_name=self.id_name,
             type_=self.type,
             charset=self.charset,
-            bytes_=self.bytes,
-            fi_uuid=self.function_instance.uuid,
+            bytes_=self.read_bytes(),
+            fi_uuid=self.function_instance_id,
             rank=self.rank, )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored_blob_ref = instance.__dict__.get('blob_ref')
+        instance._stored_bytes = instance.__dict__.get('bytes')
+        return instance
+
+    def save(self, *args, **kwargs):
+        stored_blob_ref = getattr(self, '_stored_blob_ref', None)
+        with transaction.atomic():
+            self._store_payload()
+            super().save(*args, **kwargs)
+            if stored_blob_ref and stored_blob_ref != self.blob_ref:
+                VariableBlobModel.release(stored_blob_ref)
+        self._stored_blob_ref = self.blob_ref
+        self._stored_bytes = self.bytes
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            if self.blob_ref:
+                VariableBlobModel.release(self.blob_ref)
+            return super().delete(*args, **kwargs)
+
+    def read_bytes(self) -> bytes:
+        """
+        Reads the whole payload, decompressed.
+        """
+        return codecs.decode(self.read_stored_bytes(), self.codec)
+
+    def read_stored_bytes(self) -> bytes:
+        if self.blob_ref:
+            return get_blob_storage().read(self.blob_ref)
+        return bytes(self.bytes)
+
+    def open(self) -> BinaryIO:
+        """
+        Opens the payload as a binary file, without loading blob payloads in memory.
+
+        Compressed payloads are decompressed while being read.
+        """
+        return codecs.open_decoded(self.open_stored(), self.codec)
+
+    def open_stored(self) -> BinaryIO:
+        """
+        Opens the payload as it is stored, still compressed with 'codec'.
+        """
+        if self.blob_ref:
+            return get_blob_storage().open(self.blob_ref)
+        return io.BytesIO(self.bytes)
+
+    def _store_payload(self):
+        """
+        Computes size and checksum of a new payload, compresses it when it pays off and
+        offloads it to the blob storage when it exceeds the VARIABLES_BLOB_THRESHOLD.
+
+        Offloaded payloads are content addressed: variables with the same content
+        share a single reference counted blob.
+        """
+        if 'bytes' not in self.__dict__ or not self.bytes:
+            return
+        if self.bytes is getattr(self, '_stored_bytes', None):
+            # already stored as it is: encoded and checksummed
+            return
+
+        content = bytes(self.bytes)
+        self.size = len(content)
+        self.checksum = hashlib.sha256(content).hexdigest()
+        if self.size > VARIABLES_BLOB_THRESHOLD:
+            self.blob_ref, self.codec = VariableBlobModel.acquire(
+                self.checksum, content, self.type)
+            self.bytes = b''
+        else:
+            self.blob_ref = None
+            self.codec, self.bytes = codecs.compress(
+                content, VARIABLES_COMPRESSION_CODEC, VARIABLES_COMPRESSION_MIN_SIZE,
+                VARIABLES_COMPRESSION_MIN_RATIO, self.type)
+
     @classmethod
     def create_output(cls, fi_uuid: Union[UUID, str], output: Variable) -> Tuple[object, Optional[str]]:
-        try:
-            fi = FunctionInstanceModel.objects.get(uuid=fi_uuid)
-        except ObjectDoesNotExist:
-            return None, "function instance '%s' doesn't exist" % str(fi_uuid)
-        try:
-            last_output = cls.objects.filter(function_instance=fi, iot='output'
-                                             ).order_by('-rank')[0]
-            rank = last_output.rank + 1
-        except IndexError:
-            rank = 0
-        variable = cls(
-            iot='output',
-            id_name=output.id_name,
-            type=output.type,
-            charset=output.charset,
-            bytes=output.bytes,
-            function_instance=fi,
-            rank=rank)
-        variable.save()
+        """
+        Creates an output variable allocating its rank from the function instance counter.
+
+        The counter increment locks the function instance row until the variable is
+        inserted, so concurrent outputs of the same instance always get distinct ranks.
+        """
+        instances = FunctionInstanceModel.objects.filter(uuid=fi_uuid)
+        with transaction.atomic():
+            allocated = instances.update(outputs_count=models.F('outputs_count') + 1)
+            if not allocated:
+                return None, "function instance '%s' doesn't exist" % str(fi_uuid)
+            rank = instances.values_list('outputs_count', flat=True).get() - 1
+            variable = cls(
+                iot='output',
+                id_name=output.id_name,
+                type=output.type,
+                charset=output.charset,
+                bytes=output.bytes,
+                function_instance_id=fi_uuid,
+                rank=rank)
+            variable.save()
         return variable, None
 
 
@@ -261,6 +829,379 @@ class FunctionInstanceLogMessageModel(ModelContract):
         return FunctionInstanceLogMessageEntity(
             uuid=self.uuid,
             created=self.created,
-            fi_uuid=self.function_instance.uuid,
+            fi_uuid=self.function_instance_id,
             log_message=self.log_message,
             log_level=self.log_level, )
+
+    @classmethod
+    def create_batch(cls, function_instance: FunctionInstanceModel,
+                     entries: List[dict]) -> List[object]:
+        """
+        Creates all the log messages of 'entries' with a single bulk insert.
+
+        The created instances are returned in the same order as 'entries'.
+        """
+        log_messages = [
+            cls(function_instance=function_instance,
+                log_message=entry['log_message'],
+                log_level=entry['log_level'], )
+            for entry in entries]
+        return cls.objects.bulk_create(log_messages)
+
+
+class StreamChangeModel(models.Model):
+    """
+    An entry of the change feed of a stream, 'seq' is its monotonically increasing cursor.
+    """
+    seq = models.BigAutoField(primary_key=True)
+    created = models.DateTimeField(auto_now_add=True)
+    stream = models.ForeignKey(StreamModel, on_delete=models.CASCADE,
+                               related_name='changes')
+    function_instance = models.ForeignKey(FunctionInstanceModel, on_delete=models.CASCADE,
+                                          null=True, related_name='changes')
+    type = models.CharField(max_length=50)
+    data = models.TextField()
+
+    class Meta:
+        ordering = ['seq', ]
+        db_table = 'stream_changes'
+        indexes = [
+            models.Index(fields=['created'], name='stream_changes_created_idx'),
+        ]
+        verbose_name = 'Stream Change'
+
+    @classmethod
+    def purge(cls, before, batch_size: int = 10000) -> int:
+        """
+        Deletes the changes created before the given time by batches, it returns how many.
+        """
+        deleted = 0
+        while True:
+            batch = list(cls.objects.filter(created__lt=before).order_by('seq').values_list(
+                'seq', flat=True)[:batch_size])
+            if not batch:
+                return deleted
+            deleted += cls.objects.filter(seq__in=batch).delete()[0]
+
+    @property
+    def as_dict(self) -> dict:
+        return {
+            'seq': self.seq,
+            'created': self.created,
+            'type': self.type,
+            'stream': str(self.stream_id),
+            'function_instance': (str(self.function_instance_id)
+                                  if self.function_instance_id else None),
+            'data': json.loads(self.data),
+        }
+
+
+class StatusCountModel(models.Model):
+    """
+    Number of streams or function instances of a workspace in a status, split in
+    STATUS_COUNTS_SHARDS rows summed up when read.
+
+    Every (workspace, kind, status, shard) row exists from the workspace creation on, so
+    that status changes only have to update them. Each change updates the rows of a random
+    shard, so that the changes of a busy workspace don't all wait for the same row locks.
+    """
+    STREAM = 'stream'
+    FUNCTION_INSTANCE = 'function_instance'
+    KINDS = [(STREAM, 'Stream'), (FUNCTION_INSTANCE, 'Function Instance')]
+    STATUSES = {STREAM: [status for status, _ in StreamEntity.STATUS],
+                FUNCTION_INSTANCE: [status for status, _ in FunctionInstanceEntity.STATUS]}
+
+    workspace = models.ForeignKey('accounts.WorkspaceModel',
+                                  on_delete=models.CASCADE,
+                                  related_name='status_counts')
+    kind = models.CharField(max_length=20, choices=KINDS)
+    status = models.CharField(max_length=50)
+    shard = models.PositiveSmallIntegerField(default=0)
+    total = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'status_counts'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['workspace', 'kind', 'status', 'shard'], name='unique_status_count'),
+        ]
+        verbose_name = 'Status Count'
+
+    @classmethod
+    def bump(cls, workspace, kind: str, from_status: Optional[str], to_status: Optional[str],
+             amount: int = 1) -> int:
+        """
+        Moves 'amount' entities of the workspace between the status counts of a random shard
+        with a single UPDATE, a None status stands for created or deleted entities.
+
+        'workspace' is a workspace primary key or an expression resolving to it.
+        """
+        statuses = [status for status in (from_status, to_status) if status]
+        if from_status == to_status or not statuses or not amount:
+            return 0
+
+        delta = models.Value(-amount)
+        if to_status:
+            delta = models.Case(models.When(status=to_status, then=models.Value(amount)),
+                                default=delta, output_field=models.BigIntegerField())
+        return cls.objects.filter(workspace=workspace, kind=kind, status__in=statuses,
+                                  shard=cls.random_shard()).update(
+            total=models.F('total') + delta)
+
+    @classmethod
+    def remove(cls, workspace, kind: str, totals: Dict[str, int]) -> int:
+        """
+        Subtracts the totals by status of deleted entities from the workspace status counts
+        of a random shard with a single UPDATE.
+        """
+        totals = {status: total for status, total in totals.items() if total}
+        if not totals:
+            return 0
+        delta = models.Case(*[models.When(status=status, then=models.Value(total))
+                              for status, total in totals.items()],
+                            output_field=models.BigIntegerField())
+        return cls.objects.filter(workspace=workspace, kind=kind, status__in=totals,
+                                  shard=cls.random_shard()).update(
+            total=models.F('total') - delta)
+
+    @staticmethod
+    def random_shard() -> int:
+        return random.randrange(STATUS_COUNTS_SHARDS)
+
+    @classmethod
+    def create_for_workspaces(cls, workspaces: Iterable):
+        """
+        Creates the missing status counts rows of the workspaces, of every shard.
+        """
+        cls.objects.bulk_create([
+            cls(workspace_id=getattr(workspace, 'pk', workspace), kind=kind, status=status,
+                shard=shard)
+            for workspace in workspaces
+            for kind, statuses in cls.STATUSES.items()
+            for status in statuses
+            for shard in range(STATUS_COUNTS_SHARDS)], ignore_conflicts=True)
+
+    @classmethod
+    def reconcile(cls):
+        """
+        Recomputes every status count from the streams and function instances tables,
+        into the first shard, and creates the rows of the shards added since.
+        """
+        from accounts.models import WorkspaceModel
+        cls.create_for_workspaces(WorkspaceModel.objects.values_list('pk', flat=True))
+        totals = {
+            cls.STREAM: StreamModel.objects.filter(
+                workspace=models.OuterRef('workspace'), status=models.OuterRef('status')),
+            cls.FUNCTION_INSTANCE: FunctionInstanceModel.objects.filter(
+                stream__workspace=models.OuterRef('workspace'),
+                status=models.OuterRef('status')),
+        }
+        for kind, queryset in totals.items():
+            total = queryset.order_by().values('status').annotate(
+                total=models.Count('uuid')).values('total')
+            cls.objects.filter(kind=kind, shard=0).update(
+                total=Coalesce(models.Subquery(total), 0))
+            cls.objects.filter(kind=kind).exclude(shard=0).update(total=0)
+
+    @classmethod
+    def totals(cls, workspaces) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the totals by status of each kind summed over the workspaces.
+        """
+        totals = {kind: dict.fromkeys(statuses, 0) for kind, statuses in cls.STATUSES.items()}
+        rows = cls.objects.filter(workspace__in=workspaces).values('kind', 'status').annotate(
+            sum=models.Sum('total')).order_by()
+        for row in rows:
+            totals[row['kind']][row['status']] = row['sum']
+        return totals
+
+
+class FunctionInstanceTransitionModel(models.Model):
+    """
+    An append-only record of a function instance status change.
+    """
+    id = models.BigAutoField(primary_key=True)
+    created = models.DateTimeField(help_text='When the status changed.')
+    function_instance = models.ForeignKey(FunctionInstanceModel, on_delete=models.CASCADE,
+                                          related_name='transitions')
+    function_type = models.ForeignKey(FunctionTypeModel, on_delete=models.CASCADE,
+                                      related_name='transitions')
+    from_status = models.CharField(max_length=50, null=True,
+                                   choices=FunctionInstanceEntity.STATUS)
+    to_status = models.CharField(max_length=50, choices=FunctionInstanceEntity.STATUS)
+    elapsed = models.DurationField(null=True, help_text='Time spent in the previous status.')
+
+    objects = FunctionInstanceTransitionManager()
+
+    class Meta:
+        ordering = ['created', ]
+        db_table = 'function_instance_transitions'
+        indexes = [
+            # the metrics select a range of 'created' across every function type
+            models.Index(fields=['created', 'from_status'], name='fi_transitions_created_idx'),
+        ]
+        verbose_name = 'Function Instance Transition'
+
+
+class WatchCheckpointModel(models.Model):
+    """
+    Last resourceVersion processed by a watch of Kubernetes resources, it resumes from it.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    resource_version = models.CharField(max_length=100, null=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'watch_checkpoints'
+        verbose_name = 'Watch Checkpoint'
+
+    @classmethod
+    def load(cls, name: str) -> Optional[str]:
+        return cls.objects.filter(name=name).values_list('resource_version', flat=True).first()
+
+    @classmethod
+    def store(cls, name: str, resource_version: Optional[str]):
+        if not cls.objects.filter(name=name).update(resource_version=resource_version,
+                                                    updated=timezone.now()):
+            cls.objects.create(name=name, resource_version=resource_version)
+
+
+class DispatchQueueModel(models.Model):
+    """
+    A FunctionInstance ready to run, waiting for a Job slot of its workspace.
+
+    Entries are leased while their Jobs are being submitted, and deleted once submitted.
+    Leases of a process that died expire after DISPATCH_LEASE_TIMEOUT.
+    """
+    id = models.BigAutoField(primary_key=True)
+    enqueued = models.DateTimeField()
+    dispatched = models.DateTimeField(null=True, help_text='When the entry was leased.')
+    released = models.DateTimeField(null=True,
+                                    help_text='When its last upstream instance completed.')
+    workspace = models.ForeignKey('accounts.WorkspaceModel',
+                                  on_delete=models.CASCADE,
+                                  related_name='dispatch_queue')
+    function_instance = models.OneToOneField(FunctionInstanceModel, on_delete=models.CASCADE,
+                                             related_name='dispatch_entry')
+
+    class Meta:
+        ordering = ['id', ]
+        db_table = 'dispatch_queue'
+        indexes = [
+            models.Index(fields=['workspace', 'id'], name='dispatch_queue_workspace_idx'),
+        ]
+        verbose_name = 'Dispatch Queue Entry'
+
+    @staticmethod
+    def max_running(workspace_id: Union[UUID, str]) -> int:
+        return DISPATCH_WORKSPACE_MAX_RUNNING.get(str(workspace_id),
+                                                  DISPATCH_MAX_RUNNING_PER_WORKSPACE)
+
+    @staticmethod
+    def weight(workspace_id: Union[UUID, str]) -> float:
+        return float(DISPATCH_WORKSPACE_WEIGHTS.get(str(workspace_id), 1))
+
+    @classmethod
+    def enqueue(cls, entries: Iterable[Tuple[UUID, UUID]], now=None,
+                released: Optional[Dict[UUID, datetime]] = None) -> List:
+        """
+        Queues FunctionInstances, given as (function_instance, workspace), with the
+        completion time of their last upstream instance when they have any.
+        """
+        now = now or timezone.now()
+        released = released or {}
+        return cls.objects.bulk_create([
+            cls(function_instance_id=fi_uuid, workspace_id=workspace_id, enqueued=now,
+                released=released.get(fi_uuid))
+            for fi_uuid, workspace_id in entries])
+
+    @classmethod
+    def available(cls, now=None) -> models.QuerySet:
+        """
+        Entries of pending FunctionInstances that aren't leased, or whose lease expired.
+        Those of streams paused after they were queued wait until they are pushed again.
+        """
+        now = now or timezone.now()
+        return cls.objects.filter(
+            models.Q(dispatched__isnull=True) |
+            models.Q(dispatched__lt=now - timedelta(seconds=DISPATCH_LEASE_TIMEOUT)),
+            function_instance__status=FunctionInstanceEntity.STATUS[0][0],
+            function_instance__stream__status=StreamEntity.STATUS[1][0])
+
+    @classmethod
+    def running_by_workspace(cls, workspaces) -> Dict[UUID, int]:
+        """
+        Counts the Jobs submitted, or being submitted, of unfinished FunctionInstances.
+        """
+        waiting = cls.objects.filter(dispatched__isnull=True).values('function_instance')
+        rows = FunctionInstanceModel.objects.filter(
+            initialized__isnull=False,
+            status__in=StreamModel.UNFINISHED_FUNCTION_STATUSES,
+            stream__workspace__in=workspaces).exclude(uuid__in=waiting).order_by().values(
+            'stream__workspace').annotate(total=models.Count('uuid'))
+        return {row['stream__workspace']: row['total'] for row in rows}
+
+    @classmethod
+    def lock_workspaces(cls, workspaces) -> List[UUID]:
+        """
+        Locks the rows of the workspaces until the end of the transaction, so that their
+        running Jobs are counted and their entries leased by one drain at a time.
+        """
+        from accounts.models import WorkspaceModel
+        # always locked in the same order, so concurrent drains never deadlock
+        return list(WorkspaceModel.objects.select_for_update().filter(
+            uuid__in=workspaces).order_by('uuid').values_list('uuid', flat=True))
+
+    @classmethod
+    def lease(cls, shares: Dict[UUID, int], now=None) -> List[tuple]:
+        """
+        Leases the oldest available entries of each workspace, as many as its share.
+
+        It returns the entry id, its release time, the FunctionInstance, its stream and its
+        function type (uuid, updated, key) of each leased entry.
+        """
+        now = now or timezone.now()
+        available = cls.available(now).select_for_update(of=('self',), skip_locked=True)
+        leased = []
+        with transaction.atomic():
+            for workspace_id, share in shares.items():
+                leased += available.filter(workspace_id=workspace_id).values_list(
+                    'id', 'released', 'function_instance', 'function_instance__stream',
+                    'function_instance__function_type',
+                    'function_instance__function_type__updated',
+                    'function_instance__function_type__key')[:share]
+            cls.objects.filter(id__in=[entry[0] for entry in leased]).update(dispatched=now)
+        return leased
+
+    @classmethod
+    def purge(cls) -> int:
+        """
+        Deletes the entries of FunctionInstances that are no longer pending.
+        """
+        deleted, _ = cls.objects.exclude(
+            function_instance__status=FunctionInstanceEntity.STATUS[0][0]).delete()
+        return deleted
+
+    @classmethod
+    def stats(cls, workspaces, now=None) -> Dict[str, dict]:
+        """
+        Returns the queue depth, the wait of the oldest entry (in seconds) and the Jobs
+        running of each workspace, with its limits.
+        """
+        now = now or timezone.now()
+        workspace_ids = list(workspaces.values_list('pk', flat=True))
+        queued = {row['workspace']: row for row in cls.objects.filter(
+            workspace__in=workspace_ids, dispatched__isnull=True).order_by().values(
+            'workspace').annotate(queued=models.Count('id'), oldest=models.Min('enqueued'))}
+        running = cls.running_by_workspace(workspace_ids)
+        stats = {}
+        for workspace_id in workspace_ids:
+            row = queued.get(workspace_id)
+            stats[str(workspace_id)] = {
+                'queued': row['queued'] if row else 0,
+                'oldest_wait': (now - row['oldest']).total_seconds() if row else 0.0,
+                'running': running.get(workspace_id, 0),
+                'max_running': cls.max_running(workspace_id),
+                'weight': cls.weight(workspace_id),
+            }
+        return stats
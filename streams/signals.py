@@ -0,0 +1,76 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from accounts.models import WorkspaceModel
+from .models import FunctionTypeModel, StreamModel, FunctionInstanceModel, VariableModel, \
+    VariableBlobModel, StatusCountModel, FunctionInstanceTransitionModel
+
+
+@receiver(pre_delete, sender=StreamModel)
+def release_stream_variable_blobs(sender, instance, **kwargs):
+    """
+    Releases the shared payloads of the variables deleted by CASCADE with a single UPDATE,
+    so that they are still fast deleted.
+    """
+    VariableBlobModel.release_variables(
+        VariableModel.objects.filter(function_instance__stream=instance))
+
+
+@receiver(pre_delete, sender=StreamModel)
+def count_deleted_stream_function_instances(sender, instance, **kwargs):
+    """
+    Removes the function instances deleted by CASCADE from the workspace status counts
+    with a single UPDATE, from the counters of the stream, so that they are fast deleted.
+    """
+    counters = StreamModel.objects.filter(uuid=instance.uuid).values(
+        *StreamModel.FUNCTION_COUNTERS.values()).first()
+    if counters:
+        StatusCountModel.remove(
+            instance.workspace_id, StatusCountModel.FUNCTION_INSTANCE,
+            {status: counters[counter]
+             for status, counter in StreamModel.FUNCTION_COUNTERS.items()})
+
+
+@receiver(pre_delete, sender=FunctionTypeModel)
+def release_function_type_variable_blobs(sender, instance, **kwargs):
+    VariableBlobModel.release_variables(
+        VariableModel.objects.filter(function_instance__function_type=instance))
+
+
+@receiver(pre_delete, sender=FunctionTypeModel)
+def count_deleted_function_type_instances(sender, instance, **kwargs):
+    StreamModel.count_deleted_functions(instance.instances.all())
+
+
+@receiver(post_save, sender=FunctionInstanceModel)
+def count_created_function_instance(sender, instance, created, raw, **kwargs):
+    """
+    Logs and counts new function instances in their stream, fixtures are left to the
+    'reconcile_status_counts' command.
+    """
+    if created and not raw:
+        FunctionInstanceTransitionModel.objects.create(
+            function_instance_id=instance.uuid,
+            function_type_id=instance.function_type_id,
+            to_status=instance.status,
+            created=instance.created)
+        StreamModel.count_function_change(instance.stream_id, None, instance.status)
+
+
+@receiver(post_save, sender=StreamModel)
+def count_created_stream(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        StatusCountModel.bump(instance.workspace_id, StatusCountModel.STREAM,
+                              None, instance.status)
+
+
+@receiver(post_delete, sender=StreamModel)
+def count_deleted_stream(sender, instance, **kwargs):
+    StatusCountModel.bump(instance.workspace_id, StatusCountModel.STREAM,
+                          instance.status, None)
+
+
+@receiver(post_save, sender=WorkspaceModel)
+def create_workspace_status_counts(sender, instance, created, **kwargs):
+    if created:
+        StatusCountModel.create_for_workspaces([instance])
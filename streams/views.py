@@ -1,18 +1,21 @@
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Count
 from django.views.generic import TemplateView
 from common.utils import ModelManager
 
 
 @login_required
 def dashboard_view(request):
+    totals = ModelManager.get_model('streams', 'StatusCount').totals(
+        request.user.workspaces.all())
     ctx = dict()
-    ctx['streams_status_counts'] = ModelManager.handle(
-        'streams.Stream', 'all').values('status').annotate(total=Count('status'))
-    ctx['functions_status_counts'] = ModelManager.handle(
-        'streams.FunctionInstance', 'all').values('status').annotate(total=Count('status'))
+    ctx['streams_status_counts'] = [
+        {'status': status, 'total': total}
+        for status, total in totals['stream'].items()]
+    ctx['functions_status_counts'] = [
+        {'status': status, 'total': total}
+        for status, total in totals['function_instance'].items()]
 
     return render(request,
                   template_name='streams/dashboard.html',
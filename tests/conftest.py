@@ -1,8 +1,10 @@
 from datetime import datetime
 from django.core.management import call_command
 import glob
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import json
 import os
+import threading
 from uuid import uuid4
 
 from faker import Faker
@@ -30,21 +32,18 @@ def function_config():
 @pytest.fixture(scope='session', autouse=True)
 def django_db_setup(django_db_setup, django_db_blocker, function_config):
     with django_db_blocker.unblock():
-        # the initial test DB is populated with json fixtures and
-        # fake model instances baked by model_bakery.
-        accounts_fixtures = glob.glob(os.path.join(
-            FIXTURES_DIR, 'dev', 'accounts', '*.json'))
-        call_command('loaddata', *accounts_fixtures)
+        _load_fixtures(function_config)
 
-        streams_fixtures = glob.glob(os.path.join(
-            FIXTURES_DIR, 'dev', 'streams', '*.json'))
-        call_command('loaddata', *streams_fixtures)
 
-        common_fixtures = glob.glob(os.path.join(
-            FIXTURES_DIR, 'common', '*.json'))
-        call_command('loaddata', *common_fixtures)
-
-        _bake_fixtures(function_config)
+@pytest.fixture
+def committed_db(django_db_blocker, function_config):
+    """
+    Loads the initial test DB again after a test using 'transactional_db', requested
+    after this fixture, flushed it, e.g. to commit from several threads.
+    """
+    yield
+    with django_db_blocker.unblock():
+        _load_fixtures(function_config)
 
 
 @pytest.fixture(scope='session')
@@ -64,6 +63,80 @@ def k8s_resources():
     return resources
 
 
+class FakeAPIServer(ThreadingHTTPServer):
+    """
+    Local HTTP/1.1 server standing in for a remote API.
+
+    It answers the scripted (status, body) responses in order, then 201 echoing the
+    request body, and records every request with the client port that sent it.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeAPIRequestHandler)
+        self.requests = []
+        self.responses = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % self.server_address
+
+
+class FakeAPIRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._respond(b'')
+
+    def do_POST(self):
+        self._respond(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+    def _respond(self, body):
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path, self.client_address[1], body))
+            status, body = self.server.responses.pop(0) if self.server.responses else (201, body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fake_api_server():
+    server = FakeAPIServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _load_fixtures(function_config):
+    # the initial test DB is populated with json fixtures and
+    # fake model instances baked by model_bakery.
+    accounts_fixtures = glob.glob(os.path.join(
+        FIXTURES_DIR, 'dev', 'accounts', '*.json'))
+    call_command('loaddata', *accounts_fixtures)
+
+    streams_fixtures = glob.glob(os.path.join(
+        FIXTURES_DIR, 'dev', 'streams', '*.json'))
+    call_command('loaddata', *streams_fixtures)
+
+    common_fixtures = glob.glob(os.path.join(
+        FIXTURES_DIR, 'common', '*.json'))
+    call_command('loaddata', *common_fixtures)
+
+    _bake_fixtures(function_config)
+
+    # fixtures are loaded raw, without maintaining the counters
+    call_command('reconcile_status_counts')
+
+
 def _bake_fixtures(function_config):
     bs_account = baker.make(
         'accounts.AccountModel',
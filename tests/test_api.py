@@ -0,0 +1,311 @@
+import asyncio
+import io
+import json
+import os
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import pytest
+from uuid import uuid4
+from rest_framework.exceptions import ParseError
+
+from api.events import StreamEventsApplication
+from api.pagination import count_rows, keyset_page
+from api.serializers.streams import StreamSerializer, FunctionInstanceSerializer, \
+    VariableSerializer
+from common.codecs import CODEC_STATS
+from common.pubsub import LocalPubSubBackend
+from common.utils import ModelManager
+from settings import RESOURCES_DIR, SCALADE_VERSION
+from streams import events
+from streams.models import StreamModel, FunctionInstanceModel, VariableModel, \
+    FunctionInstanceLogMessageModel
+
+
+class TestKeysetPagination:
+    @pytest.mark.django_db
+    def test_pages_match_offsets(self):
+        st = ModelManager.handle('streams.stream', 'all')[0]
+        StreamModel.objects.bulk_create([
+            StreamModel(name=f'Stream{index}', workspace=st.workspace, account=st.account)
+            for index in range(7)])
+        # ties on 'created' are broken by the uuid
+        StreamModel.objects.filter(name__in=['Stream2', 'Stream3', 'Stream4']).update(
+            created=timezone.now())
+        queryset = StreamModel.objects.order_by('-created', 'uuid')
+        expected = list(queryset.values_list('uuid', flat=True))
+
+        pages, cursor = [], ''
+        while cursor is not None:
+            items, cursor, prev = keyset_page(StreamModel.objects.all(), 3, cursor)
+            assert (prev is None) == (not pages)
+            pages.append([item.uuid for item in items])
+        assert sum(pages, []) == expected
+
+        items, _, prev = keyset_page(StreamModel.objects.all(), 3, prev)
+        assert [item.uuid for item in items] == pages[-2]
+
+    @pytest.mark.django_db
+    def test_pages_are_read_from_the_ordering_index(self):
+        if connection.vendor != 'postgresql':
+            pytest.skip('query plans are only checked on PostgreSQL')
+        _, cursor, _ = keyset_page(StreamModel.objects.all(), 1)
+        with CaptureQueriesContext(connection) as queries:
+            keyset_page(StreamModel.objects.all(), 1, cursor)
+        with connection.cursor() as db_cursor:
+            # the test tables are too small for the planner to prefer an index otherwise
+            db_cursor.execute('SET LOCAL enable_seqscan = off')
+            db_cursor.execute(f"EXPLAIN {queries[-1]['sql']}")
+            plan = '\n'.join(row[0] for row in db_cursor.fetchall())
+        assert 'streams_created_idx' in plan
+        assert 'Sort' not in plan
+        # the scan starts at the cursor instead of filtering every row before it
+        assert [line for line in plan.splitlines()
+                if 'Index Cond' in line and 'created <=' in line]
+
+    @pytest.mark.django_db
+    def test_invalid_cursor(self):
+        with pytest.raises(ParseError):
+            keyset_page(StreamModel.objects.all(), 3, 'not-a-cursor')
+
+
+class TestCountRows:
+    @pytest.mark.django_db
+    def test_modes(self, monkeypatch):
+        queryset = StreamModel.objects.all()
+        total = len(queryset)
+        assert count_rows(queryset, 'exact') == total
+        assert count_rows(queryset, 'none') is None
+        monkeypatch.setattr('api.pagination.LIST_COUNT_ESTIMATE_CAP', 1)
+        assert count_rows(queryset, 'estimated') == min(total, 1)
+        with pytest.raises(ParseError):
+            count_rows(queryset, 'approximate')
+
+
+class TestAccountViewSet:
+    @pytest.mark.django_db
+    def test_accounts_of_a_workspace_without_any(self, client):
+        account = ModelManager.handle('accounts.account', 'all')[0]
+        account.is_superuser = True
+        account.save()
+        client.force_login(account)
+        workspace = ModelManager.handle('accounts.workspace', 'all')[0]
+        empty_workspace = ModelManager.handle(
+            'accounts.workspace', 'create', name='no-accounts', business=workspace.business)
+        # the master account of the business is added to new workspaces
+        empty_workspace.accountmodel_set.clear()
+
+        response = client.get(f'/api/v{SCALADE_VERSION[0]}/entities/accounts/',
+                              {'related_to_workspace': str(empty_workspace.uuid)})
+        assert response.status_code == 200
+        assert response.json()['data'] == []
+        assert response.json()['total_queryset'] == 0
+
+
+class TestStreamSerializer:
+    @pytest.mark.django_db
+    def test_detail_queries(self, django_assert_num_queries):
+        st = ModelManager.handle('streams.stream', 'all')[0]
+        fi = st.functions.all()[0]
+        for index in range(20):
+            FunctionInstanceModel.objects.create(
+                function_type=fi.function_type, stream=st,
+                position=f'{{"row": {index}, "col": 1}}')
+        VariableModel.objects.bulk_create([
+            VariableModel(iot='input', id_name=f'var{rank}', type='text', bytes=b'value',
+                          function_instance=fi, rank=rank)
+            for rank in (2, 0, 1)])
+
+        with django_assert_num_queries(3):
+            data = StreamSerializer(StreamModel.objects.get_detail(uuid=st.uuid)).data
+        assert len(data['functions']) == st.functions.count()
+        function = [fc for fc in data['functions'] if fc['uuid'] == str(fi.uuid)][0]
+        ranks = [ipt['__rank__'] for ipt in function['inputs']]
+        assert ranks == sorted(ranks)
+
+    @pytest.mark.django_db
+    def test_function_inputs_ordered_without_prefetch(self):
+        fi = ModelManager.handle('streams.stream', 'all')[0].functions.all()[0]
+        VariableModel.objects.bulk_create([
+            VariableModel(iot='input', id_name=f'var{rank}', type='text', bytes=b'value',
+                          function_instance=fi, rank=rank)
+            for rank in (2, 0, 1)])
+
+        data = FunctionInstanceSerializer(FunctionInstanceModel.objects.get(uuid=fi.uuid)).data
+        ranks = [ipt['__rank__'] for ipt in data['inputs']]
+        assert ranks == sorted(ranks)
+
+
+class TestSparseFieldsets:
+    def test_columns(self):
+        serializer = FunctionInstanceSerializer(fields={'uuid', 'status', 'inputs'})
+        assert set(serializer.fields) == {'uuid', 'status', 'inputs'}
+        assert serializer.columns() == ['status', 'uuid']
+        assert 'position' not in FunctionInstanceSerializer(omit={'position'}).fields
+        with pytest.raises(ParseError):
+            FunctionInstanceSerializer(fields={'payload'})
+
+    def test_expand(self):
+        assert 'bytes' not in VariableSerializer().columns()
+        serializer = VariableSerializer(context={'expand': {'bytes'}})
+        assert {'bytes', 'blob_ref', 'codec'} <= set(serializer.columns())
+
+    @pytest.mark.django_db
+    def test_payloads_are_deferred(self):
+        variable = ModelManager.handle('streams.variable', 'all')[0]
+        st = variable.function_instance.stream
+        stream = StreamModel.objects.get_detail(
+            uuid=st.uuid, variable_columns=VariableSerializer().columns())
+        variables = [var_ for fi in stream.functions.all() for var_ in fi.context_variables]
+        assert variable.uuid in [var_.uuid for var_ in variables]
+        assert all('bytes' in var_.get_deferred_fields() for var_ in variables)
+
+        data = StreamSerializer(stream).data
+        assert all('bytes' not in ipt for fc in data['functions'] for ipt in fc['inputs'])
+
+    @pytest.mark.django_db
+    def test_variables_link_their_body(self):
+        variable = ModelManager.handle('streams.variable', 'all')[0]
+        data = VariableSerializer(variable).data
+        assert data['body_url'].endswith(f'/variables/{variable.uuid}/body/')
+        assert data['size'] == variable.size
+        assert 'bytes' not in data
+
+
+class TestRuntimeAPI:
+    URL = f'/api/v{SCALADE_VERSION[0]}/runtime/'
+
+    @pytest.fixture
+    def fi(self, monkeypatch):
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        monkeypatch.setattr('common.utils.parse_bearer_token', lambda header: header.split()[-1])
+        monkeypatch.setattr('common.utils._resolve_runtime_token', lambda token: ({}, fi))
+        return fi
+
+    @pytest.mark.django_db
+    def test_create_fi_log_message_batch(self, client, fi, monkeypatch):
+        with open(os.path.join(RESOURCES_DIR, 'api', 'runtime',
+                               'create_fi_log_message_batch.json')) as file:
+            batch = json.load(file)
+        url = self.URL + 'create-fi-log-message-batch/'
+
+        response = client.post(url, batch, content_type='application/json',
+                               HTTP_AUTHORIZATION='Bearer token')
+        assert response.status_code == 200
+        assert len(response.json()['fi_log_messages']) == len(batch)
+        assert FunctionInstanceLogMessageModel.objects.filter(
+            function_instance=fi, uuid__in=response.json()['fi_log_messages']).count() == 2
+
+        response = client.post(url, batch[0], content_type='application/json',
+                               HTTP_AUTHORIZATION='Bearer token')
+        assert response.status_code == 400
+        assert 'array' in response.json()['detail']
+
+        monkeypatch.setattr('api.views.runtime.RUNTIME_LOG_BATCH_MAX_SIZE', len(batch) - 1)
+        response = client.post(url, batch, content_type='application/json',
+                               HTTP_AUTHORIZATION='Bearer token')
+        assert response.status_code == 400
+        assert 'maximum batch size' in response.json()['detail']
+
+    @pytest.mark.django_db
+    def test_stream_fi_logs_chunked(self, client, fi):
+        body = (b'{"log_message": "first chunked message"}\n'
+                b'not json\n'
+                b'{"log_message": "second chunked message", "log_level": "debug"}\n')
+        # a chunked upload has no Content-Length, the server dechunks the input
+        response = client.post(self.URL + 'stream-fi-logs/', content_type='application/x-ndjson',
+                               HTTP_AUTHORIZATION='Bearer token', CONTENT_LENGTH='',
+                               **{'wsgi.input': io.BytesIO(body), 'wsgi.input_terminated': True})
+        assert response.status_code == 200
+        assert response.json()['created'] == 2
+        assert response.json()['rejected'] == 1
+        assert FunctionInstanceLogMessageModel.objects.filter(
+            function_instance=fi, log_message__endswith='chunked message').count() == 2
+
+        response = client.post(self.URL + 'stream-fi-logs/', content_type='application/x-ndjson',
+                               HTTP_AUTHORIZATION='Bearer token', CONTENT_LENGTH='',
+                               **{'wsgi.input': io.BytesIO(body)})
+        assert response.status_code == 411
+
+    @pytest.mark.django_db
+    def test_stats(self, client):
+        account = ModelManager.handle('accounts.account', 'all')[0]
+        assert client.get(self.URL + 'stats/').status_code == 403
+        account.is_staff = True
+        account.save()
+        client.force_login(account)
+        response = client.get(self.URL + 'stats/')
+        assert response.status_code == 200
+        assert {'hits', 'misses', 'evictions'} <= set(response.json()['token_cache'])
+        assert response.json()['codecs'] == CODEC_STATS.snapshot()
+        assert {'samples', 'over_target', 'p50', 'p99'} <= set(
+            response.json()['dispatch_latency'])
+
+
+class TestStreamEventsApplication:
+    @staticmethod
+    def run(scope, until):
+        """
+        Serves the scope until the response bodies sent satisfy 'until'.
+        """
+        sent = []
+
+        async def fallback(scope, receive, send):
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+
+        async def send(message):
+            sent.append(message)
+
+        async def receive():
+            while not until([message['body'] for message in sent[1:]]):
+                await asyncio.sleep(0.01)
+            return {'type': 'http.disconnect'}
+
+        async def serve():
+            await asyncio.wait_for(StreamEventsApplication(fallback)(scope, receive, send), 5)
+
+        asyncio.run(serve())
+        return sent
+
+    @staticmethod
+    def scope(stream_uuid, method='GET', headers=()):
+        return {'type': 'http', 'method': method, 'headers': list(headers),
+                'path': f'/api/v{SCALADE_VERSION[0]}/entities/streams/{stream_uuid}/events/'}
+
+    def test_rejects_other_methods(self):
+        sent = self.run(self.scope(uuid4(), method='POST'), lambda bodies: True)
+        assert sent[0]['status'] == 405
+
+        sent = self.run({'type': 'http', 'method': 'GET', 'path': '/api/', 'headers': []},
+                        lambda bodies: True)
+        assert sent == [{'type': 'http.response.start', 'status': 200, 'headers': []}]
+
+    def test_resumes_from_last_event_id(self, committed_db, transactional_db, monkeypatch):
+        backend = LocalPubSubBackend()
+        monkeypatch.setattr('api.events.get_pubsub', lambda: backend)
+        monkeypatch.setattr('streams.events.get_pubsub', lambda: backend)
+        monkeypatch.setattr('api.events._authorize', lambda session_key, stream_uuid: 200)
+        stream = ModelManager.handle('streams.stream', 'all')[0]
+        first, missed = [events.record_change(stream.uuid, events.FI_STATUS, {'status': status})
+                         for status in ('running', 'completed')]
+        channel = events.stream_channel(stream.uuid)
+
+        published = []
+
+        def until(bodies):
+            if len(bodies) == 1 and not published:
+                # the first one was replayed already
+                published.append(missed.as_dict)
+                published.append({'seq': missed.seq + 1, 'type': events.FI_STATUS})
+                for event in published:
+                    backend.publish(channel, event)
+            return len(bodies) >= 2
+
+        sent = self.run(self.scope(stream.uuid, headers=[
+            (b'last-event-id', str(first.seq).encode())]), until)
+        assert sent[0]['status'] == 200
+        bodies = [message['body'] for message in sent[1:]]
+        assert bodies[0].startswith(f'id: {missed.seq}\nevent: {events.FI_STATUS}\n'.encode())
+        assert bodies[1].startswith(f'id: {missed.seq + 1}\n'.encode())
+        assert len(bodies) == 2
@@ -1,11 +1,24 @@
+import asyncio
+import hashlib
+import io
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
 import pytest
 from uuid import uuid4
 
 import requests_mock
+from scaladecore.entities import FunctionInstanceEntity
 
-from common.contracts import HttpClient
+from common import codecs, utils
+from common.cache import TTLCache
+from common.contracts import HttpClient, LogPreview
+from common.pubsub import LocalPubSubBackend
 from common.api import KubernetesHttpClient, KubernetesAPI
-from common.utils import ModelManager
+from common.storage import LocalBlobStorage, S3BlobStorage
+from common.utils import ModelManager, iter_batches, iter_ndjson, parse_byte_range, iter_file_range
 from streams.models import FunctionTypeModel, FunctionInstanceModel, VariableModel
 
 
@@ -26,6 +39,25 @@ class TestKubernetesHttpClient:
         client = KubernetesHttpClient.new()
         assert issubclass(client.__class__, HttpClient)
 
+    def test_reuses_connections(self, fake_api_server):
+        client = KubernetesHttpClient.new(server_url=fake_api_server.url)
+        for _ in range(3):
+            assert client.get('v1/namespaces').status_code == 201
+
+        assert len({port for _, _, port, _ in fake_api_server.requests}) == 1
+
+    def test_retries_throttled_and_failed_calls(self, fake_api_server):
+        fake_api_server.responses = [(429, b'{}'), (503, b'{}')]
+        client = KubernetesHttpClient.new(server_url=fake_api_server.url, backoff_factor=0)
+        response = client.post('batch/v1/namespaces/default/jobs', json={'kind': 'Job'})
+
+        assert response.status_code == 201
+        assert len(fake_api_server.requests) == 3
+
+    def test_log_preview(self):
+        assert str(LogPreview(b'{"kind": "Job"}', max_size=6)) == '{"kind...'
+        assert str(LogPreview({'kind': 'Job'}, max_size=64)) == "{'kind': 'Job'}"
+
 
 class TestKubernetesAPI:
     @pytest.mark.usefixtures('k8s_api')
@@ -36,7 +68,7 @@ class TestKubernetesAPI:
         assert k8s_api.client == k8s_api_2.client
 
     @pytest.mark.usefixtures('k8s_api')
-    @pytest.mark.usefixture('k8s_resources')
+    @pytest.mark.usefixtures('k8s_resources')
     def test_create(self, k8s_api, k8s_resources):
         job_config = k8s_resources['job']
         with requests_mock.Mocker() as mocker:
@@ -45,7 +77,7 @@ class TestKubernetesAPI:
                         status_code=200)
             k8s_api.create('job', job_config)
 
-    @pytest.mark.usefixture('k8s_resources')
+    @pytest.mark.usefixtures('k8s_resources')
     @pytest.mark.usefixtures('k8s_api')
     def test_create_job(self, k8s_resources, k8s_api):
         job_config = {**k8s_resources['job']}
@@ -59,6 +91,23 @@ class TestKubernetesAPI:
         response = k8s_api.create('job', job_config)
         assert response.status_code == 201
 
+    @pytest.mark.usefixtures('k8s_api')
+    @pytest.mark.usefixtures('k8s_resources')
+    def test_create_many(self, k8s_api, k8s_resources, fake_api_server, monkeypatch):
+        client = KubernetesHttpClient.new(server_url=fake_api_server.url, pool_size=4)
+        monkeypatch.setattr(k8s_api, '_client', client)
+        configs = []
+        for number in range(10):
+            job_config = {**k8s_resources['job'],
+                          'metadata': {'name': f'fake-function-{number}'}}
+            configs.append(job_config)
+
+        responses = k8s_api.create_many('job', configs)
+        assert [resp.status_code for resp in responses] == [201] * 10
+        assert [resp.json()['metadata']['name'] for resp in responses] == [
+            config['metadata']['name'] for config in configs]
+        assert len({port for _, _, port, _ in fake_api_server.requests}) <= 4
+
     @pytest.mark.usefixtures('k8s_api')
     def test_retrieve(self, k8s_api):
         pass
@@ -70,3 +119,230 @@ class TestKubernetesAPI:
     @pytest.mark.usefixtures('k8s_api')
     def test_delete(self, k8s_api):
         pass
+
+
+class TestNDJSONUtils:
+    def test_iter_batches(self):
+        batches = list(iter_batches(range(7), 3))
+        assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+    def test_iter_ndjson(self):
+        stream = io.BytesIO(b'{"log_message": "first"}\n'
+                            b'\n'
+                            b'not json\n'
+                            b'[1, 2]\n'
+                            b'{"log_message": "%s"}\n'
+                            b'{"log_message": "last"}' % (b'x' * 64))
+        parsed = list(iter_ndjson(stream, max_line_size=32))
+
+        assert parsed[0] == (1, {'log_message': 'first'}, None)
+        assert [line for line, record, _ in parsed if record is None] == [3, 4, 5]
+        assert parsed[-1] == (6, {'log_message': 'last'}, None)
+
+
+class TestByteRanges:
+    def test_parse_byte_range(self):
+        assert parse_byte_range('bytes=0-9', 100) == (0, 9)
+        assert parse_byte_range('bytes=90-', 100) == (90, 99)
+        assert parse_byte_range('bytes=-10', 100) == (90, 99)
+        assert parse_byte_range('bytes=90-200', 100) == (90, 99)
+        # multiple or invalid ranges are ignored
+        assert parse_byte_range('bytes=0-1,5-6', 100) is None
+        assert parse_byte_range('bytes=9-0', 100) is None
+        assert parse_byte_range('lines=0-9', 100) is None
+        with pytest.raises(ValueError):
+            parse_byte_range('bytes=100-', 100)
+
+    def test_iter_file_range(self):
+        file = io.BytesIO(b'0123456789')
+        assert b''.join(iter_file_range(file, 3, 4, chunk_size=3)) == b'3456'
+        assert file.closed
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache:
+    def test_get_and_set(self):
+        cache = TTLCache(maxsize=10, ttl=5)
+        assert cache.get('key') is None
+        cache.set('key', 'value')
+        assert cache.get('key') == 'value'
+        assert cache.stats['hits'] == 1
+        assert cache.stats['misses'] == 1
+
+    def test_expiration(self):
+        timer = FakeTimer()
+        cache = TTLCache(maxsize=10, ttl=5, timer=timer)
+        cache.set('key', 'value')
+        cache.set('short', 'value', ttl=1)
+        timer.now = 2
+        assert cache.get('short') is None
+        assert cache.get('key') == 'value'
+        timer.now = 5
+        assert cache.get('key') is None
+        assert len(cache) == 0
+
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=5)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert cache.stats['evictions'] == 1
+
+
+class TestRuntimeTokens:
+    @pytest.mark.django_db
+    def test_status_is_read_fresh(self, monkeypatch):
+        canceled = FunctionInstanceEntity.STATUS[-2][0]
+        fi = FunctionInstanceModel.objects.exclude(status=canceled)[0]
+        decoded = []
+
+        def decode(token):
+            decoded.append(token)
+            return {'fi_uuid': str(fi.uuid)}
+
+        monkeypatch.setattr('common.utils.decode_scalade_token', decode)
+        monkeypatch.setattr('common.utils.RUNTIME_TOKEN_CACHE', TTLCache(maxsize=10, ttl=30))
+        _, cached_fi = utils._resolve_runtime_token('runtime-token')
+        assert cached_fi.status == fi.status
+
+        FunctionInstanceModel.objects.filter(uuid=fi.uuid).update(status=canceled)
+        _, cached_fi = utils._resolve_runtime_token('runtime-token')
+        assert decoded == ['runtime-token']
+        assert cached_fi.status == canceled
+        assert utils.RUNTIME_TOKEN_CACHE.stats['hits'] == 1
+
+
+class TestLocalBlobStorage:
+    def test_save_and_read(self, tmp_path):
+        storage = LocalBlobStorage(tmp_path)
+        content = b'fake payload'
+        key = hashlib.sha256(content).hexdigest()
+
+        ref = storage.save(key, content)
+        assert storage.exists(ref)
+        assert storage.read(ref) == content
+        # saving the same content again is a no-op
+        assert storage.save(key, content) == ref
+
+        storage.delete(ref)
+        assert not storage.exists(ref)
+
+
+class FakeStreamingBody:
+    def __init__(self, content: bytes):
+        self._content = io.BytesIO(content)
+        self.closed = False
+
+    def read(self, amt=None):
+        return self._content.read(amt)
+
+    def close(self):
+        self.closed = True
+
+
+class TestS3BlobStorage:
+    def test_open(self, monkeypatch):
+        content = b'fake s3 payload' * 1000
+        body = FakeStreamingBody(content)
+        client = SimpleNamespace(get_object=lambda Bucket, Key: {'Body': body})
+        monkeypatch.setitem(sys.modules, 'boto3',
+                            SimpleNamespace(client=lambda service, **kwargs: client))
+        storage = S3BlobStorage('bucket', prefix='variables/')
+
+        with storage.open('key') as file:
+            assert not file.seekable()
+            assert file.read(4) == content[:4]
+            assert file.read() == content[4:]
+        assert body.closed
+
+
+class TestCodecs:
+    def test_compress_when_it_pays_off(self):
+        content = b'{"name": "foo", "value": "bar"}' * 100
+        codec, encoded = codecs.compress(content, codecs.ZLIB, min_size=64, min_ratio=0.9,
+                                         variable_type='json')
+        assert codec == codecs.ZLIB
+        assert len(encoded) < len(content)
+        assert codecs.decode(encoded, codec) == content
+        assert codecs.CODEC_STATS.snapshot()['json']['kept'] >= 1
+
+    def test_skip_compression(self):
+        small = b'tiny'
+        assert codecs.compress(small, codecs.ZLIB, 64, 0.9) == (codecs.IDENTITY, small)
+
+        random_content = os.urandom(4096)
+        codec, encoded = codecs.compress(random_content, codecs.LZMA, 64, 0.9)
+        assert codec == codecs.IDENTITY
+        assert encoded == random_content
+
+    def test_open_decoded(self):
+        content = b'fake line\n' * 10000
+        for codec in (codecs.ZLIB, codecs.LZMA):
+            with codecs.open_decoded(io.BytesIO(codecs.encode(content, codec)), codec) as file:
+                assert file.read() == content
+
+    def test_accepted_content_encoding(self):
+        assert codecs.accepted_content_encoding(codecs.ZLIB, 'gzip, deflate') == 'deflate'
+        assert codecs.accepted_content_encoding(codecs.ZLIB, 'deflate;q=0') is None
+        assert codecs.accepted_content_encoding(codecs.ZLIB, 'gzip') is None
+        assert codecs.accepted_content_encoding(codecs.LZMA, 'deflate') is None
+
+
+class TestLocalPubSubBackend:
+    def test_publish_subscribe(self):
+        backend = LocalPubSubBackend()
+
+        async def consume():
+            subscription = backend.subscribe('streams.a')
+            other = backend.subscribe('streams.b')
+            publisher = threading.Thread(
+                target=lambda: backend.publish('streams.a', {'type': 'fi.status'}))
+            publisher.start()
+            message = await subscription.get(timeout=1)
+            publisher.join()
+            subscription.close()
+            other_message = await other.get(timeout=0.01)
+            other.close()
+            return message, other_message
+
+        message, other_message = asyncio.run(consume())
+        assert message == {'type': 'fi.status'}
+        assert other_message is None
+        assert not backend._subscriptions
+
+    def test_slow_subscriber_drops_oldest(self):
+        backend = LocalPubSubBackend(max_queue_size=2)
+
+        async def consume():
+            subscription = backend.subscribe('streams.a')
+            for index in range(3):
+                backend.publish('streams.a', {'index': index})
+            # deliveries are scheduled in the loop of the subscriber
+            await asyncio.sleep(0)
+            messages = [await subscription.get(timeout=0.01) for _ in range(3)]
+            return messages, subscription.dropped
+
+        messages, dropped = asyncio.run(consume())
+        assert messages == [{'index': 1}, {'index': 2}, None]
+        assert dropped == 1
+
+    def test_wait(self):
+        backend = LocalPubSubBackend()
+        assert not backend.wait('streams.a', 0.01)
+
+        timer = threading.Timer(0.01, backend.publish, ('streams.a', {'type': 'fi.status'}))
+        timer.start()
+        assert backend.wait('streams.a', 1)
+        timer.join()
+        assert not backend._waiters
@@ -1,11 +1,34 @@
+from datetime import timedelta
+import json
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 import pytest
+from uuid import uuid4
 
 from scaladecore.entities import FunctionTypeEntity, StreamEntity, FunctionInstanceEntity, \
     VariableEntity, FunctionInstanceLogMessageEntity
 from scaladecore.variables import Variable
 
+from accounts.models import WorkspaceModel
+from common.exceptions import InconsistentStateChangeError
+from common.storage import LocalBlobStorage
 from common.utils import ModelManager
-from streams.models import VariableModel
+from streams import events
+from streams.application.manifests import FI_UUID_LABEL, JobTemplate, get_job_template
+from streams.application.reconciler import JobReconciler, ReplayJobSource
+from streams.application.handlers import PushedStreamHandler
+from streams.application.scheduler import DISPATCH_CHANNEL, StreamScheduler, \
+    build_dependencies, fair_shares, get_scheduler
+from streams.models import StreamModel, FunctionInstanceModel, VariableModel, VariableBlobModel, \
+    FunctionInstanceLogMessageModel, StatusCountModel, FunctionInstanceTransitionModel, \
+    WatchCheckpointModel, DispatchQueueModel, StreamChangeModel
+from settings import STATUS_COUNTS_SHARDS
 
 
 @pytest.mark.django_db
@@ -41,6 +64,137 @@ class TestStreamModel:
         for st in streams:
             assert isinstance(st.to_entity, StreamEntity)
 
+    @pytest.mark.django_db
+    def test_cancel_many(self, django_assert_max_num_queries):
+        stream_cancelled = StreamEntity.STATUS[-2][0]
+        fi_cancelled = FunctionInstanceEntity.STATUS[-2][0]
+        streams = StreamModel.objects.exclude(status=stream_cancelled).filter(
+            functions__isnull=False).distinct()
+        expected = {st.uuid: st.functions.exclude(status=fi_cancelled).count()
+                    for st in streams}
+        assert expected
+        stream_moves = streams.order_by().values_list('workspace', 'status').distinct()
+        function_moves = FunctionInstanceModel.objects.filter(stream__in=expected).exclude(
+            status=fi_cancelled).order_by().values_list('stream__workspace', 'status').distinct()
+
+        # the number of queries doesn't depend on the number of streams or instances, only
+        # on the workspaces and statuses involved: the savepoint and its release, the lock,
+        # the instances read, UPDATE and transitions INSERT, the streams UPDATE, then one
+        # status counts UPDATE by workspace and status moved
+        with django_assert_max_num_queries(7 + len(stream_moves) + len(function_moves)):
+            cancelled, already_cancelled, transitions = StreamModel.cancel_many(
+                StreamModel.objects.filter(uuid__in=expected))
+        assert cancelled == expected
+        assert already_cancelled == []
+        assert len(transitions) == sum(expected.values())
+        assert {status for _, _, status in transitions.values()} == {fi_cancelled}
+        assert not FunctionInstanceModel.objects.filter(
+            stream__in=expected).exclude(status=fi_cancelled).exists()
+
+        cancelled, already_cancelled, transitions = StreamModel.cancel_many(
+            StreamModel.objects.filter(uuid__in=expected))
+        assert cancelled == transitions == {}
+        assert set(already_cancelled) == set(expected)
+
+    @pytest.mark.django_db
+    def test_cancel(self):
+        stream = StreamModel.objects.exclude(status=StreamEntity.STATUS[-2][0]).filter(
+            functions__isnull=False).first()
+        stream.functions.update(status=FunctionInstanceEntity.STATUS[1][0])
+        StreamModel.refresh_function_counters(StreamModel.objects.filter(uuid=stream.uuid))
+        assert stream.cancel() == stream.functions.count()
+        assert stream.status == StreamEntity.STATUS[-2][0]
+
+        stream.refresh_from_db()
+        assert stream.canceled_functions == stream.functions.count()
+        assert stream.running_functions == 0
+
+    def test_cancel_while_updating_status(self, committed_db, transactional_db):
+        running = FunctionInstanceEntity.STATUS[1][0]
+        stream = StreamModel.objects.exclude(status=StreamEntity.STATUS[-2][0]).filter(
+            functions__isnull=False).first()
+        stream.functions.update(status=running)
+        StreamModel.refresh_function_counters(StreamModel.objects.filter(uuid=stream.uuid))
+        fi = stream.functions.all()[0]
+
+        # both lock the stream row first, one waits for the other instead of deadlocking
+        barrier = threading.Barrier(2, timeout=10)
+        errors = []
+
+        def run(func):
+            try:
+                barrier.wait()
+                func()
+            except InconsistentStateChangeError:
+                # the cancel committed first
+                pass
+            except DatabaseError as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(func,)) for func in (
+            lambda: StreamModel.cancel_many(StreamModel.objects.filter(uuid=stream.uuid)),
+            lambda: fi.update_status('complete'))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        stream.refresh_from_db()
+        assert stream.status == StreamEntity.STATUS[-2][0]
+        counters = {counter: getattr(stream, counter)
+                    for counter in StreamModel.FUNCTION_COUNTERS.values()}
+        StreamModel.refresh_function_counters(StreamModel.objects.filter(uuid=stream.uuid))
+        stream.refresh_from_db()
+        assert counters == {counter: getattr(stream, counter)
+                            for counter in StreamModel.FUNCTION_COUNTERS.values()}
+
+    @pytest.mark.django_db
+    def test_finishes_when_last_function_completes(self):
+        running = FunctionInstanceEntity.STATUS[1][0]
+        stream = StreamModel.objects.exclude(status=StreamEntity.STATUS[-2][0]).filter(
+            functions__isnull=False).first()
+        stream.functions.update(status=running)
+        StreamModel.refresh_function_counters(StreamModel.objects.filter(uuid=stream.uuid))
+        instances = list(stream.functions.all())
+
+        for fi in instances:
+            stream.refresh_from_db()
+            assert stream.status != StreamEntity.STATUS[-1][0]
+            fi.update_status('complete')
+
+        stream.refresh_from_db()
+        assert stream.status == StreamEntity.STATUS[-1][0]
+        assert stream.finished is not None
+        assert stream.completed_functions == len(instances)
+        assert stream.running_functions == 0
+
+    @pytest.mark.django_db
+    def test_ends_when_last_function_is_canceled(self):
+        running = FunctionInstanceEntity.STATUS[1][0]
+        canceled = FunctionInstanceEntity.STATUS[-2][0]
+        st = ModelManager.handle('streams.stream', 'all')[0]
+        for to_status, expected in ((FunctionInstanceEntity.STATUS[-1][0],
+                                     StreamEntity.STATUS[-1][0]),
+                                    (canceled, StreamEntity.STATUS[-2][0])):
+            stream = StreamModel.objects.create(name='Ending', workspace=st.workspace,
+                                                account=st.account,
+                                                status=StreamEntity.STATUS[1][0])
+            first, second = [FunctionInstanceModel.objects.create(
+                function_type=st.functions.all()[0].function_type, stream=stream,
+                status=running, position=json.dumps({'row': row, 'col': 0}))
+                for row in range(2)]
+            FunctionInstanceModel.transition_many({first.uuid: to_status})
+            stream.refresh_from_db()
+            assert stream.status == StreamEntity.STATUS[1][0]
+            # the last unfinished instance is canceled, not completed
+            FunctionInstanceModel.transition_many({second.uuid: canceled})
+            stream.refresh_from_db()
+            assert stream.status == expected
+            assert (stream.finished is not None) == (expected == StreamEntity.STATUS[-1][0])
+
 
 class TestFunctionInstanceModel:
     @pytest.mark.django_db
@@ -49,6 +203,72 @@ class TestFunctionInstanceModel:
         for fi in instances:
             assert isinstance(fi.to_entity, FunctionInstanceEntity)
 
+    @pytest.mark.django_db
+    def test_get_context_num_queries(self, django_assert_num_queries):
+        fi_uuid = ModelManager.handle('streams.functioninstance', 'all')[0].uuid
+        with django_assert_num_queries(2):
+            fi = ModelManager.handle('streams.functioninstance', 'get_context', uuid=fi_uuid)
+            assert isinstance(fi.to_entity, FunctionInstanceEntity)
+            variables = [var_.to_entity for var_ in fi.context_variables]
+
+        assert len(variables) > 0
+        ranks = [var_.rank for var_ in fi.context_variables]
+        assert ranks == sorted(ranks)
+
+    @pytest.mark.django_db
+    def test_update_status_compare_and_swap(self, django_assert_max_num_queries):
+        running, completed = FunctionInstanceEntity.STATUS[1][0], FunctionInstanceEntity.STATUS[-1][0]
+        fi_uuid = ModelManager.handle('streams.functioninstance', 'all')[0].uuid
+        FunctionInstanceModel.objects.filter(uuid=fi_uuid).update(status=running)
+        fi = FunctionInstanceModel.objects.get(uuid=fi_uuid)
+        stale_fi = FunctionInstanceModel.objects.get(uuid=fi_uuid)
+        StreamModel.refresh_function_counters(StreamModel.objects.filter(uuid=fi.stream_id))
+
+        # the stream lock, the status UPDATE, the transition INSERT, the stream and
+        # workspace counters UPDATEs and the stream finishing check, plus the finishing
+        # UPDATEs when it is the last instance.
+        with django_assert_max_num_queries(8) as captured:
+            fi.update_status('complete')
+        assert fi.status == completed
+        assert fi.completed == fi.updated
+        # the status is compared and swapped by a single UPDATE, without reading it first
+        assert self.count_status_updates(captured) == 1
+        assert not [query for query in captured.captured_queries
+                    if query['sql'].startswith('SELECT')
+                    and 'FROM "function_instances"' in query['sql']]
+
+        # the stale instance still believes it is running, the transition loses
+        with CaptureQueriesContext(connection) as captured:
+            with pytest.raises(InconsistentStateChangeError) as exc_info:
+                stale_fi.update_status('block')
+        assert self.count_status_updates(captured) == 1
+        assert exc_info.value.current_status == completed
+        assert FunctionInstanceModel.objects.get(uuid=fi_uuid).status == completed
+
+    @staticmethod
+    def count_status_updates(captured) -> int:
+        return sum(query['sql'].startswith('UPDATE "function_instances"')
+                   for query in captured.captured_queries)
+
+    @pytest.mark.django_db
+    def test_stale_instances_never_log_transitions(self):
+        running = FunctionInstanceEntity.STATUS[1][0]
+        fi_uuid = ModelManager.handle('streams.functioninstance', 'all')[0].uuid
+        entered = timezone.now() - timedelta(minutes=5)
+        FunctionInstanceModel.objects.filter(uuid=fi_uuid).update(status=running,
+                                                                 updated=entered)
+        stale_fi = FunctionInstanceModel.objects.get(uuid=fi_uuid)
+        # the status was entered again since the stale instance was loaded
+        reentered = timezone.now()
+        FunctionInstanceModel.objects.filter(uuid=fi_uuid).update(updated=reentered)
+        with pytest.raises(InconsistentStateChangeError):
+            stale_fi.update_status('complete')
+
+        fi = FunctionInstanceModel.objects.get(uuid=fi_uuid)
+        fi.update_status('complete')
+        transition = fi.transitions.get(from_status=running)
+        assert transition.elapsed == fi.updated - reentered
+
 
 class TestVariableModel:
     @pytest.mark.django_db
@@ -66,6 +286,127 @@ class TestVariableModel:
         assert var_orm.to_entity
         assert var_orm.rank >= 0
 
+    @pytest.mark.django_db
+    def test_create_output_allocates_consecutive_ranks(self):
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        ranks = []
+        for idx in range(3):
+            output = Variable.create('text', f'output_{idx}', 'fakeValue')
+            var_orm, err_msg = VariableModel.create_output(fi.uuid, output)
+            assert err_msg is None
+            ranks.append(var_orm.rank)
+
+        assert ranks == list(range(ranks[0], ranks[0] + 3))
+        fi.refresh_from_db()
+        assert fi.outputs_count == ranks[-1] + 1
+
+    @pytest.mark.django_db
+    def test_offloads_big_payloads(self, tmp_path, monkeypatch):
+        storage = LocalBlobStorage(tmp_path)
+        monkeypatch.setattr('streams.models.get_blob_storage', lambda: storage)
+        monkeypatch.setattr('streams.models.VARIABLES_BLOB_THRESHOLD', 16)
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        content = b'x' * 64
+
+        variable = VariableModel.objects.create(
+            iot='input', id_name='big_input', type='text', bytes=content,
+            function_instance=fi, rank=0)
+        variable.refresh_from_db()
+
+        assert variable.blob_ref and not variable.bytes
+        assert variable.size == len(content)
+        assert storage.exists(variable.blob_ref)
+        assert variable.read_bytes() == content
+        with variable.open() as file:
+            assert file.read() == content
+
+    @pytest.mark.django_db
+    def test_shares_big_payloads(self, tmp_path, monkeypatch):
+        storage = LocalBlobStorage(tmp_path)
+        monkeypatch.setattr('streams.models.get_blob_storage', lambda: storage)
+        monkeypatch.setattr('streams.models.VARIABLES_BLOB_THRESHOLD', 16)
+        instances = ModelManager.handle('streams.functioninstance', 'all')[:2]
+        content = b'shared payload' * 8
+
+        variables = [VariableModel.objects.create(
+            iot='input', id_name='shared_input', type='text', bytes=content,
+            function_instance=fi, rank=0) for fi in instances]
+        blob = VariableBlobModel.objects.get(checksum=variables[0].checksum)
+        assert blob.ref_count == len(variables)
+        assert len({var_.blob_ref for var_ in variables}) == 1
+
+        variables[0].delete()
+        blob.refresh_from_db()
+        assert blob.ref_count == len(variables) - 1
+        assert storage.exists(blob.checksum)
+
+        variables[1].delete()
+        blob.refresh_from_db()
+        assert blob.ref_count == 0 and blob.released
+        assert storage.exists(blob.checksum)
+        assert VariableBlobModel.collect(grace=3600) == (0, 0)
+
+        # acquiring a released blob revives it
+        variable = VariableModel.objects.create(
+            iot='input', id_name='shared_input', type='text', bytes=content,
+            function_instance=instances[0], rank=0)
+        blob.refresh_from_db()
+        assert (blob.ref_count, blob.released) == (1, None)
+        variable.function_instance.stream.delete()
+        blob.refresh_from_db()
+        assert blob.ref_count == 0
+
+        orphan = storage.save('0' * 64, b'written by a rolled back transaction')
+        assert VariableBlobModel.collect(grace=0) == (1, 1)
+        assert not VariableBlobModel.objects.filter(checksum=blob.checksum).exists()
+        assert not storage.exists(blob.checksum)
+        assert not storage.exists(orphan)
+
+    @pytest.mark.django_db
+    def test_function_type_deletions_release_payloads(self, tmp_path, monkeypatch):
+        storage = LocalBlobStorage(tmp_path)
+        monkeypatch.setattr('streams.models.get_blob_storage', lambda: storage)
+        monkeypatch.setattr('streams.models.VARIABLES_BLOB_THRESHOLD', 16)
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        variable = VariableModel.objects.create(
+            iot='input', id_name='big_input', type='text', bytes=b'offloaded payload' * 8,
+            function_instance=fi, rank=0)
+        assert variable.blob_ref
+
+        fi.function_type.delete()
+        blob = VariableBlobModel.objects.get(checksum=variable.checksum)
+        assert blob.ref_count == 0 and blob.released
+        assert VariableBlobModel.collect(grace=0) == (1, 0)
+        assert not storage.exists(variable.blob_ref)
+
+    @pytest.mark.django_db
+    def test_compresses_payloads(self, monkeypatch):
+        monkeypatch.setattr('streams.models.VARIABLES_COMPRESSION_MIN_SIZE', 64)
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        content = b'My name is Foo and I love Bars. ' * 32
+
+        variable = VariableModel.objects.create(
+            iot='input', id_name='text_input', type='text', bytes=content,
+            function_instance=fi, rank=0)
+        variable = ModelManager.handle('streams.variable', 'get', uuid=variable.uuid)
+
+        assert variable.codec == 'zlib'
+        assert variable.size == len(content)
+        assert len(variable.read_stored_bytes()) < len(content)
+        assert variable.read_bytes() == content
+        assert variable.to_entity.bytes == content
+
+        # saving it again doesn't encode the stored payload twice
+        variable.save()
+        assert variable.read_bytes() == content
+
+    @pytest.mark.django_db
+    def test_create_output_without_instance(self):
+        output = Variable.create('text', 'output_1', 'fakeValue')
+        var_orm, err_msg = VariableModel.create_output(uuid4(), output)
+        assert var_orm is None
+        assert err_msg
+
 
 class TestFunctionInstanceLogMessageModel:
     @pytest.mark.django_db
@@ -75,3 +416,520 @@ class TestFunctionInstanceLogMessageModel:
             'all')
         for lm in log_messages:
             assert isinstance(lm.to_entity, FunctionInstanceLogMessageEntity)
+
+    @pytest.mark.django_db
+    def test_create_batch(self, django_assert_num_queries):
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        entries = [{'log_message': f'batch message {idx}', 'log_level': 'info'}
+                   for idx in range(5)]
+        with django_assert_num_queries(1):
+            log_messages = FunctionInstanceLogMessageModel.create_batch(fi, entries)
+
+        assert [lm.log_message for lm in log_messages] == [
+            entry['log_message'] for entry in entries]
+        stored = ModelManager.handle(
+            'streams.FunctionInstanceLogMessageModel',
+            'filter',
+            uuid__in=[lm.uuid for lm in log_messages])
+        assert len(stored) == len(entries)
+
+
+class FakePubSubBackend:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+
+
+class TestStreamChangeModel:
+    @pytest.mark.django_db
+    def test_change_feed(self, monkeypatch):
+        backend = FakePubSubBackend()
+        monkeypatch.setattr('streams.events.transaction.on_commit', lambda func: func())
+        monkeypatch.setattr('streams.events.get_pubsub', lambda: backend)
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        changes, has_more = events.wait_for_changes(fi.stream_id, 0, 0, 10)
+        since = changes[-1].seq if changes else 0
+
+        events.publish_fi_status(fi)
+        output = Variable.create('text', 'output_1', 'fakeValue')
+        variable, _ = VariableModel.create_output(fi.uuid, output)
+        events.publish_fi_output(fi, variable)
+
+        changes, has_more = events.wait_for_changes(fi.stream_id, since, 0, 1)
+        assert [change.type for change in changes] == [events.FI_STATUS]
+        assert has_more
+        changes, has_more = events.wait_for_changes(fi.stream_id, changes[-1].seq, 0, 10)
+        assert [change.type for change in changes] == [events.FI_OUTPUT]
+        assert changes[0].as_dict['data']['rank'] == variable.rank
+        assert not has_more
+
+        assert [channel for channel, _ in backend.published] == [
+            events.stream_channel(fi.stream_id)] * 2
+        assert backend.published[-1][1]['seq'] == changes[0].seq
+
+    @pytest.mark.django_db
+    def test_purge(self, monkeypatch):
+        monkeypatch.setattr('streams.events.transaction.on_commit', lambda func: func())
+        monkeypatch.setattr('streams.events.get_pubsub', lambda: FakePubSubBackend())
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        old_change = events.record_change(fi.stream_id, events.FI_STATUS, {'status': 'old'})
+        new_change = events.record_change(fi.stream_id, events.FI_STATUS, {'status': 'new'})
+        StreamChangeModel.objects.filter(seq=old_change.seq).update(
+            created=timezone.now() - timedelta(days=30))
+
+        assert StreamChangeModel.purge(timezone.now() - timedelta(days=7), batch_size=1) >= 1
+        seqs = set(StreamChangeModel.objects.values_list('seq', flat=True))
+        assert old_change.seq not in seqs
+        assert new_change.seq in seqs
+
+    @pytest.mark.django_db
+    def test_streams_cancelled_feed(self, monkeypatch):
+        monkeypatch.setattr('streams.events.transaction.on_commit', lambda func: func())
+        monkeypatch.setattr('streams.events.get_pubsub', lambda: FakePubSubBackend())
+        stream = StreamModel.objects.exclude(status=StreamEntity.STATUS[-2][0]).filter(
+            functions__isnull=False).first()
+        since = stream.changes.order_by('-seq').values_list('seq', flat=True).first() or 0
+
+        cancelled, _, transitions = StreamModel.cancel_many(
+            StreamModel.objects.filter(uuid=stream.uuid))
+        events.publish_streams_cancelled(cancelled, transitions)
+        changes, _ = events.wait_for_changes(stream.uuid, since, 0, 100)
+        assert [change.type for change in changes] == \
+            [events.STREAM_STATUS] + [events.FI_STATUS] * len(transitions)
+        assert {change.function_instance_id for change in changes[1:]} == set(transitions)
+
+
+class TestStatusCountModel:
+    @staticmethod
+    def count_statuses():
+        counts = {kind: dict.fromkeys(statuses, 0)
+                  for kind, statuses in StatusCountModel.STATUSES.items()}
+        querysets = {StatusCountModel.STREAM: StreamModel.objects.all(),
+                     StatusCountModel.FUNCTION_INSTANCE: FunctionInstanceModel.objects.all()}
+        for kind, queryset in querysets.items():
+            for row in queryset.order_by().values('status').annotate(total=Count('uuid')):
+                counts[kind][row['status']] = row['total']
+        return counts
+
+    @pytest.mark.django_db
+    def test_counts_follow_status_changes(self):
+        workspaces = ModelManager.handle('accounts.workspace', 'all')
+        assert StatusCountModel.totals(workspaces) == self.count_statuses()
+
+        stream = StreamModel.objects.exclude(status=StreamEntity.STATUS[-2][0]).filter(
+            functions__isnull=False).first()
+        stream.functions.update(status=FunctionInstanceEntity.STATUS[1][0])
+        call_command('reconcile_status_counts')
+        assert StatusCountModel.totals(workspaces) == self.count_statuses()
+
+        for fi in stream.functions.all():
+            fi.update_status('complete')
+        assert StatusCountModel.totals(workspaces) == self.count_statuses()
+
+        StreamModel.cancel_many(StreamModel.objects.all())
+        assert StatusCountModel.totals(workspaces) == self.count_statuses()
+
+    @pytest.mark.django_db
+    def test_bumps_are_spread_over_shards(self, monkeypatch):
+        workspace = ModelManager.handle('accounts.workspace', 'all')[0]
+        pending = FunctionInstanceEntity.STATUS[0][0]
+        before = StatusCountModel.totals([workspace])[StatusCountModel.FUNCTION_INSTANCE]
+        shards = iter(range(4))
+        monkeypatch.setattr(StatusCountModel, 'random_shard', staticmethod(lambda: next(shards)))
+        for _ in range(4):
+            StatusCountModel.bump(workspace.pk, StatusCountModel.FUNCTION_INSTANCE, None, pending)
+
+        totals = StatusCountModel.totals([workspace])[StatusCountModel.FUNCTION_INSTANCE]
+        assert totals[pending] == before[pending] + 4
+        rows = workspace.status_counts.filter(
+            kind=StatusCountModel.FUNCTION_INSTANCE, status=pending)
+        assert rows.count() == STATUS_COUNTS_SHARDS
+        assert rows.filter(shard__in=range(1, 4)).values_list('total', flat=True).distinct() \
+            .get() == 1
+
+        call_command('reconcile_status_counts')
+        assert StatusCountModel.totals([workspace])[StatusCountModel.FUNCTION_INSTANCE] == before
+        assert not rows.exclude(shard=0).exclude(total=0).exists()
+
+    @pytest.mark.django_db
+    def test_counts_follow_deletions(self, django_assert_max_num_queries):
+        workspaces = ModelManager.handle('accounts.workspace', 'all')
+        stream = StreamModel.objects.filter(functions__isnull=False).first()
+        for row in range(20):
+            FunctionInstanceModel.objects.create(
+                function_type=stream.functions.all()[0].function_type, stream=stream,
+                position=json.dumps({'row': row, 'col': 9}))
+        fi = stream.functions.all()[0]
+        fi.delete()
+        stream.refresh_from_db()
+        assert stream.pending_functions + stream.running_functions + \
+            stream.blocked_functions + stream.canceled_functions + \
+            stream.completed_functions == stream.functions.count()
+        assert StatusCountModel.totals(workspaces) == self.count_statuses()
+
+        # the function instances are fast deleted, whatever their number
+        with django_assert_max_num_queries(25):
+            stream.delete()
+        assert StatusCountModel.totals(workspaces) == self.count_statuses()
+
+        function_type = FunctionInstanceModel.objects.first().function_type
+        function_type.delete()
+        assert StatusCountModel.totals(workspaces) == self.count_statuses()
+
+
+class TestFunctionInstanceTransitionModel:
+    @pytest.mark.django_db
+    def test_logs_transitions(self):
+        running, blocked = FunctionInstanceEntity.STATUS[1][0], FunctionInstanceEntity.STATUS[2][0]
+        fi_uuid = ModelManager.handle('streams.functioninstance', 'all')[0].uuid
+        FunctionInstanceModel.objects.filter(uuid=fi_uuid).update(status=running)
+        fi = FunctionInstanceModel.objects.get(uuid=fi_uuid)
+        entered = fi.updated
+
+        fi.update_status('block')
+        transition = fi.transitions.last()
+        assert (transition.from_status, transition.to_status) == (running, blocked)
+        assert transition.function_type_id == fi.function_type_id
+        assert transition.created == fi.updated
+        assert transition.elapsed == fi.updated - entered
+
+    @pytest.mark.django_db
+    def test_time_in_status_percentiles(self):
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        now = timezone.now()
+        FunctionInstanceTransitionModel.objects.bulk_create([
+            FunctionInstanceTransitionModel(
+                function_instance=fi, function_type_id=fi.function_type_id,
+                from_status=FunctionInstanceEntity.STATUS[1][0],
+                to_status=FunctionInstanceEntity.STATUS[-1][0],
+                created=now, elapsed=timedelta(seconds=seconds))
+            for seconds in range(1, 11)])
+
+        metrics = ModelManager.handle(
+            'streams.functioninstancetransition',
+            'time_in_status_percentiles',
+            since=now - timedelta(hours=1),
+            until=now + timedelta(hours=1),
+            percentiles=[50, 90], )
+        run_time = metrics[str(fi.function_type_id)]['run_time']
+        assert run_time['count'] == 10
+        assert run_time['p50'] == pytest.approx(5.5)
+        assert run_time['p90'] == pytest.approx(9.1)
+
+
+class TestStreamScheduler:
+    @pytest.mark.django_db
+    def test_dispatches_released_instances(self):
+        running = FunctionInstanceEntity.STATUS[1][0]
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        stream = StreamModel.objects.create(name='DAGStream', workspace=fi.stream.workspace,
+                                            account=fi.stream.account,
+                                            status=StreamEntity.STATUS[1][0])
+        first, second, last = [
+            FunctionInstanceModel.objects.create(
+                function_type=fi.function_type, stream=stream,
+                position=json.dumps({'row': row, 'col': col}))
+            for row, col in ((0, 0), (1, 0), (0, 1))]
+
+        manifests = []
+        scheduler = StreamScheduler(dispatch=manifests.append, max_workers=2)
+        assert set(scheduler.schedule(stream.uuid)) == {first.uuid, second.uuid}
+        assert scheduler.schedule(stream.uuid) == []
+        manifests = [mf.as_dict() for mf in manifests]
+        assert {mf['metadata']['labels'][FI_UUID_LABEL] for mf in manifests} == {
+            str(first.uuid), str(second.uuid)}
+        assert manifests[0]['spec']['template']['spec']['containers'][0]['image'] == (
+            fi.function_type.key)
+
+        stream.functions.filter(uuid__in=[first.uuid, second.uuid]).update(status=running)
+        StreamModel.refresh_function_counters(StreamModel.objects.filter(uuid=stream.uuid))
+        first.refresh_from_db()
+        first.update_status('complete')
+        assert scheduler.release(stream.uuid) == []
+
+        second.refresh_from_db()
+        second.update_status('complete')
+        assert scheduler.release(stream.uuid) == [last.uuid]
+        assert len(manifests) == 3
+        # only the instances with upstream ones are released
+        assert len(scheduler.latency) == 1
+        assert scheduler.latency.over_target == 0
+
+    @pytest.mark.django_db
+    def test_drains_record_the_latency_since_release(self):
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        stream = StreamModel.objects.create(name='DAGStream', workspace=fi.stream.workspace,
+                                            account=fi.stream.account,
+                                            status=StreamEntity.STATUS[1][0])
+        upstream, downstream = [
+            FunctionInstanceModel.objects.create(
+                function_type=fi.function_type, stream=stream,
+                position=json.dumps({'row': 0, 'col': col}))
+            for col in range(2)]
+        completed = timezone.now() - timedelta(seconds=3)
+        FunctionInstanceModel.objects.filter(uuid=upstream.uuid).update(
+            status=FunctionInstanceEntity.STATUS[-1][0], completed=completed)
+
+        # queued by the requests, submitted by the drain_dispatch_queue processes
+        assert StreamScheduler.enqueue(stream.uuid) == [downstream.uuid]
+        assert DispatchQueueModel.objects.get(function_instance=downstream).released == completed
+        scheduler = StreamScheduler(dispatch=lambda manifest: None)
+        assert scheduler.drain() == [downstream.uuid]
+        stats = scheduler.latency.stats
+        assert stats['samples'] == 1
+        assert stats['p50'] >= 3
+        assert stats['over_target'] == 1
+
+    @pytest.mark.django_db
+    def test_failed_dispatches_are_retried(self):
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        stream = StreamModel.objects.create(name='DAGStream', workspace=fi.stream.workspace,
+                                            account=fi.stream.account,
+                                            status=StreamEntity.STATUS[1][0])
+        instance = FunctionInstanceModel.objects.create(
+            function_type=fi.function_type, stream=stream,
+            position=json.dumps({'row': 0, 'col': 0}))
+
+        def failing_dispatch(manifest):
+            raise ConnectionError
+
+        assert StreamScheduler(dispatch=failing_dispatch).schedule(stream.uuid) == []
+        entry = DispatchQueueModel.objects.get(function_instance=instance)
+        assert entry.dispatched is None
+        assert StreamScheduler(dispatch=lambda manifest: None).drain() == [instance.uuid]
+        assert not DispatchQueueModel.objects.filter(function_instance=instance).exists()
+
+    @pytest.mark.django_db
+    def test_releases_only_queue_instances(self, monkeypatch):
+        backend = FakePubSubBackend()
+        monkeypatch.setattr('streams.application.scheduler.get_pubsub', lambda: backend)
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        stream = StreamModel.objects.create(name='DAGStream', workspace=fi.stream.workspace,
+                                            account=fi.stream.account,
+                                            status=StreamEntity.STATUS[1][0])
+        instance = FunctionInstanceModel.objects.create(
+            function_type=fi.function_type, stream=stream,
+            position=json.dumps({'row': 0, 'col': 0}))
+
+        stream.status = StreamEntity.STATUS[2][0]
+        stream.save()
+        assert PushedStreamHandler.handle(stream.uuid) == []
+        stream.status = StreamEntity.STATUS[1][0]
+        stream.save()
+        assert PushedStreamHandler.handle(stream.uuid) == [instance.uuid]
+        assert DispatchQueueModel.objects.get(function_instance=instance).dispatched is None
+        assert backend.published == [
+            (DISPATCH_CHANNEL, {'stream': str(stream.uuid), 'queued': 1})]
+
+        def failing_enqueue(stream_uuid):
+            raise DatabaseError
+
+        monkeypatch.setattr(StreamScheduler, '_enqueue_ready', staticmethod(failing_enqueue))
+        assert PushedStreamHandler.release(instance) == []
+
+    def test_scheduler_requires_a_token_issuer(self, monkeypatch):
+        monkeypatch.setattr('streams.application.scheduler.SCHEDULER_RUNTIME_TOKEN_ISSUER', None)
+        get_scheduler.cache_clear()
+        with pytest.raises(ImproperlyConfigured):
+            get_scheduler()
+
+    def test_dependencies_follow_the_columns(self):
+        first, second, third, fourth = [uuid4() for _ in range(4)]
+        dependencies = build_dependencies({first: (0, 0), second: (1, 0), third: (0, 2),
+                                           fourth: (3, 5)})
+        # every row of the preceding column, gaps between columns are skipped
+        assert dependencies == {first: set(), second: set(), third: {first, second},
+                                fourth: {third}}
+
+    def test_fair_shares(self):
+        queued = {'a': 10, 'b': 10}
+        caps = {'a': 100, 'b': 100}
+        assert fair_shares(queued, {'a': 4}, caps, {'a': 1, 'b': 1}, 6) == {'a': 1, 'b': 5}
+        assert fair_shares(queued, {}, caps, {'a': 2, 'b': 1}, 6) == {'a': 4, 'b': 2}
+        assert fair_shares(queued, {}, {'a': 1, 'b': 100}, {'a': 1, 'b': 1}, 6) == {
+            'a': 1, 'b': 5}
+        assert fair_shares({'a': 2}, {}, caps, {'a': 1}, 6) == {'a': 2}
+
+    @pytest.mark.django_db
+    def test_workspaces_are_capped(self, monkeypatch):
+        monkeypatch.setattr('streams.models.DISPATCH_MAX_RUNNING_PER_WORKSPACE', 2)
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        streams = []
+        for name, size in (('tenant-a', 5), ('tenant-b', 2)):
+            workspace = WorkspaceModel.objects.create(
+                name=name, business=fi.stream.workspace.business)
+            stream = StreamModel.objects.create(name='DAGStream', workspace=workspace,
+                                                account=fi.stream.account,
+                                                status=StreamEntity.STATUS[1][0])
+            FunctionInstanceModel.objects.bulk_create([
+                FunctionInstanceModel(function_type=fi.function_type, stream=stream,
+                                      position=json.dumps({'row': row, 'col': 0}))
+                for row in range(size)])
+            streams.append(stream)
+        first, second = streams
+
+        scheduler = StreamScheduler(dispatch=lambda manifest: None)
+        assert len(scheduler.schedule(first.uuid)) == 2
+        assert len(scheduler.schedule(second.uuid)) == 2
+        assert scheduler.drain() == []
+
+        stats = DispatchQueueModel.stats(WorkspaceModel.objects.filter(
+            uuid__in=[first.workspace_id, second.workspace_id]))
+        assert stats[str(first.workspace_id)]['queued'] == 3
+        assert stats[str(first.workspace_id)]['running'] == 2
+        assert stats[str(second.workspace_id)]['queued'] == 0
+
+        running = first.functions.filter(initialized__isnull=False).first()
+        FunctionInstanceModel.transition_many({running.uuid: FunctionInstanceEntity.STATUS[-2][0]})
+        assert len(scheduler.drain()) == 1
+
+    def test_concurrent_drains_share_the_caps(self, committed_db, transactional_db, monkeypatch):
+        monkeypatch.setattr('streams.models.DISPATCH_MAX_RUNNING_PER_WORKSPACE', 2)
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        workspace = WorkspaceModel.objects.create(
+            name='tenant-c', business=fi.stream.workspace.business)
+        stream = StreamModel.objects.create(name='DAGStream', workspace=workspace,
+                                            account=fi.stream.account,
+                                            status=StreamEntity.STATUS[1][0])
+        FunctionInstanceModel.objects.bulk_create([
+            FunctionInstanceModel(function_type=fi.function_type, stream=stream,
+                                  position=json.dumps({'row': row, 'col': 0}))
+            for row in range(5)])
+        StreamScheduler._enqueue_ready(stream.uuid)
+
+        # both drains count the queued entries before either of them locks the workspace
+        barrier = threading.Barrier(2, timeout=10)
+        lock_workspaces = DispatchQueueModel.lock_workspaces
+
+        def wait_and_lock(workspaces):
+            barrier.wait()
+            return lock_workspaces(workspaces)
+
+        monkeypatch.setattr(DispatchQueueModel, 'lock_workspaces', wait_and_lock)
+        results = []
+
+        def drain():
+            try:
+                results.append(StreamScheduler(dispatch=lambda manifest: None).drain())
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=drain) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(results) == 2
+        assert len(sum(results, [])) == 2
+        assert DispatchQueueModel.objects.filter(workspace=workspace).count() == 3
+
+
+class TestJobTemplate:
+    def test_render(self):
+        fi_uuid, stream_uuid = uuid4(), uuid4()
+        template = JobTemplate('account/function:latest', resources={'limits': {'cpu': '1'}})
+        manifest = template.render(fi_uuid, stream_uuid, token='a"token')
+
+        job = manifest.as_dict()
+        assert manifest.name == job['metadata']['name'] == f'fi-{fi_uuid.hex}'
+        assert job['metadata']['labels'] == {FI_UUID_LABEL: str(fi_uuid),
+                                             'scalade.io/stream-uuid': str(stream_uuid)}
+        container = job['spec']['template']['spec']['containers'][0]
+        assert container['image'] == 'account/function:latest'
+        assert container['env'] == [
+            {'name': 'SCALADE_FI_UUID', 'value': str(fi_uuid)},
+            {'name': 'SCALADE_RUNTIME_TOKEN', 'value': 'a"token'}]
+        assert container['resources'] == {'limits': {'cpu': '1'}}
+
+        container = template.render(fi_uuid, stream_uuid, resources={}).as_dict()[
+            'spec']['template']['spec']['containers'][0]
+        assert len(container['env']) == 1
+        assert container['resources'] == {}
+
+    def test_templates_are_cached_by_function_type_version(self):
+        ft_uuid, updated = uuid4(), timezone.now()
+        template = get_job_template(ft_uuid, updated, 'account/function:latest')
+        assert get_job_template(ft_uuid, updated, 'account/function:latest') is template
+        assert get_job_template(ft_uuid, updated + timedelta(seconds=1),
+                                'account/function:v2') is not template
+
+
+def job_event(type_, fi_uuid, resource_version, condition=None, active=0):
+    return {'type': type_, 'object': {
+        'metadata': {'name': f'fi-{fi_uuid.hex}',
+                     'labels': {FI_UUID_LABEL: str(fi_uuid)},
+                     'resourceVersion': resource_version},
+        'status': {'active': active,
+                   'conditions': [{'type': condition, 'status': 'True'}] if condition else []},
+    }}
+
+
+class TestJobReconciler:
+    @staticmethod
+    def create_stream(total):
+        fi = ModelManager.handle('streams.functioninstance', 'all')[0]
+        stream = StreamModel.objects.create(name='WatchedStream', workspace=fi.stream.workspace,
+                                            account=fi.stream.account,
+                                            status=StreamEntity.STATUS[1][0])
+        return stream, [FunctionInstanceModel.objects.create(
+            function_type=fi.function_type, stream=stream,
+            position=json.dumps({'row': row, 'col': 0})) for row in range(total)]
+
+    @pytest.mark.django_db
+    def test_applies_watched_statuses(self, monkeypatch):
+        monkeypatch.setattr('streams.events.transaction.on_commit', lambda func: func())
+        monkeypatch.setattr('streams.events.get_pubsub', lambda: FakePubSubBackend())
+        stream, (first, second, third) = self.create_stream(3)
+        source = ReplayJobSource([
+            job_event('ADDED', first.uuid, '11', active=1),
+            job_event('ADDED', second.uuid, '12', active=1),
+            job_event('MODIFIED', first.uuid, '13', condition='Complete'),
+            job_event('MODIFIED', second.uuid, '14', condition='Failed'),
+            job_event('ADDED', third.uuid, '15', active=1),
+            {'type': 'BOOKMARK', 'object': {'metadata': {'resourceVersion': '20'}}},
+        ], resource_version='10')
+        reconciler = JobReconciler(source, batch_size=2, flush_interval=0.05,
+                                   checkpoint='test.jobs',
+                                   scheduler=StreamScheduler(dispatch=lambda manifest: None))
+
+        assert reconciler.reconcile_once() == '20'
+        statuses = dict(stream.functions.values_list('uuid', 'status'))
+        assert statuses == {first.uuid: FunctionInstanceEntity.STATUS[-1][0],
+                            second.uuid: FunctionInstanceEntity.STATUS[-2][0],
+                            third.uuid: FunctionInstanceEntity.STATUS[1][0]}
+        assert WatchCheckpointModel.load('test.jobs') == '20'
+        assert reconciler.stats['relists'] == 1
+        # the first batch moved the first two instances to running
+        assert stream.changes.filter(type=events.FI_STATUS).count() == 5
+
+        stream.refresh_from_db()
+        assert (stream.completed_functions, stream.canceled_functions,
+                stream.running_functions) == (1, 1, 1)
+        first_transitions = first.transitions.values_list('from_status', 'to_status')
+        assert list(first_transitions) == [
+            (None, FunctionInstanceEntity.STATUS[0][0]),
+            (FunctionInstanceEntity.STATUS[0][0], FunctionInstanceEntity.STATUS[1][0]),
+            (FunctionInstanceEntity.STATUS[1][0], FunctionInstanceEntity.STATUS[-1][0])]
+
+    @pytest.mark.django_db
+    def test_relists_when_resource_version_expires(self, monkeypatch):
+        monkeypatch.setattr('streams.events.transaction.on_commit', lambda func: func())
+        monkeypatch.setattr('streams.events.get_pubsub', lambda: FakePubSubBackend())
+        stream, (instance,) = self.create_stream(1)
+        WatchCheckpointModel.store('test.jobs', '5')
+        completed = job_event('ADDED', instance.uuid, '30', condition='Complete')['object']
+        source = ReplayJobSource([{'type': 'ERROR', 'object': {'code': 410}}],
+                                 items=[completed], resource_version='30')
+        reconciler = JobReconciler(source, flush_interval=0.05, checkpoint='test.jobs',
+                                   scheduler=StreamScheduler(dispatch=lambda manifest: None))
+
+        assert reconciler.reconcile_once() is None
+        assert WatchCheckpointModel.load('test.jobs') is None
+        assert reconciler.reconcile_once() == '30'
+        instance.refresh_from_db()
+        assert instance.status == FunctionInstanceEntity.STATUS[-1][0]
+        stream.refresh_from_db()
+        assert stream.status == StreamEntity.STATUS[-1][0]